@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+CryptoRisk Analytics - Anomaly Rules
+Cross-field, statistical and calendar rule types for validate_and_clean_data,
+evaluated over whole (symbol x date) panels in grouped array passes.
+
+Rule types (keys besides name / type / action):
+    expression    'expression': pandas eval string that must hold, e.g. 'high >= low'.
+                  'min_run': only count violations in runs of at least this many
+                  consecutive rows per symbol (e.g. zero-volume streaks).
+    outlier       Rolling score of 'field' per symbol. 'method': 'mad' (median /
+                  scaled MAD, Hampel filter) or 'zscore' (mean / std); 'window',
+                  'center', 'threshold', 'transform' (None, 'log', 'return',
+                  'log_return') and 'min_scale' (floor for the MAD / std).
+    calendar_gap  Dates missing from each symbol's expected calendar ('freq', a
+                  Timedelta string, default '1D') between its first and last row.
+
+Actions:
+    remove        Drop the offending rows
+    clip          Clip 'field' into ['lower', 'upper'] (column names or numbers)
+    interpolate   Replace 'field' by linear interpolation in time over the symbol's
+                  other rows; calendar gaps get the missing rows inserted
+    flag          Keep the rows and set the FLAG_COLUMN boolean column
+
+The panel is ordered by (symbol, date) once per rule with one lexsort; group
+boundaries then make every per-symbol operation (runs, rolling windows,
+interpolation, gaps) a flat array expression. Row order of the input is kept.
+
+Usage:
+    df, issues, message = apply_anomaly_rule(df, rule)
+"""
+
+import warnings
+
+import numpy as np
+import pandas as pd
+
+# Configuration
+FLAG_COLUMN = 'quality_flag'
+CHUNK_ROWS = 262_144            # Rows per block of rolling windows
+MAD_SCALE = 1.4826              # MAD -> standard deviation for normal data
+RULE_TYPES = ('expression', 'outlier', 'calendar_gap')
+ACTIONS = {
+    'expression': ('remove', 'clip', 'interpolate', 'flag'),
+    'outlier': ('remove', 'clip', 'interpolate', 'flag'),
+    'calendar_gap': ('interpolate', 'flag'),
+}
+
+
+def _fields(rule):
+    field = rule.get('field', [])
+    return [field] if isinstance(field, str) else list(field)
+
+
+def grouped_order(df, by='symbol', date_field='date'):
+    """
+    Sort permutation of a panel by (group, date) and the group bounds of every sorted row.
+
+    Returns:
+        dict with order (permutation), codes, times (int64 ns) in sorted order, and
+        start / end (first row and one past the last row of each row's group)
+    """
+    codes = pd.factorize(df[by])[0]
+    times = pd.to_datetime(df[date_field]).to_numpy(dtype='datetime64[ns]').view('i8')
+    order = np.lexsort((times, codes))
+    codes, times = codes[order], times[order]
+    n = len(order)
+    first = np.ones(n, dtype=bool)
+    first[1:] = codes[1:] != codes[:-1]
+    starts = np.flatnonzero(first)
+    ends = np.append(starts[1:], n)
+    sizes = np.diff(np.append(starts, n))
+    return {'order': order, 'codes': codes, 'times': times,
+            'start': np.repeat(starts, sizes), 'end': np.repeat(ends, sizes)}
+
+
+def run_lengths(mask, start):
+    """Length of the run of consecutive True values (within a group) that each sorted row belongs to."""
+    n = len(mask)
+    if n == 0:
+        return np.zeros(0, dtype=int)
+    boundary = np.ones(n, dtype=bool)
+    boundary[1:] = (mask[1:] != mask[:-1]) | (start[1:] != start[:-1])
+    run_id = np.cumsum(boundary) - 1
+    return np.bincount(run_id)[run_id]
+
+
+def _row_nanmedian(values):
+    """Median of each row ignoring NaN (NaN where a row has no values); sorts instead of np.nanmedian."""
+    ordered = np.sort(values, axis=1)
+    count = (~np.isnan(ordered)).sum(axis=1)
+    low = np.take_along_axis(ordered, np.maximum((count - 1) // 2, 0)[:, None], axis=1)[:, 0]
+    high = np.take_along_axis(ordered, np.maximum(count // 2, 0)[:, None], axis=1)[:, 0]
+    return np.where(count > 0, (low + high) / 2, np.nan)
+
+
+def rolling_scores(values, start, end, window, method='mad', center=True, min_scale=0.0, chunk_rows=CHUNK_ROWS):
+    """
+    |x - location| / scale over a rolling window within each group.
+
+    Centered windows include the row itself; trailing windows use the previous
+    `window` rows only, so a spike does not inflate its own scale. Windows are
+    copied out of a sliding view in (rows x window) blocks of chunk_rows rows.
+
+    Returns:
+        Scores for the sorted rows (NaN where the window has fewer than window // 2 + 1 values)
+    """
+    n = len(values)
+    offsets = np.arange(window) - window // 2 if center else np.arange(-window, 0)
+
+    # Row i's window is row i of a sliding view over the NaN-padded values; only rows
+    # whose window crosses their group boundary need masking
+    before, after = -offsets[0], max(offsets[-1], 0)
+    padded = np.concatenate([np.full(before, np.nan), values, np.full(after, np.nan)])
+    view = np.lib.stride_tricks.sliding_window_view(padded, window)
+    crosses = (np.arange(n) + offsets[0] < start) | (np.arange(n) + offsets[-1] >= end)
+    scores = np.full(n, np.nan)
+    for first in range(0, n, chunk_rows):
+        last = min(first + chunk_rows, n)
+        windows = view[first:last].copy()
+        edge = np.flatnonzero(crosses[first:last])
+        if len(edge):
+            rows = first + edge
+            positions = rows[:, None] + offsets[None, :]
+            inside = (positions >= start[rows, None]) & (positions < end[rows, None])
+            windows[edge] = np.where(inside, windows[edge], np.nan)
+        rows = slice(first, last)
+        if method == 'mad':
+            location = _row_nanmedian(windows)
+            scale = MAD_SCALE * _row_nanmedian(np.abs(windows - location[:, None]))
+        else:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)     # All-NaN windows
+                location = np.nanmean(windows, axis=1)
+                scale = np.nanstd(windows, axis=1, ddof=1)
+        enough = (~np.isnan(windows)).sum(axis=1) >= window // 2 + 1
+        with np.errstate(invalid='ignore', divide='ignore'):
+            score = np.abs(values[rows] - location) / np.maximum(scale, min_scale)
+        scores[rows] = np.where(enough, score, np.nan)
+    return scores
+
+
+def interpolate_grouped(values, times, start, end):
+    """
+    Fill NaN values of sorted rows by linear interpolation in time within each group.
+
+    Rows before a group's first (or after its last) valid value take the nearest
+    valid value; groups without any valid value stay NaN.
+    """
+    n = len(values)
+    index = np.arange(n)
+    valid = ~np.isnan(values)
+    previous = np.maximum.accumulate(np.where(valid, index, -1))
+    following = np.minimum.accumulate(np.where(valid, index, n)[::-1])[::-1]
+    has_previous = previous >= start
+    has_following = following < end
+    previous, following = np.clip(previous, 0, n - 1), np.clip(following, 0, n - 1)
+
+    span = (times[following] - times[previous]).astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fraction = np.where(span > 0, (times - times[previous]) / span, 0.0)
+    between = values[previous] + fraction * (values[following] - values[previous])
+    filled = np.where(has_previous & has_following, between,
+                      np.where(has_previous, values[previous], np.where(has_following, values[following], np.nan)))
+    return np.where(valid, values, filled)
+
+
+def _transform(values, transform, start):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if transform in ('log', 'log_return'):
+            values = np.log(np.where(values > 0, values, np.nan))
+        if transform in ('return', 'log_return'):
+            previous = np.concatenate([[np.nan], values[:-1]])
+            previous[np.arange(len(values)) == start] = np.nan
+            values = values - previous if transform == 'log_return' else values / previous - 1
+    return values
+
+
+def rule_violations(df, rule, groups):
+    """Boolean mask over the sorted rows of groups that violate an expression or outlier rule."""
+    order = groups['order']
+    if rule['type'] == 'expression':
+        holds = df.eval(rule['expression'])
+        violations = ~np.asarray(holds, dtype=bool)[order]
+        if rule.get('min_run', 1) > 1:
+            violations &= run_lengths(violations, groups['start']) >= rule['min_run']
+        return violations
+
+    field = _fields(rule)[0]
+    values = _transform(df[field].to_numpy(dtype=float)[order], rule.get('transform'), groups['start'])
+    scores = rolling_scores(values, groups['start'], groups['end'], rule.get('window', 7),
+                            rule.get('method', 'mad'), rule.get('center', True), rule.get('min_scale', 0.0))
+    return scores > rule.get('threshold', 6.0)
+
+
+def _fill_calendar_gaps(df, rule, groups, gap_rows, missing, step):
+    """Insert the missing calendar rows and interpolate the rule's fields on them."""
+    by, date_field = rule.get('by', 'symbol'), rule.get('date_field', 'date')
+    order = groups['order']
+    counts = missing[gap_rows]
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+    times = np.repeat(groups['times'][gap_rows - 1], counts) + offsets * step
+    labels = df[by].to_numpy()[order][np.repeat(gap_rows, counts)]
+    inserted = pd.DataFrame({by: labels, date_field: pd.to_datetime(times)})
+    df = pd.concat([df, inserted], ignore_index=True)
+
+    groups = grouped_order(df, by, date_field)
+    df = df.iloc[groups['order']].reset_index(drop=True)
+    for field in _fields(rule) or ['open', 'high', 'low', 'close']:
+        if field in df.columns:
+            df[field] = interpolate_grouped(df[field].to_numpy(dtype=float), groups['times'],
+                                            groups['start'], groups['end'])
+    return df
+
+
+def apply_anomaly_rule(df, rule):
+    """
+    Evaluate one anomaly rule and apply its action.
+
+    Returns:
+        (cleaned DataFrame, number of issues, action summary for the quality report)
+    """
+    rule_type, action = rule['type'], rule.get('action', 'flag')
+    if rule_type not in RULE_TYPES:
+        raise ValueError(f"Unknown anomaly rule type '{rule_type}'. Choose from: {', '.join(RULE_TYPES)}")
+    if action not in ACTIONS[rule_type]:
+        raise ValueError(f"Rule '{rule['name']}': action '{action}' not supported for {rule_type} rules")
+    if action == 'flag' and FLAG_COLUMN not in df.columns:
+        df = df.assign(**{FLAG_COLUMN: False})
+    if len(df) == 0:
+        return df, 0, ''
+
+    by, date_field = rule.get('by', 'symbol'), rule.get('date_field', 'date')
+    groups = grouped_order(df, by, date_field)
+    order = groups['order']
+
+    if rule_type == 'calendar_gap':
+        step = pd.Timedelta(rule.get('freq', '1D')).value
+        missing = np.zeros(len(df), dtype=np.int64)
+        within = groups['start'][1:] != np.arange(1, len(df))
+        missing[1:] = np.where(within, np.diff(groups['times']) // step - 1, 0)
+        missing = np.maximum(missing, 0)
+        issues = int(missing.sum())
+        if issues == 0:
+            return df, 0, ''
+        if action == 'interpolate':
+            gap_rows = np.flatnonzero(missing)
+            return _fill_calendar_gaps(df, rule, groups, gap_rows, missing, step), issues, \
+                f"Inserted {issues} missing dates with interpolated {', '.join(_fields(rule) or ['prices'])}"
+        violations = missing > 0
+    else:
+        violations = rule_violations(df, rule, groups)
+        issues = int(violations.sum())
+        if issues == 0:
+            return df, 0, ''
+
+    # Back to the caller's row order
+    mask = np.zeros(len(df), dtype=bool)
+    mask[order] = violations
+
+    if action == 'remove':
+        return df[~mask], issues, "Removed invalid records"
+
+    df = df.copy()
+    if action == 'flag':
+        df[FLAG_COLUMN] = df[FLAG_COLUMN].to_numpy(dtype=bool) | mask
+        return df, issues, f"Flagged in {FLAG_COLUMN}"
+
+    for field in _fields(rule):
+        values = df[field].to_numpy(dtype=float).copy()
+        if action == 'clip':
+            lower, upper = (df[b].to_numpy(dtype=float) if isinstance(b, str) else b
+                            for b in (rule.get('lower', -np.inf), rule.get('upper', np.inf)))
+            values = np.where(mask, np.clip(values, lower, upper), values)
+        else:
+            # Only the offending rows are replaced; values missing beforehand stay missing
+            sorted_values = np.where(violations, np.nan, values[order])
+            filled = interpolate_grouped(sorted_values, groups['times'], groups['start'], groups['end'])
+            values[order] = np.where(violations, filled, values[order])
+        df[field] = values
+    verb = 'Clipped' if action == 'clip' else 'Interpolated'
+    return df, issues, f"{verb} {', '.join(_fields(rule))}"
@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+"""
+CryptoRisk Analytics - Pipeline Benchmark Suite
+Runs every pipeline stage on synthetic inputs at configurable scale factors
+(symbols, days, portfolios, trades per position) and records wall time, peak
+RSS and rows/sec to a JSON history file. Results are compared against a stored
+baseline to flag regressions.
+
+Fully offline: prices come from the same per-symbol price model as
+generate_crypto_prices_synthetic() (synthetic_generator.symbol_ohlcv), no
+network or yfinance needed. The exit status is nonzero when a stage fails or
+regresses.
+
+Usage:
+    python3 benchmark_pipeline.py --scale small
+    python3 benchmark_pipeline.py --scale medium --stages generate_trades calculate_market_metrics
+    python3 benchmark_pipeline.py --symbols 50 --days 2000 --update-baseline
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import platform
+import queue as queue_module
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import lot_accounting
+import position_ledger
+import prepare_crypto_data as pipeline
+import prepare_crypto_data_with_kpis as kpis
+import price_matrix_store
+from pipeline_instrumentation import current_rss_mb, peak_rss_mb
+from synthetic_generator import symbol_ohlcv
+
+# Configuration
+BENCHMARK_DIR = Path(__file__).parent.parent / "data" / "benchmarks"
+HISTORY_FILE = 'benchmark_history.json'
+BASELINE_FILE = 'benchmark_baseline.json'
+REGRESSION_TOLERANCE = 0.25  # Flag stages more than 25% slower than baseline
+
+SCALES = {
+    'small': {'symbols': 10, 'days': 365, 'portfolios': 3, 'trades_per_position': 5},
+    'medium': {'symbols': 25, 'days': 1500, 'portfolios': 10, 'trades_per_position': 20},
+    'large': {'symbols': 100, 'days': 4000, 'portfolios': 50, 'trades_per_position': 50},
+}
+
+SNAPSHOT_DAYS = 365
+
+
+def make_synthetic_prices(n_symbols, n_days, seed=42):
+    """
+    Synthetic price panel with the pipeline's price schema.
+
+    Each symbol's OHLCV comes from synthetic_generator.symbol_ohlcv(), the model
+    behind generate_crypto_prices_synthetic(), and the derived columns from the
+    pipeline's add_price_metrics(). The first symbols are taken from
+    CRYPTO_UNIVERSE (so hard-coded allocations resolve); extra symbols are named
+    SYN0001, SYN0002, ...
+    """
+    universe = list(pipeline.CRYPTO_UNIVERSE)
+    symbols = universe[:n_symbols] + [f'SYN{i:04d}' for i in range(1, max(0, n_symbols - len(universe)) + 1)]
+    dates = pd.date_range(end=pd.Timestamp.today().normalize(), periods=n_days, freq='D')
+    ohlcv = [symbol_ohlcv(symbol, n_days, seed) for symbol in symbols]
+
+    df = pd.DataFrame({
+        'date': np.tile(dates.values, len(symbols)),
+        'symbol': np.repeat(symbols, n_days),
+        **{field: np.concatenate([o[field] for o in ohlcv]).round(2 if field == 'volume' else 8)
+           for field in ('open', 'high', 'low', 'close', 'volume')},
+    })
+    return pipeline.add_price_metrics(df)
+
+
+def make_synthetic_positions(prices_df, n_portfolios, snapshot_days=SNAPSHOT_DAYS, seed=42):
+    """Daily position snapshots for n_portfolios with random 4-7 asset allocations."""
+    rng = np.random.default_rng(seed)
+    symbols = prices_df['symbol'].unique()
+    dates = np.sort(prices_df['date'].unique())[-snapshot_days:]
+    close = prices_df.pivot(index='date', columns='symbol', values='close').loc[dates]
+    risk_levels = ['Low', 'Medium', 'High']
+
+    frames = []
+    for i in range(n_portfolios):
+        held = rng.choice(symbols, size=min(len(symbols), rng.integers(4, 8)), replace=False)
+        weights = rng.dirichlet(np.ones(len(held))).round(4)
+        total_value = rng.uniform(1e5, 5e5)
+
+        position_value = total_value * weights * rng.uniform(0.95, 1.05, size=(len(dates), len(held)))
+        current_price = close[held].to_numpy()
+        frames.append(pd.DataFrame({
+            'portfolio_id': f'PF{i + 1:03d}',
+            'portfolio_name': f'Portfolio {i + 1}',
+            'risk_tolerance': risk_levels[i % 3],
+            'symbol': np.tile(held, len(dates)),
+            'quantity': (position_value / current_price).ravel().round(8),
+            'avg_cost': (current_price * rng.uniform(0.8, 1.2, size=current_price.shape)).ravel().round(8),
+            'current_price': current_price.ravel().round(8),
+            'position_value': position_value.ravel().round(2),
+            'target_weight': np.tile(weights, len(dates)),
+            'as_of_date': np.repeat(dates, len(held)),
+        }))
+
+    df = pd.concat(frames, ignore_index=True)
+    df['unrealized_pnl'] = (df['current_price'] - df['avg_cost']) * df['quantity']
+    df['unrealized_pnl_pct'] = (df['current_price'] / df['avg_cost'] - 1) * 100
+    return df
+
+
+def make_synthetic_trades(prices_df, positions_df, trades_per_position, seed=42):
+    """
+    Vectorized synthetic trade history with the pipeline's trade schema.
+
+    trades_per_position trades per held (portfolio, symbol), 4 BUYs to 1 SELL,
+    on random dates of the price history at the day's close +/- 5%.
+    """
+    rng = np.random.default_rng(seed)
+    held = positions_df[['portfolio_id', 'portfolio_name', 'symbol', 'quantity']].drop_duplicates(
+        ['portfolio_id', 'symbol'])
+    n = len(held) * trades_per_position
+    rows = held.loc[held.index.repeat(trades_per_position)].reset_index(drop=True)
+
+    closes = prices_df[['date', 'symbol', 'close']]
+    dates = np.sort(closes['date'].unique())
+    rows['trade_date'] = dates[rng.integers(0, len(dates), n)]
+    rows = rows.merge(closes, left_on=['trade_date', 'symbol'], right_on=['date', 'symbol'], how='left')
+
+    quantity = (rows['quantity'] * rng.uniform(0.05, 0.3, n)).round(8)
+    price = (rows['close'] * rng.uniform(0.95, 1.05, n)).round(8)
+    return pd.DataFrame({
+        'trade_id': [f'TRD{i:08d}' for i in range(1, n + 1)],
+        'trade_date': rows['trade_date'],
+        'portfolio_id': rows['portfolio_id'],
+        'portfolio_name': rows['portfolio_name'],
+        'symbol': rows['symbol'],
+        'trade_type': np.where(rng.random(n) < 0.2, 'SELL', 'BUY'),
+        'quantity': quantity,
+        'price': price,
+        'trade_amount': (quantity * price).round(2),
+        'fee': (quantity * price * 0.001).round(2),
+    })
+
+
+def build_dataset(scale):
+    """Build the synthetic inputs shared by all stages for one scale."""
+    prices = make_synthetic_prices(scale['symbols'], scale['days'])
+    positions = make_synthetic_positions(prices, scale['portfolios'], min(SNAPSHOT_DAYS, scale['days']))
+    positions_str = positions.assign(as_of_date=positions['as_of_date'].dt.strftime('%Y-%m-%d'))
+    trades = make_synthetic_trades(prices, positions, scale['trades_per_position'])
+    return {'prices': prices, 'positions': positions, 'positions_str': positions_str, 'trades': trades,
+            'scale': scale}
+
+
+def _latest_positions(data):
+    positions = data['positions_str']
+    return positions[positions['as_of_date'] == positions['as_of_date'].max()]
+
+
+# Stage name -> (function, input builder returning (args, kwargs, rows_in))
+# Builders run in the benchmark process before the timer starts.
+STAGES = {
+    'calculate_bollinger_bands': (
+        pipeline.calculate_bollinger_bands,
+        lambda d: ((d['prices'].copy(),), {}, len(d['prices']))),
+    'validate_and_clean_data': (
+        pipeline.validate_and_clean_data,
+        lambda d: ((d['prices'].copy(), 'Crypto Prices', pipeline.QUALITY_RULES['crypto_prices']), {},
+                   len(d['prices']))),
+    'generate_portfolio_positions': (
+        pipeline.generate_portfolio_positions,
+        lambda d: ((d['prices'].copy(),), {}, len(d['prices']))),
+    'generate_trades': (
+        pipeline.generate_trades,
+        lambda d: ((_latest_positions(d).copy(),),
+                   {'trades_per_position': (d['scale']['trades_per_position'],
+                                            d['scale']['trades_per_position'] + 1)},
+                   len(_latest_positions(d)) * d['scale']['trades_per_position'])),
+    'calculate_market_metrics': (
+        pipeline.calculate_market_metrics,
+        lambda d: ((d['prices'].copy(),), {}, len(d['prices']))),
+    'calculate_portfolio_risk_metrics': (
+        pipeline.calculate_portfolio_risk_metrics,
+        lambda d: ((_latest_positions(d).copy(), d['prices'].copy()), {}, len(d['prices']))),
+    'calculate_correlation_matrix': (
+        pipeline.calculate_correlation_matrix,
+        lambda d: ((d['prices'].copy(),), {'lookback_days': 365}, len(d['prices']))),
+    'calculate_portfolio_volatility_timeseries': (
+        kpis.calculate_portfolio_volatility_timeseries,
+        lambda d: ((d['prices'].copy(), d['positions'].copy()), {}, len(d['prices']))),
+    'calculate_portfolio_var_current': (
+        kpis.calculate_portfolio_var_current,
+        lambda d: ((d['prices'].copy(), d['positions'].copy()), {}, len(d['prices']))),
+    'calculate_portfolio_risk_adjusted_returns': (
+        kpis.calculate_portfolio_risk_adjusted_returns,
+        lambda d: ((d['prices'].copy(), d['positions'].copy(), _quiet(
+            kpis.calculate_portfolio_volatility_timeseries, d['prices'], d['positions'])), {},
+                   len(d['prices']))),
+    'calculate_portfolio_concentration_metrics': (
+        kpis.calculate_portfolio_concentration_metrics,
+        lambda d: ((d['positions'].copy(), d['prices'].copy()), {}, len(d['positions']))),
+    'calculate_portfolio_concentration_history': (
+        kpis.calculate_portfolio_concentration_history,
+        lambda d: ((d['positions'].copy(), d['prices'].copy()), {}, len(d['positions']))),
+    'calculate_portfolio_24h_change': (
+        kpis.calculate_portfolio_24h_change,
+        lambda d: ((d['positions'].copy(),), {}, len(d['positions']))),
+    'calculate_portfolio_drawdown_timeseries': (
+        kpis.calculate_portfolio_drawdown_timeseries,
+        lambda d: ((d['prices'].copy(), d['positions'].copy()), {}, len(d['prices']))),
+    'calculate_rolling_beta_timeseries': (
+        kpis.calculate_rolling_beta_timeseries,
+        lambda d: ((d['prices'].copy(), d['positions'].copy()), {}, len(d['prices']))),
+    'calculate_category_attribution': (
+        kpis.calculate_category_attribution,
+        lambda d: ((d['prices'].copy(), d['positions'].copy(), pd.DataFrame(
+            [{'symbol': symbol, 'category': info['category']} for symbol, info in pipeline.CRYPTO_UNIVERSE.items()])),
+                   {}, len(d['prices']))),
+    'calculate_portfolio_risk_bootstrap': (
+        kpis.calculate_portfolio_risk_bootstrap,
+        lambda d: ((d['prices'].copy(), d['positions'].copy()), {}, len(d['prices']))),
+    'calculate_garch_volatility_forecast': (
+        kpis.calculate_garch_volatility_forecast,
+        lambda d: ((d['prices'].copy(), d['positions'].copy()), {}, len(d['prices']))),
+    'calculate_correlation_clusters': (
+        kpis.calculate_correlation_clusters,
+        lambda d: ((d['prices'].copy(),), {}, len(d['prices']))),
+    'calculate_portfolio_hrp_weights': (
+        kpis.calculate_portfolio_hrp_weights,
+        lambda d: ((d['prices'].copy(), d['positions'].copy()), {}, len(d['positions']))),
+    'calculate_portfolio_liquidity_risk': (
+        kpis.calculate_portfolio_liquidity_risk,
+        lambda d: ((d['prices'].copy(), d['positions'].copy()), {}, len(d['positions']))),
+    'process_trades': (
+        lot_accounting.process_trades,
+        lambda d: ((d['trades'].copy(),), {'workers': 1}, len(d['trades']))),
+    'build_position_ledger': (
+        position_ledger.PositionLedger.from_trades,
+        lambda d: ((d['trades'].copy(), d['prices'].copy()), {}, len(d['trades']))),
+    'align_prices': (
+        price_matrix_store.align_prices,
+        lambda d: ((d['prices'].copy(),), {}, len(d['prices']))),
+}
+
+
+def _quiet(func, *args, **kwargs):
+    """Call a pipeline function with its progress output suppressed."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args, **kwargs)
+
+
+def run_stage(name, data):
+    """Run one stage and measure it. Returns a result dict."""
+    func, build_inputs = STAGES[name]
+    args, kwargs, rows_in = build_inputs(data)
+    rss_before = current_rss_mb()
+
+    start = time.perf_counter()
+    result = _quiet(func, *args, **kwargs)
+    wall_time = time.perf_counter() - start
+
+    peak_rss = peak_rss_mb()
+    return {
+        'stage': name,
+        'wall_time_s': round(wall_time, 4),
+        'peak_rss_mb': round(peak_rss, 1),
+        'peak_rss_delta_mb': round(max(0.0, peak_rss - rss_before), 1),
+        'rows_in': int(rows_in),
+        'rows_out': int(len(result)) if result is not None else 0,
+        'rows_per_sec': round(rows_in / wall_time, 1) if wall_time > 0 else None,
+    }
+
+
+def _run_stage_child(name, data, queue):
+    try:
+        queue.put(run_stage(name, data))
+    except Exception as e:
+        queue.put({'stage': name, 'error': f"{type(e).__name__}: {e}"})
+
+
+def run_isolated(name, data):
+    """
+    Run a stage in a forked child so peak RSS is measured per stage.
+
+    Falls back to in-process execution where fork is unavailable.
+    """
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return run_stage(name, data)
+    ctx = multiprocessing.get_context('fork')
+    queue = ctx.Queue()
+    process = ctx.Process(target=_run_stage_child, args=(name, data, queue))
+    process.start()
+    while True:
+        try:
+            result = queue.get(timeout=1)
+            break
+        except queue_module.Empty:
+            # A child killed by a signal (e.g. the OOM killer) never reports back
+            if not process.is_alive() and queue.empty():
+                result = {'stage': name, 'error': f"Stage process exited with code {process.exitcode}"}
+                break
+    process.join()
+    return result
+
+
+def run_benchmarks(scale, stages=None, isolate=True):
+    """Run the selected stages at one scale and return a run record."""
+    print(f"\n=== Building synthetic inputs: {scale} ===")
+    data = build_dataset(scale)
+    print(f"   {len(data['prices']):,} price rows, {len(data['positions']):,} position rows")
+
+    results = []
+    for name in stages or STAGES:
+        result = run_isolated(name, data) if isolate else run_stage(name, data)
+        results.append(result)
+        if 'error' in result:
+            print(f"   ❌ {name:<45} {result['error'][:60]}")
+        else:
+            print(f"   ✓ {name:<45} {result['wall_time_s']:>9.3f}s "
+                  f"{result['peak_rss_delta_mb']:>8.1f} MB {result['rows_per_sec'] or 0:>14,.0f} rows/s")
+
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'scale': scale,
+        'results': results,
+    }
+
+
+def _scale_key(scale):
+    return '-'.join(f"{k}={scale[k]}" for k in sorted(scale))
+
+
+def find_regressions(run, baseline, tolerance=REGRESSION_TOLERANCE):
+    """
+    Compare a run against the stored baseline for the same scale.
+
+    Returns:
+        List of (stage, baseline_s, current_s, ratio) for stages slower than tolerance
+    """
+    reference = baseline.get(_scale_key(run['scale']), {})
+    regressions = []
+    for result in run['results']:
+        before = reference.get(result['stage'])
+        if before is None or 'error' in result or before <= 0:
+            continue
+        ratio = result['wall_time_s'] / before
+        if ratio > 1 + tolerance:
+            regressions.append((result['stage'], before, result['wall_time_s'], ratio))
+    return regressions
+
+
+def _load_json(path, default):
+    if path.exists():
+        with open(path) as f:
+            return json.load(f)
+    return default
+
+
+def main():
+    """Parse arguments, run benchmarks, record history and flag regressions."""
+    parser = argparse.ArgumentParser(description="Benchmark CryptoRisk pipeline stages on synthetic data")
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small', help="Preset scale factors")
+    parser.add_argument('--symbols', type=int, help="Override number of symbols")
+    parser.add_argument('--days', type=int, help="Override number of days")
+    parser.add_argument('--portfolios', type=int, help="Override number of portfolios")
+    parser.add_argument('--trades-per-position', type=int, help="Override trades per position")
+    parser.add_argument('--stages', nargs='+', choices=sorted(STAGES), help="Stages to run (default all)")
+    parser.add_argument('--output-dir', type=Path, default=BENCHMARK_DIR, help="History/baseline directory")
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE, help="Allowed slowdown ratio")
+    parser.add_argument('--update-baseline', action='store_true', help="Store this run as the baseline")
+    parser.add_argument('--no-isolate', action='store_true', help="Run stages in-process (no per-stage RSS)")
+    args = parser.parse_args()
+
+    scale = dict(SCALES[args.scale])
+    for key in ('symbols', 'days', 'portfolios', 'trades_per_position'):
+        if getattr(args, key) is not None:
+            scale[key] = getattr(args, key)
+
+    print("\n" + "="*70)
+    print("CryptoRisk Analytics - Pipeline Benchmarks")
+    print("="*70)
+
+    run = run_benchmarks(scale, args.stages, isolate=not args.no_isolate)
+
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    history_path = args.output_dir / HISTORY_FILE
+    baseline_path = args.output_dir / BASELINE_FILE
+
+    history = _load_json(history_path, [])
+    history.append(run)
+    with open(history_path, 'w') as f:
+        json.dump(history, f, indent=2)
+    print(f"\n✓ Appended run to {history_path}")
+
+    baseline = _load_json(baseline_path, {})
+    regressions = find_regressions(run, baseline, args.tolerance)
+    if regressions:
+        print(f"\n⚠️  {len(regressions)} regression(s) vs baseline (> {args.tolerance:.0%} slower):")
+        for stage, before, after, ratio in regressions:
+            print(f"   {stage}: {before:.3f}s → {after:.3f}s ({ratio:.2f}x)")
+    elif _scale_key(scale) in baseline:
+        print("\n✅ No regressions vs baseline")
+    else:
+        print("\nℹ️  No baseline for this scale yet (use --update-baseline)")
+
+    if args.update_baseline:
+        baseline[_scale_key(scale)] = {
+            r['stage']: r['wall_time_s'] for r in run['results'] if 'error' not in r
+        }
+        with open(baseline_path, 'w') as f:
+            json.dump(baseline, f, indent=2)
+        print(f"✓ Updated baseline in {baseline_path}")
+
+    failed = [r['stage'] for r in run['results'] if 'error' in r]
+    if failed:
+        print(f"\n❌ {len(failed)} stage(s) failed: {', '.join(failed)}")
+
+    print("\n" + "="*70)
+    return 1 if regressions or failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
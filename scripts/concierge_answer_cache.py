@@ -0,0 +1,515 @@
+#!/usr/bin/env python3
+"""
+CryptoRisk Analytics - Concierge Answer Cache
+Pre-resolves the facts needed by every CryptoRisk Concierge topic (portfolio risk,
+asset performance, rebalancing, alerts, market insights, trading history) into
+small per-portfolio / per-symbol JSON blobs with an O(1) lookup API.
+
+Each entry records which source tables it was built from; when a KPI or data
+table changes on disk only the affected entry groups are rebuilt.
+
+Run this AFTER prepare_crypto_data.py and prepare_crypto_data_with_kpis.py.
+"""
+
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from price_matrix_store import MATRIX_DIR, shared_matrices
+
+# Configuration
+DATA_DIR = Path(__file__).parent.parent / "data" / "raw"
+CONCIERGE_CONFIG_PATH = Path(__file__).parent.parent / "config" / "concierge_config.yaml"
+TEST_PROMPTS_PATH = Path(__file__).parent.parent / "tests" / "concierge_test_prompts.yaml"
+CACHE_DIRNAME = 'concierge_cache'
+MANIFEST_FILE = 'manifest.json'
+
+# Source tables each entry group is built from
+SOURCE_TABLES = {
+    'positions': 'portfolio_positions_current.csv',
+    'prices': 'crypto_prices_daily_2020_2024.csv',
+    'trades': 'trades_history_sample.csv',
+    'market': 'market_metrics_daily.csv',
+    'volatility': 'kpi_portfolio_volatility_timeseries.csv',
+    'var': 'kpi_portfolio_var_current.csv',
+    'risk_adjusted': 'kpi_portfolio_risk_adjusted_returns.csv',
+    'concentration': 'kpi_portfolio_concentration.csv',
+    'change_24h': 'kpi_portfolio_24h_change.csv',
+}
+
+GROUP_SOURCES = {
+    'portfolio': ['positions', 'volatility', 'var', 'risk_adjusted', 'concentration', 'change_24h'],
+    'symbol': ['prices'],
+    'market': ['market', 'prices'],
+    'trading': ['trades'],
+}
+
+# Concierge topics and test categories -> entry group answering them
+TOPIC_GROUPS = {
+    'Portfolio Risk Assessment': 'portfolio',
+    'Asset Performance': 'symbol',
+    'Rebalancing Recommendations': 'portfolio',
+    'Alert Management': 'portfolio',
+    'Market Insights': 'market',
+    'Basic Portfolio Queries': 'portfolio',
+    'Crypto Price Queries': 'symbol',
+    'Risk Analysis': 'portfolio',
+    'Portfolio Management': 'portfolio',
+    'Trading History': 'trading',
+    'Market Analysis': 'market',
+    'Comparative Analysis': 'portfolio',
+    'Business Preferences': 'portfolio',
+    'Time-Based Queries': 'symbol',
+    'Alerts & Actions': 'portfolio',
+}
+
+DEFAULT_PREFERENCES = {
+    'risk_threshold_high': 0.25,
+    'rebalance_threshold': 0.10,
+    'concentration_alert': 0.30,
+    'daily_change_alert_pct': 5.0,
+    'recent_trade_days': 7,
+}
+
+
+def _clean(value):
+    """Convert numpy/pandas scalars to JSON-safe Python values."""
+    if isinstance(value, dict):
+        return {k: _clean(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_clean(v) for v in value]
+    if isinstance(value, (pd.Timestamp, np.datetime64)):
+        return pd.Timestamp(value).strftime('%Y-%m-%d')
+    if isinstance(value, np.bool_):
+        return bool(value)
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        return None if np.isnan(value) else round(float(value), 6)
+    return value
+
+
+def _fingerprint(path):
+    """Cheap change detector for a source table (size + mtime)."""
+    if not path.exists():
+        return None
+    stat = path.stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def load_preferences():
+    """Concierge thresholds from concierge_config.yaml, with defaults for missing ones."""
+    preferences = dict(DEFAULT_PREFERENCES)
+    if CONCIERGE_CONFIG_PATH.exists():
+        with open(CONCIERGE_CONFIG_PATH) as f:
+            preferences.update(yaml.safe_load(f).get('preferences', {}))
+    return preferences
+
+
+def configured_topics():
+    """Topic names from concierge_config.yaml and categories from the test prompts."""
+    topics = []
+    if CONCIERGE_CONFIG_PATH.exists():
+        with open(CONCIERGE_CONFIG_PATH) as f:
+            topics += [t['name'] for t in yaml.safe_load(f).get('topics', [])]
+    if TEST_PROMPTS_PATH.exists():
+        with open(TEST_PROMPTS_PATH) as f:
+            topics += [c['category'] for c in yaml.safe_load(f).get('test_categories', [])]
+    return topics
+
+
+def _read(data_dir, source, **kwargs):
+    path = data_dir / SOURCE_TABLES[source]
+    if not path.exists():
+        return None
+    return pd.read_csv(path, **kwargs)
+
+
+def build_portfolio_entries(data_dir, preferences):
+    """
+    Build one entry per portfolio plus a 'portfolio:ALL' summary.
+
+    Covers risk assessment, rebalancing, alerts and portfolio comparisons.
+    """
+    positions = _read(data_dir, 'positions', parse_dates=['as_of_date'])
+    if positions is None:
+        return {}
+    latest_date = positions['as_of_date'].max()
+    latest = positions[positions['as_of_date'] == latest_date].copy()
+    latest['total_value'] = latest.groupby('portfolio_id')['position_value'].transform('sum')
+    latest['current_weight'] = latest['position_value'] / latest['total_value']
+    latest['weight_drift'] = latest['current_weight'] - latest['target_weight']
+
+    def latest_rows(source, date_col):
+        df = _read(data_dir, source, parse_dates=[date_col])
+        if df is None or df.empty:
+            return pd.DataFrame(columns=['portfolio_id']).set_index('portfolio_id')
+        df = df.sort_values(date_col)
+        return df.groupby('portfolio_id').tail(1).set_index('portfolio_id')
+
+    volatility = latest_rows('volatility', 'date')
+    var = latest_rows('var', 'as_of_date')
+    risk_adjusted = latest_rows('risk_adjusted', 'as_of_date')
+    change = latest_rows('change_24h', 'date')
+
+    entries = {}
+    summary = []
+    for portfolio_id, pf in latest.groupby('portfolio_id', sort=False):
+        pf = pf.sort_values('position_value', ascending=False)
+        total_value = pf['position_value'].sum()
+        hhi = (pf['current_weight'] ** 2).sum()
+
+        def field(table, column):
+            if portfolio_id in table.index and column in table.columns:
+                return table.at[portfolio_id, column]
+            return None
+
+        vol_30d = field(volatility, 'volatility_30d')
+        change_pct = field(change, 'change_24h_pct')
+        drifted = pf[pf['weight_drift'].abs() > preferences['rebalance_threshold']]
+
+        alerts = []
+        if vol_30d is not None and pd.notna(vol_30d) and vol_30d > preferences['risk_threshold_high']:
+            alerts.append({'type': 'High Volatility', 'severity': 'High',
+                           'description': f"30d volatility {vol_30d:.1%} above {preferences['risk_threshold_high']:.0%}"})
+        if pf['current_weight'].max() > preferences['concentration_alert']:
+            top = pf.iloc[0]
+            alerts.append({'type': 'Concentration', 'severity': 'Medium',
+                           'description': f"{top['symbol']} is {top['current_weight']:.1%} of portfolio"})
+        if len(drifted):
+            alerts.append({'type': 'Rebalance Needed', 'severity': 'Medium',
+                           'description': f"{len(drifted)} positions drifted beyond {preferences['rebalance_threshold']:.0%}"})
+        if change_pct is not None and pd.notna(change_pct) and abs(change_pct) > preferences['daily_change_alert_pct']:
+            alerts.append({'type': 'Large Daily Move', 'severity': 'Medium',
+                           'description': f"Portfolio moved {change_pct:+.2f}% in 24h"})
+
+        entry = {
+            'portfolio_id': portfolio_id,
+            'portfolio_name': pf['portfolio_name'].iloc[0],
+            'risk_tolerance': pf['risk_tolerance'].iloc[0],
+            'as_of_date': latest_date,
+            'total_value': total_value,
+            'unrealized_pnl': pf['unrealized_pnl'].sum(),
+            'num_assets': len(pf),
+            'positions': pf[['symbol', 'quantity', 'position_value', 'current_weight',
+                             'target_weight', 'weight_drift', 'unrealized_pnl']].to_dict('records'),
+            'volatility_30d': vol_30d,
+            'volatility_90d': field(volatility, 'volatility_90d'),
+            'volatility_365d': field(volatility, 'volatility_365d'),
+            'var_95': field(var, 'var_95'),
+            'var_99': field(var, 'var_99'),
+            'sharpe_ratio': field(risk_adjusted, 'sharpe_ratio'),
+            'sortino_ratio': field(risk_adjusted, 'sortino_ratio'),
+            'beta_vs_btc': field(risk_adjusted, 'beta_vs_btc'),
+            'alpha': field(risk_adjusted, 'alpha'),
+            'correlation_to_btc': field(risk_adjusted, 'correlation_to_btc'),
+            'hhi': hhi,
+            'diversification_score': (1 - hhi) * 100,
+            'change_24h': field(change, 'change_24h'),
+            'change_24h_pct': change_pct,
+            'drifted_positions': drifted['symbol'].tolist(),
+            'alerts': alerts,
+        }
+        entries[f'portfolio:{portfolio_id}'] = _clean(entry)
+        summary.append({'portfolio_id': portfolio_id, 'portfolio_name': entry['portfolio_name'],
+                        'total_value': total_value, 'volatility_30d': vol_30d,
+                        'alert_count': len(alerts)})
+
+    grand_total = sum(s['total_value'] for s in summary)
+    for s in summary:
+        s['pct_of_total'] = s['total_value'] / grand_total * 100 if grand_total else None
+    summary.sort(key=lambda s: s['total_value'], reverse=True)
+    entries['portfolio:ALL'] = _clean({'as_of_date': latest_date, 'total_value': grand_total,
+                                       'portfolios': summary})
+    return entries
+
+
+def build_symbol_entries(data_dir, preferences):
+    """Build one entry per symbol with latest price, multi-horizon returns and risk."""
+    prices = _read(data_dir, 'prices', parse_dates=['date'])
+    if prices is None:
+        return {}
+
+    close = shared_matrices(prices, data_dir / MATRIX_DIR).frame('close')
+    returns = close.pct_change(fill_method=None)
+    latest_date = close.index[-1]
+    ytd_base = close[close.index < pd.Timestamp(latest_date.year, 1, 1)].ffill().iloc[-1:] \
+        if (close.index < pd.Timestamp(latest_date.year, 1, 1)).any() else close.iloc[:1]
+
+    def horizon(days):
+        if len(close) <= days:
+            return pd.Series(np.nan, index=close.columns)
+        return (close.iloc[-1] / close.iloc[-1 - days] - 1) * 100
+
+    return_24h, return_7d, return_30d = horizon(1), horizon(7), horizon(30)
+    return_ytd = (close.iloc[-1] / ytd_base.iloc[0] - 1) * 100
+    vol_30d = returns.tail(30).std() * np.sqrt(365)
+
+    recent = returns.tail(365)
+    btc = recent['BTC'] if 'BTC' in recent.columns else None
+    beta = recent.apply(lambda col: col.cov(btc) / btc.var()) if btc is not None else None
+
+    latest_rows = prices.sort_values('date').groupby('symbol').tail(1).set_index('symbol')
+    entries = {}
+    for symbol in close.columns:
+        row = latest_rows.loc[symbol]
+        entries[f'symbol:{symbol}'] = _clean({
+            'symbol': symbol,
+            'name': row.get('name'),
+            'category': row.get('category'),
+            'as_of_date': row['date'],
+            'close': row['close'],
+            'return_24h_pct': return_24h[symbol],
+            'return_7d_pct': return_7d[symbol],
+            'return_30d_pct': return_30d[symbol],
+            'return_ytd_pct': return_ytd[symbol],
+            'volatility_30d': vol_30d[symbol],
+            'beta_vs_btc': beta[symbol] if beta is not None else None,
+            'bb_percent': row.get('bb_percent'),
+        })
+
+    ranking = pd.DataFrame({'return_24h_pct': return_24h, 'volatility_30d': vol_30d})
+    entries['symbol:ALL'] = _clean({
+        'as_of_date': latest_date,
+        'top_performers_24h': ranking['return_24h_pct'].sort_values(ascending=False).head(5).round(4).to_dict(),
+        'most_volatile_30d': ranking['volatility_30d'].sort_values(ascending=False).head(5).round(4).to_dict(),
+    })
+    return entries
+
+
+def build_market_entries(data_dir, preferences):
+    """Build the latest market snapshot with top 24h movers."""
+    market = _read(data_dir, 'market', parse_dates=['date'])
+    if market is None or market.empty:
+        return {}
+    market = market.sort_values('date')
+    latest = market.iloc[-1].to_dict()
+
+    # The matrix fields plus date/symbol are enough for the store fingerprint to match the saved store
+    prices = _read(data_dir, 'prices', usecols=['date', 'symbol', 'close', 'volume', 'daily_return'], parse_dates=['date'])
+    if prices is not None:
+        matrices = shared_matrices(prices, data_dir / MATRIX_DIR)
+        day = matrices.cross_section('returns', matrices.dates[-1]).rename('daily_return').reset_index()
+        latest['top_gainers'] = day.nlargest(3, 'daily_return')[['symbol', 'daily_return']].to_dict('records')
+        latest['top_losers'] = day.nsmallest(3, 'daily_return')[['symbol', 'daily_return']].to_dict('records')
+
+    latest['volatility_trend_30d'] = market['market_volatility'].tail(30).tolist()
+    sentiment = latest['positive_movers'] / latest['total_assets'] if latest.get('total_assets') else None
+    latest['sentiment'] = None if sentiment is None else (
+        'Bullish' if sentiment >= 0.6 else 'Bearish' if sentiment <= 0.4 else 'Neutral')
+    return {'market:latest': _clean(latest)}
+
+
+def build_trading_entries(data_dir, preferences):
+    """Build per-portfolio and overall trading summaries (recent trades, fees, most traded)."""
+    trades = _read(data_dir, 'trades', parse_dates=['trade_date'],
+                   usecols=['trade_id', 'trade_date', 'portfolio_id', 'symbol', 'trade_type',
+                            'quantity', 'price', 'trade_amount', 'fee'])
+    if trades is None or trades.empty:
+        return {}
+
+    latest_date = trades['trade_date'].max()
+    recent_cutoff = latest_date - pd.Timedelta(days=preferences['recent_trade_days'])
+    ytd_start = pd.Timestamp(latest_date.year, 1, 1)
+
+    def summarize(df):
+        ytd = df[df['trade_date'] >= ytd_start]
+        recent = df[df['trade_date'] > recent_cutoff].sort_values('trade_date', ascending=False)
+        volume_by_symbol = df.groupby('symbol')['trade_amount'].sum().sort_values(ascending=False)
+        return _clean({
+            'as_of_date': latest_date,
+            'trade_count': len(df),
+            'total_volume': df['trade_amount'].sum(),
+            'fees_ytd': ytd['fee'].sum(),
+            'most_traded': volume_by_symbol.head(5).round(2).to_dict(),
+            'recent_trades': recent.head(20).to_dict('records'),
+        })
+
+    entries = {'trading:ALL': summarize(trades)}
+    for portfolio_id, df in trades.groupby('portfolio_id'):
+        entries[f'trading:{portfolio_id}'] = summarize(df)
+    return entries
+
+
+GROUP_BUILDERS = {
+    'portfolio': build_portfolio_entries,
+    'symbol': build_symbol_entries,
+    'market': build_market_entries,
+    'trading': build_trading_entries,
+}
+
+
+def _write_json(path, payload):
+    """Write JSON atomically so readers never see a partial blob."""
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(payload, f, separators=(',', ':'), default=str)
+    os.replace(tmp_path, path)
+
+
+def _entry_filename(key):
+    return key.replace(':', '_').replace('/', '-') + '.json'
+
+
+def build_answer_cache(data_dir=None, groups=None, force=False):
+    """
+    Build (or incrementally refresh) the concierge answer cache.
+
+    Args:
+        data_dir: Directory with the pipeline CSVs (default DATA_DIR)
+        groups: Entry groups to consider (default all)
+        force: Rebuild even if source tables are unchanged
+
+    Returns:
+        List of entry groups that were rebuilt
+    """
+    data_dir = Path(data_dir or DATA_DIR)
+    cache_dir = data_dir / CACHE_DIRNAME
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = cache_dir / MANIFEST_FILE
+
+    manifest = {'groups': {}, 'entries': {}}
+    if manifest_path.exists():
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    fingerprints = {s: _fingerprint(data_dir / f) for s, f in SOURCE_TABLES.items()}
+    preferences = load_preferences()
+    rebuilt = []
+
+    for group in groups or GROUP_BUILDERS:
+        sources = {s: fingerprints[s] for s in GROUP_SOURCES[group]}
+        previous = manifest['groups'].get(group, {})
+        if not force and previous.get('sources') == sources:
+            continue
+
+        entries = GROUP_BUILDERS[group](data_dir, preferences)
+        stale_keys = [k for k, g in manifest['entries'].items() if g == group and k not in entries]
+        for key in stale_keys:
+            (cache_dir / _entry_filename(key)).unlink(missing_ok=True)
+            del manifest['entries'][key]
+        for key, entry in entries.items():
+            _write_json(cache_dir / _entry_filename(key), entry)
+            manifest['entries'][key] = group
+
+        manifest['groups'][group] = {'sources': sources, 'built_at': time.time(), 'entries': len(entries)}
+        rebuilt.append(group)
+
+    manifest['preferences'] = preferences
+    _write_json(manifest_path, manifest)
+    return rebuilt
+
+
+class ConciergeCache:
+    """
+    O(1) fact lookups for the Concierge, backed by the precomputed JSON blobs.
+
+    All entries are held in a dict in memory. Source table fingerprints are
+    re-checked at most every check_interval seconds; changed groups are rebuilt
+    and reloaded transparently.
+    """
+
+    def __init__(self, data_dir=None, check_interval=5.0, auto_rebuild=True):
+        self.data_dir = Path(data_dir or DATA_DIR)
+        self.cache_dir = self.data_dir / CACHE_DIRNAME
+        self.check_interval = check_interval
+        self.auto_rebuild = auto_rebuild
+        self._entries = {}
+        self._manifest = {'groups': {}, 'entries': {}}
+        self._checked_at = 0.0
+        self.reload()
+
+    def reload(self):
+        """Load the manifest and every entry blob into memory."""
+        manifest_path = self.cache_dir / MANIFEST_FILE
+        if not manifest_path.exists():
+            if not self.auto_rebuild:
+                return
+            build_answer_cache(self.data_dir)
+        with open(manifest_path) as f:
+            self._manifest = json.load(f)
+        entries = {}
+        for key in self._manifest['entries']:
+            path = self.cache_dir / _entry_filename(key)
+            if path.exists():
+                with open(path) as f:
+                    entries[key] = json.load(f)
+        self._entries = entries
+        self._checked_at = time.monotonic()
+
+    def stale_groups(self):
+        """Entry groups whose source tables changed since they were built."""
+        stale = []
+        for group, sources in GROUP_SOURCES.items():
+            built = self._manifest['groups'].get(group, {}).get('sources', {})
+            current = {s: _fingerprint(self.data_dir / SOURCE_TABLES[s]) for s in sources}
+            if built != current:
+                stale.append(group)
+        return stale
+
+    def _refresh_if_stale(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        stale = self.stale_groups()
+        if stale and self.auto_rebuild:
+            build_answer_cache(self.data_dir, groups=stale)
+            self.reload()
+
+    def get(self, key, default=None):
+        """Look up an entry such as 'portfolio:PF001', 'symbol:BTC' or 'market:latest'."""
+        self._refresh_if_stale()
+        return self._entries.get(key, default)
+
+    def for_topic(self, topic, entity='ALL'):
+        """Look up the facts answering a Concierge topic for one portfolio/symbol (or ALL)."""
+        group = TOPIC_GROUPS.get(topic)
+        if group is None:
+            raise KeyError(f"No cached facts for topic: {topic}")
+        if group == 'market':
+            return self.get('market:latest')
+        return self.get(f'{group}:{entity}')
+
+    def keys(self):
+        return list(self._entries)
+
+
+def main():
+    """Build the concierge answer cache and time a round of lookups."""
+    print("\n" + "="*70)
+    print("CryptoRisk Analytics - Concierge Answer Cache")
+    print("="*70)
+    print(f"Data directory: {DATA_DIR}\n")
+
+    unmapped = [t for t in configured_topics() if t not in TOPIC_GROUPS]
+    if unmapped:
+        print(f"⚠️  Topics without cached facts: {', '.join(unmapped)}")
+
+    start = time.perf_counter()
+    rebuilt = build_answer_cache()
+    elapsed = time.perf_counter() - start
+    if rebuilt:
+        print(f"✓ Rebuilt groups: {', '.join(rebuilt)} ({elapsed:.2f}s)")
+    else:
+        print("✓ Cache up to date - no source tables changed")
+
+    cache = ConciergeCache()
+    keys = cache.keys()
+    start = time.perf_counter()
+    for key in keys:
+        cache.get(key)
+    lookup_us = (time.perf_counter() - start) / max(len(keys), 1) * 1e6
+
+    print(f"\n📦 {len(keys)} cached entries in {DATA_DIR / CACHE_DIRNAME}")
+    print(f"⚡ Average lookup: {lookup_us:.1f} µs")
+    print("\n" + "="*70)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+CryptoRisk Analytics - Covariance Engine
+One covariance service for the whole universe, shared by VaR, volatility, beta,
+correlation and optimization code instead of ad-hoc pivot().corr() / .cov() calls.
+
+Estimators (all per date, on the date x symbol daily-return matrix):
+    ewma         RiskMetrics exponentially weighted covariance (lambda = 0.94),
+                 updated in O(N²) per new day. Missing returns leave a pair
+                 untouched and weights are bias-corrected, so newly listed coins
+                 get a proper estimate after their first few days.
+    sample       Pairwise-complete sample covariance over the trailing window
+    ledoit_wolf  Sample covariance shrunk toward a scaled identity with the
+                 Ledoit-Wolf (2004) optimal intensity
+
+State can be saved after a run and loaded by the next one, which then only
+processes the new days. Materialized matrices are kept in an LRU cache.
+
+Usage:
+    engine = shared_engine(prices_df)
+    cov = engine.covariance(method='ewma', symbols=['BTC', 'ETH'])
+    sigma = engine.portfolio_volatility({'BTC': 0.6, 'ETH': 0.4})
+"""
+
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from price_matrix_store import prices_fingerprint, shared_matrices
+
+# Configuration
+DATA_DIR = Path(__file__).parent.parent / "data" / "raw"
+STATE_FILE = 'covariance_state.npz'
+
+EWMA_LAMBDA = 0.94          # RiskMetrics daily decay
+SHRINKAGE_WINDOW = 365      # Trailing days for sample / Ledoit-Wolf estimates
+CHECKPOINT_EVERY = 30       # Keep EWMA state every N days for fast historical lookups
+METHODS = ('ewma', 'sample', 'ledoit_wolf')
+
+
+def returns_matrix(prices_df):
+    """(date x symbol) daily-return DataFrame from the shared price matrix store (dates without any return dropped)."""
+    return shared_matrices(prices_df).frame('returns').dropna(how='all')
+
+
+def ewma_step(ewma_sum, ewma_weight, row, lam):
+    """
+    Advance the EWMA sums by one day of returns (NaN = missing).
+
+    Pairs with a missing return keep their previous state instead of decaying.
+    """
+    valid = ~np.isnan(row)
+    if valid.all():
+        return lam * ewma_sum + (1 - lam) * np.outer(row, row), lam * ewma_weight + (1 - lam)
+    pair = np.outer(valid, valid)
+    values = np.where(valid, row, 0.0)
+    return (np.where(pair, lam * ewma_sum + (1 - lam) * np.outer(values, values), ewma_sum),
+            np.where(pair, lam * ewma_weight + (1 - lam), ewma_weight))
+
+
+def pairwise_moments(returns, min_periods=2):
+    """
+    Pairwise-complete covariance and correlation of a (days x series) matrix with gaps.
+
+    Each pair uses the days on which both series are observed, so a short or
+    gappy series only limits its own pairs. All pairs come from a few masked
+    matrix products: with M the 0/1 observation mask and X the returns (0 where
+    missing), M'M counts common days, X'M holds each series' sum over the days
+    the other is observed, and X'X and (X²)'M the cross and own sums of squares.
+
+    Args:
+        returns: (days x series) array, NaN = missing
+        min_periods: Fewest common days for a pair to get an estimate
+
+    Returns:
+        (pair_count, covariance, correlation) as (series x series) arrays; covariance
+        is normalized by the pair count, correlation matches pandas DataFrame.corr(),
+        and both are NaN where a pair has fewer than min_periods common days
+    """
+    returns = np.asarray(returns, dtype=float)
+    valid = ~np.isnan(returns)
+    mask = valid.astype(float)
+    # Centering per series (a shift, so every pair's moments are unchanged) keeps the sums well conditioned
+    counts = mask.sum(axis=0)
+    means = np.where(valid, returns, 0.0).sum(axis=0) / np.maximum(counts, 1)
+    values = np.where(valid, returns - means, 0.0)
+
+    pair_count = mask.T @ mask
+    pair_sum = values.T @ mask
+    pair_squares = (values ** 2).T @ mask
+    enough = pair_count >= max(min_periods, 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        co_moment = values.T @ values - pair_sum * pair_sum.T / pair_count
+        own_moment = pair_squares - pair_sum ** 2 / pair_count
+        covariance = np.where(enough, co_moment / pair_count, np.nan)
+        correlation = co_moment / np.sqrt(np.maximum(own_moment, 0.0) * np.maximum(own_moment.T, 0.0))
+    correlation = np.where(enough & np.isfinite(correlation), np.clip(correlation, -1, 1), np.nan)
+    return pair_count, covariance, correlation
+
+
+def ledoit_wolf_shrink(centered, sample_cov):
+    """
+    Shrink a covariance matrix toward mu * I with the Ledoit-Wolf intensity.
+
+    Args:
+        centered: (n x N) demeaned returns (missing values as 0)
+        sample_cov: (N x N) covariance normalized by n
+
+    Returns:
+        (shrunk covariance, shrinkage intensity in [0, 1])
+    """
+    n, n_features = centered.shape
+    mu = np.trace(sample_cov) / n_features
+    delta = np.sum((sample_cov - mu * np.eye(n_features)) ** 2) / n_features
+    squared_norms = np.sum(centered ** 2, axis=1)
+    beta = (np.sum(squared_norms ** 2) / n - np.sum(sample_cov ** 2)) / (n * n_features)
+    shrinkage = 0.0 if delta <= 0 else float(np.clip(min(beta, delta) / delta, 0.0, 1.0))
+    shrunk = (1 - shrinkage) * sample_cov
+    shrunk[np.diag_indices(n_features)] += shrinkage * mu
+    return shrunk, shrinkage
+
+
+class CovarianceEngine:
+    """Incremental EWMA / sample / Ledoit-Wolf covariance for a return matrix."""
+
+    def __init__(self, symbols, ewma_lambda=EWMA_LAMBDA, window=SHRINKAGE_WINDOW,
+                 checkpoint_every=CHECKPOINT_EVERY, cache_size=64):
+        self.symbols = list(symbols)
+        self.ewma_lambda = ewma_lambda
+        self.window = window
+        self.checkpoint_every = checkpoint_every
+        self.cache_size = cache_size
+
+        n = len(self.symbols)
+        self._index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self._dates = []
+        self._returns = np.empty((0, n))
+        self._ewma_sum = np.zeros((n, n))
+        self._ewma_weight = np.zeros((n, n))
+        self._checkpoints = {}
+        self._cache = OrderedDict()
+        self.shrinkage = {}
+
+    @classmethod
+    def from_prices(cls, prices_df, state_path=None, **kwargs):
+        """
+        Build an engine from a prices frame, resuming from saved state when possible.
+
+        A saved state is reused if it covers the same symbols, its dates are a
+        prefix of the prices dates and its returns equal the prices' returns on
+        those dates (revised or re-sourced prices force a rebuild); only the
+        remaining days are processed.
+        """
+        returns = returns_matrix(prices_df)
+        engine = None
+        if state_path is not None and Path(state_path).exists():
+            engine = cls.load(state_path, **kwargs)
+            known = pd.DatetimeIndex(engine.dates)
+            if (engine.symbols != list(returns.columns) or len(known) > len(returns)
+                    or not known.equals(pd.DatetimeIndex(returns.index[:len(known)]))
+                    or not np.array_equal(engine._returns, returns.to_numpy(dtype=float)[:len(known)],
+                                          equal_nan=True)):
+                engine = None
+        if engine is None:
+            engine = cls(returns.columns, **kwargs)
+        engine.extend(returns.iloc[len(engine.dates):])
+        return engine
+
+    @property
+    def dates(self):
+        return list(self._dates)
+
+    def update(self, date, returns):
+        """
+        Add one day of returns (Series/dict by symbol or array in symbol order).
+        Cost is O(N²) regardless of history length.
+        """
+        if isinstance(returns, (pd.Series, dict)):
+            row = np.array([returns.get(symbol, np.nan) for symbol in self.symbols], dtype=float)
+        else:
+            row = np.asarray(returns, dtype=float)
+        self._append([pd.Timestamp(date)], row[None, :])
+
+    def extend(self, returns):
+        """Add many days from a (date x symbol) DataFrame in date order."""
+        returns = returns.reindex(columns=self.symbols)
+        self._append(list(pd.to_datetime(returns.index)), returns.to_numpy(dtype=float))
+
+    def _append(self, dates, rows):
+        first = len(self._dates)
+        self._dates.extend(dates)
+        self._returns = np.vstack([self._returns, rows]) if first else rows.copy()
+        for offset, row in enumerate(rows):
+            self._ewma_sum, self._ewma_weight = ewma_step(self._ewma_sum, self._ewma_weight, row, self.ewma_lambda)
+            position = first + offset
+            if self.checkpoint_every and position % self.checkpoint_every == 0:
+                self._checkpoints[position] = (self._ewma_sum.copy(), self._ewma_weight.copy())
+
+    def _position(self, date):
+        if date is None:
+            return len(self._dates) - 1
+        position = pd.DatetimeIndex(self._dates).searchsorted(pd.Timestamp(date), side='right') - 1
+        if position < 0:
+            raise KeyError(f"No returns on or before {date}")
+        return int(position)
+
+    def _ewma_state(self, position):
+        """Raw EWMA sums after `position`, replaying from the nearest checkpoint."""
+        if position == len(self._dates) - 1:
+            return self._ewma_sum, self._ewma_weight
+        start = max((p for p in self._checkpoints if p <= position), default=None)
+        if start is None:
+            ewma_sum, weight, start = np.zeros_like(self._ewma_sum), np.zeros_like(self._ewma_weight), -1
+        else:
+            ewma_sum, weight = self._checkpoints[start]
+        for row in self._returns[start + 1:position + 1]:
+            ewma_sum, weight = ewma_step(ewma_sum, weight, row, self.ewma_lambda)
+        return ewma_sum, weight
+
+    @staticmethod
+    def _ewma_covariance(ewma_sum, weight):
+        # Dividing by the accumulated weight removes the start-up bias (1 - lambda^n)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(weight > 0, ewma_sum / weight, np.nan)
+
+    def _window_estimates(self, position):
+        """Pairwise-complete sample covariance and its Ledoit-Wolf shrinkage for the window ending at position."""
+        window = self._returns[max(0, position - self.window + 1):position + 1]
+        valid = ~np.isnan(window)
+        mask = valid.astype(float)
+        values = np.where(valid, window, 0.0)
+        _, sample, _ = pairwise_moments(window)
+
+        # Shrinkage intensity from per-symbol demeaned returns over the window
+        observed = np.nan_to_num(sample)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means = np.where(mask.sum(axis=0) > 0, values.sum(axis=0) / mask.sum(axis=0), 0.0)
+        centered = np.where(valid, window - means, 0.0)
+        shrunk, intensity = ledoit_wolf_shrink(centered, observed)
+        shrunk[np.isnan(sample)] = np.nan
+        return sample, shrunk, intensity
+
+    def covariance(self, date=None, method='ewma', symbols=None):
+        """
+        Daily covariance matrix on (or just before) `date` as a symbol-indexed DataFrame.
+
+        Args:
+            date: Any date-like; defaults to the latest day
+            method: 'ewma', 'sample' or 'ledoit_wolf'
+            symbols: Optional subset/order of symbols
+        """
+        if method not in METHODS:
+            raise ValueError(f"Unknown covariance method '{method}'. Choose from: {', '.join(METHODS)}")
+        position = self._position(date)
+        key = (method, position)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            matrix = self._cache[key]
+        else:
+            if method == 'ewma':
+                matrix = self._ewma_covariance(*self._ewma_state(position))
+            else:
+                sample, shrunk, intensity = self._window_estimates(position)
+                self.shrinkage[self._dates[position]] = intensity
+                self._store(('sample', position), sample)
+                matrix = shrunk if method == 'ledoit_wolf' else sample
+            self._store(key, matrix)
+
+        frame = pd.DataFrame(matrix, index=self.symbols, columns=self.symbols)
+        return frame.loc[symbols, symbols] if symbols is not None else frame
+
+    def _store(self, key, matrix):
+        self._cache[key] = matrix
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def correlation(self, date=None, method='ewma', symbols=None):
+        """Correlation matrix derived from covariance(date, method, symbols)."""
+        cov = self.covariance(date, method, symbols)
+        std = np.sqrt(np.diag(cov.to_numpy()))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corr = cov.to_numpy() / np.outer(std, std)
+        return pd.DataFrame(np.clip(corr, -1, 1), index=cov.index, columns=cov.columns)
+
+    def volatility(self, date=None, method='ewma', annualize=True):
+        """Per-symbol volatility (annualized with sqrt(365) by default)."""
+        cov = self.covariance(date, method)
+        vol = np.sqrt(np.diag(cov.to_numpy())) * (np.sqrt(365) if annualize else 1)
+        return pd.Series(vol, index=self.symbols)
+
+    def portfolio_volatility(self, weights, date=None, method='ewma', annualize=False):
+        """
+        Volatility of a weighted portfolio: sqrt(wᵀ Σ w).
+
+        Args:
+            weights: dict/Series of symbol -> weight (missing symbols count as 0)
+        """
+        weights = pd.Series(weights, dtype=float)
+        weights = weights.groupby(level=0).sum()
+        symbols = [s for s in weights.index if s in self._index]
+        cov = np.nan_to_num(self.covariance(date, method, symbols).to_numpy())
+        w = weights.loc[symbols].to_numpy()
+        sigma = float(np.sqrt(max(w @ cov @ w, 0.0)))
+        return sigma * np.sqrt(365) if annualize else sigma
+
+    def beta(self, weights, benchmark='BTC', date=None, method='ewma'):
+        """Beta of a weighted portfolio vs a benchmark symbol: Cov(p, b) / Var(b)."""
+        weights = pd.Series(weights, dtype=float).groupby(level=0).sum()
+        symbols = [s for s in weights.index if s in self._index]
+        cov = self.covariance(date, method)
+        column = np.nan_to_num(cov.loc[symbols, benchmark].to_numpy())
+        variance = cov.loc[benchmark, benchmark]
+        return float(weights.loc[symbols].to_numpy() @ column / variance) if variance > 0 else np.nan
+
+    def iter_covariances(self, method='ewma', start=None):
+        """
+        Yield (date, covariance ndarray) for every day from `start`, sweeping forward once.
+
+        A `start` before the first return date starts the sweep at the beginning of the history.
+        """
+        if start is None or pd.Timestamp(start) < self._dates[0]:
+            first = 0
+        else:
+            first = self._position(start)
+        if method == 'ewma':
+            ewma_sum, weight = self._ewma_state(first)
+            yield self._dates[first], self._ewma_covariance(ewma_sum, weight)
+            for position in range(first + 1, len(self._dates)):
+                ewma_sum, weight = ewma_step(ewma_sum, weight, self._returns[position], self.ewma_lambda)
+                yield self._dates[position], self._ewma_covariance(ewma_sum, weight)
+        else:
+            for position in range(first, len(self._dates)):
+                sample, shrunk, _ = self._window_estimates(position)
+                yield self._dates[position], shrunk if method == 'ledoit_wolf' else sample
+
+    def save(self, path):
+        """Persist dates, returns and the latest EWMA state for incremental reuse."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(
+            path,
+            symbols=np.array(self.symbols),
+            dates=np.array([d.strftime('%Y-%m-%d') for d in self._dates]),
+            returns=self._returns,
+            ewma_sum=self._ewma_sum,
+            ewma_weight=self._ewma_weight,
+            ewma_lambda=self.ewma_lambda,
+        )
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        """
+        Load an engine saved with save().
+
+        Only the latest EWMA state is stored, so historical EWMA lookups replay from the
+        first day; new days and latest-date queries cost O(N²).
+        """
+        data = np.load(path, allow_pickle=False)
+        if 'ewma_lambda' not in kwargs:
+            kwargs['ewma_lambda'] = float(data['ewma_lambda'])
+        engine = cls(data['symbols'].tolist(), **kwargs)
+        if float(data['ewma_lambda']) != engine.ewma_lambda:
+            # State was built with a different decay; replay everything
+            engine.extend(pd.DataFrame(data['returns'], index=pd.to_datetime(data['dates']), columns=engine.symbols))
+            return engine
+        engine._dates = list(pd.to_datetime(data['dates']))
+        engine._returns = data['returns']
+        engine._ewma_sum = data['ewma_sum']
+        engine._ewma_weight = data['ewma_weight']
+        return engine
+
+
+_shared = {}
+
+
+def shared_engine(prices_df, state_path=None, **kwargs):
+    """
+    Return a CovarianceEngine for prices_df, reusing one built earlier in this process.
+
+    Engines are keyed by the prices fingerprint (rows, symbols, first/last date, content
+    hash) and the engine parameters, so every risk function in a run shares the same instance.
+    """
+    fingerprint = (*prices_fingerprint(prices_df), tuple(sorted(kwargs.items())))
+    if fingerprint not in _shared:
+        _shared[fingerprint] = CovarianceEngine.from_prices(prices_df, state_path=state_path, **kwargs)
+    return _shared[fingerprint]
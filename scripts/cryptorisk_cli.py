@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+CryptoRisk Analytics - Command Line Entry Point
+Single fast-starting CLI for the data pipeline, meant for schedulers that run
+individual stages many times a day.
+
+Only argparse is imported up front; pandas, numpy, yfinance and the pipeline
+modules load when a subcommand actually needs them, and nothing touches the
+disk until a command runs.
+
+Commands:
+    fetch     Download (or synthesize) prices and write the prices file only
+    generate  Build the core datasets (prices, positions, trades, market, risk, correlation)
+    kpis      Build pre-calculated KPI tables from the core datasets
+    lots      Stream a (large) trades CSV through lot matching in parallel
+    synthetic Sharded, reproducible synthetic dataset for load tests
+    serve     Local HTTP query service over the KPI and price tables
+    all       generate followed by kpis
+
+Usage:
+    python3 cryptorisk_cli.py fetch --start 2020-01-01
+    python3 cryptorisk_cli.py generate --reuse-prices
+    python3 cryptorisk_cli.py kpis --stages var concentration --workers 4
+    python3 cryptorisk_cli.py lots --trades all_trades.csv --workers 8
+    python3 cryptorisk_cli.py synthetic --symbols 2000 --days 4000 --portfolios 100000 --workers 32 --output-dir /data/loadtest
+    python3 cryptorisk_cli.py serve --port 8765
+    python3 cryptorisk_cli.py all --source synthetic --output-dir /tmp/crypto --universe universe.csv
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+
+def _configure_core(args):
+    """Import and configure prepare_crypto_data from the shared options."""
+    import prepare_crypto_data as pipeline
+
+    universe = pipeline.load_universe(args.universe) if args.universe else None
+    pipeline.configure(data_dir=args.output_dir, start_date=args.start, end_date=args.end, universe=universe)
+    return pipeline
+
+
+def _configure_kpis(args):
+    """Import and configure prepare_crypto_data_with_kpis from the shared options."""
+    import prepare_crypto_data_with_kpis as kpis
+
+    kpis.configure(data_dir=args.output_dir)
+    return kpis
+
+
+def cmd_fetch(args):
+    pipeline = _configure_core(args)
+    prices_df = pipeline.generate_crypto_prices(args.source)
+    crypto_ref_df = pipeline.create_crypto_reference()
+    pipeline.save_prices(prices_df, crypto_ref_df, date_table=args.date_table)
+    return 0
+
+
+def cmd_generate(args):
+    pipeline = _configure_core(args)
+    pipeline.main(source=args.source, reuse_prices=args.reuse_prices, date_table=args.date_table)
+    return 0
+
+
+def cmd_kpis(args):
+    kpis = _configure_kpis(args)
+    try:
+        kpis.resolve_kpi_selection(args.stages)
+    except ValueError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 2
+    kpis.main(kpi_names=args.stages, workers=args.workers)
+    return 0
+
+
+def cmd_lots(args):
+    kpis = _configure_kpis(args)
+    import lot_accounting
+
+    trades_path = args.trades or kpis.DATA_DIR / 'trades_history_sample.csv'
+    daily_df, lots_df = lot_accounting.process_trades_file(trades_path, workers=args.workers,
+                                                           chunksize=args.chunksize)
+    kpis.save_kpi_tables({'realized_pnl': daily_df, 'open_lots': lots_df})
+    return 0
+
+
+def cmd_synthetic(args):
+    import synthetic_generator
+
+    output_dir = args.output_dir or Path(__file__).parent.parent / "data" / "synthetic"
+    synthetic_generator.generate_dataset(
+        output_dir, n_symbols=args.symbols, n_days=args.days, n_portfolios=args.portfolios,
+        start_date=args.start, seed=args.seed, workers=args.workers,
+        trades_per_position=args.trades_per_position,
+    )
+    return 0
+
+
+def cmd_all(args):
+    status = cmd_generate(args)
+    return status or cmd_kpis(args)
+
+
+def cmd_serve(args):
+    kpis = _configure_kpis(args)
+    import kpi_query_service
+
+    kpi_query_service.main(data_dir=kpis.DATA_DIR, host=args.host, port=args.port, cache_size=args.cache_size,
+                           load_test_requests=args.load_test, concurrency=args.concurrency)
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='cryptorisk',
+        description='CryptoRisk Analytics data pipeline',
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--output-dir', type=Path,
+                        help='Directory for generated CSVs (default: data/raw)')
+
+    core = argparse.ArgumentParser(add_help=False)
+    core.add_argument('--start', help='First price date, YYYY-MM-DD (default: 2015-01-01)')
+    core.add_argument('--end', help='Last price date, YYYY-MM-DD (default: today)')
+    core.add_argument('--universe', type=Path,
+                      help='CSV/JSON file listing symbols to use instead of the built-in universe')
+    core.add_argument('--source', choices=['auto', 'yahoo', 'synthetic'], default='auto',
+                      help='Price source: Yahoo Finance with synthetic fallback (auto), Yahoo only, or synthetic only')
+    core.add_argument('--date-table', action='store_true',
+                      help='Also write date_dimension.csv (date attributes, one row per price date)')
+
+    kpi = argparse.ArgumentParser(add_help=False)
+    kpi.add_argument('--stages', nargs='+', metavar='KPI',
+                     help='KPI tables to build (default: all); dependencies are added automatically')
+    kpi.add_argument('--workers', type=int, default=1,
+                     help='Processes for independent KPI tables (default: 1)')
+
+    p = subparsers.add_parser('fetch', parents=[common, core], help='Write the prices file only')
+    p.set_defaults(func=cmd_fetch)
+
+    p = subparsers.add_parser('generate', parents=[common, core], help='Build the core datasets')
+    p.add_argument('--reuse-prices', action='store_true',
+                   help='Start from the prices file already in the output directory')
+    p.set_defaults(func=cmd_generate)
+
+    p = subparsers.add_parser('kpis', parents=[common, kpi], help='Build pre-calculated KPI tables')
+    p.set_defaults(func=cmd_kpis)
+
+    p = subparsers.add_parser('lots', parents=[common], help='Lot-match a trades CSV in streaming partitions')
+    p.add_argument('--trades', type=Path,
+                   help='Trades CSV (default: trades_history_sample.csv in the output directory)')
+    p.add_argument('--workers', type=int,
+                   help='Processes for the partitions (default: all cores)')
+    p.add_argument('--chunksize', type=int, default=1_000_000,
+                   help='Rows read per chunk (default: 1,000,000)')
+    p.set_defaults(func=cmd_lots)
+
+    p = subparsers.add_parser('synthetic', parents=[common],
+                              help='Sharded synthetic dataset (default output: data/synthetic)')
+    p.add_argument('--symbols', type=int, help='Universe size, padded with SYN symbols (default: built-in universe)')
+    p.add_argument('--days', type=int, help='Number of daily prices (default: --start to today)')
+    p.add_argument('--portfolios', type=int, default=3, help='Number of portfolios (default: 3)')
+    p.add_argument('--trades-per-position', type=int, default=20, help='Trades per held symbol (default: 20)')
+    p.add_argument('--start', default='2015-01-01', help='First price date, YYYY-MM-DD (default: 2015-01-01)')
+    p.add_argument('--seed', type=int, default=20150101, help='Root seed (default: 20150101)')
+    p.add_argument('--workers', type=int, default=1,
+                   help='Processes; the output is identical for any value (default: 1)')
+    p.set_defaults(func=cmd_synthetic)
+
+    p = subparsers.add_parser('serve', parents=[common], help='Serve KPI/price queries over HTTP on localhost')
+    p.add_argument('--host', default='127.0.0.1', help='Bind address (default: 127.0.0.1)')
+    p.add_argument('--port', type=int, default=8765, help='Port (default: 8765)')
+    p.add_argument('--cache-size', type=int, default=4096, help='Cached responses kept (default: 4096)')
+    p.add_argument('--load-test', type=int, default=0, metavar='N',
+                   help='Fire N requests at the service on startup, print latency percentiles and exit')
+    p.add_argument('--concurrency', type=int, default=32,
+                   help='Concurrent connections for --load-test (default: 32)')
+    p.set_defaults(func=cmd_serve)
+
+    p = subparsers.add_parser('all', parents=[common, core, kpi], help='generate followed by kpis')
+    p.add_argument('--reuse-prices', action='store_true',
+                   help='Start from the prices file already in the output directory')
+    p.set_defaults(func=cmd_all)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+CryptoRisk Analytics - GARCH(1,1) Volatility Forecasting
+Fits GARCH(1,1) to many daily return series at once and forecasts their volatility,
+without scipy or an external statistics service.
+
+Model (per series, on demeaned returns e_t):
+    sigma²_t+1 = omega + alpha * e²_t + beta * sigma²_t
+with variance targeting, omega = s² (1 - alpha - beta) where s² is the sample
+variance, so only alpha and beta are estimated by Gaussian maximum likelihood.
+
+The variance recursion runs over time once for all series together (numpy vectors
+across series), carrying analytic derivatives of sigma² with respect to alpha and
+beta. Each series then takes BHHH steps (outer product of scores as the Hessian)
+with its own backtracking line search, all batched. Starting points come from a
+small grid evaluated the same way. Missing returns (e.g. before a coin listed)
+leave sigma² unchanged and are left out of the likelihood. Large universes are
+split into blocks of series fitted in a process pool.
+
+Usage:
+    fits = fit_garch_frame(returns_df)      # one row per column: params + forecasts
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+# Configuration
+MIN_OBSERVATIONS = 250          # Fewer valid returns -> no fit
+MAX_ITERATIONS = 100
+TOLERANCE = 1e-7                # Stop when the largest parameter step is below this
+MAX_HALVINGS = 20
+MAX_PERSISTENCE = 0.9995        # alpha + beta cap keeps the process stationary
+FORECAST_HORIZON = 30
+ANNUALIZATION = 365
+PARALLEL_MIN_SERIES = 64        # Below this, a process pool costs more than it saves
+INITIAL_GRID = [(a, b) for a in (0.03, 0.08, 0.15) for b in (0.80, 0.88, 0.94) if a + b < MAX_PERSISTENCE]
+
+
+def garch_recursion(e2, valid, alpha, beta, var0, gradient=False):
+    """
+    Gaussian log-likelihood of GARCH(1,1) with variance targeting, for all series at once.
+
+    Args:
+        e2: (days x series) squared demeaned returns (0 where missing)
+        valid: (days x series) bool, True where the return is observed
+        alpha, beta, var0: (series,) parameters and target (sample) variance
+        gradient: Also return scores for BHHH
+
+    Returns:
+        (log-likelihood (series,), next-day variance (series,)) and, with gradient=True,
+        also the score sum (series x 2) and outer-product matrix (series x 2 x 2)
+    """
+    n_series = e2.shape[1]
+    omega = var0 * (1 - alpha - beta)
+    sigma2 = var0.copy()
+    loglik = np.zeros(n_series)
+    if gradient:
+        d_alpha, d_beta = np.zeros(n_series), np.zeros(n_series)
+        s_alpha, s_beta = np.zeros(n_series), np.zeros(n_series)
+        o_aa, o_ab, o_bb = np.zeros(n_series), np.zeros(n_series), np.zeros(n_series)
+    for x, v in zip(e2, valid):
+        loglik += np.where(v, np.log(sigma2) + x / sigma2, 0.0)
+        updated = omega + alpha * x + beta * sigma2
+        if gradient:
+            common = np.where(v, -0.5 * (1 - x / sigma2) / sigma2, 0.0)
+            score_a, score_b = common * d_alpha, common * d_beta
+            s_alpha += score_a
+            s_beta += score_b
+            o_aa += score_a * score_a
+            o_ab += score_a * score_b
+            o_bb += score_b * score_b
+            d_alpha = np.where(v, x - var0 + beta * d_alpha, d_alpha)
+            d_beta = np.where(v, sigma2 - var0 + beta * d_beta, d_beta)
+        sigma2 = np.where(v, updated, sigma2)
+    loglik = -0.5 * (loglik + valid.sum(axis=0) * np.log(2 * np.pi))
+    if gradient:
+        score_sum = np.stack([s_alpha, s_beta], axis=1)
+        outer = np.stack([np.stack([o_aa, o_ab], axis=1), np.stack([o_ab, o_bb], axis=1)], axis=1)
+        return loglik, sigma2, score_sum, outer
+    return loglik, sigma2
+
+
+def _project(alpha, beta):
+    """Clip parameters into the stationary, positive region."""
+    alpha = np.clip(alpha, 1e-6, MAX_PERSISTENCE)
+    beta = np.clip(beta, 0.0, MAX_PERSISTENCE)
+    total = alpha + beta
+    scale = np.where(total > MAX_PERSISTENCE, MAX_PERSISTENCE / total, 1.0)
+    return alpha * scale, beta * scale
+
+
+def fit_garch(returns, max_iterations=MAX_ITERATIONS, tolerance=TOLERANCE):
+    """
+    Fit GARCH(1,1) to every column of a (days x series) return array (NaN = missing).
+
+    Returns:
+        dict of (series,) arrays: mu, omega, alpha, beta, persistence, long_run_variance,
+        next_variance, log_likelihood, observations, iterations, converged
+    """
+    returns = np.asarray(returns, dtype=float)
+    valid = ~np.isnan(returns)
+    observations = valid.sum(axis=0)
+    mu = np.where(observations > 0, np.nansum(returns, axis=0) / np.maximum(observations, 1), 0.0)
+    e2 = np.where(valid, returns - mu, 0.0) ** 2
+    var0 = np.where(observations > 1, e2.sum(axis=0) / np.maximum(observations - 1, 1), np.nan)
+    n_series = returns.shape[1]
+
+    fitted = (observations >= MIN_OBSERVATIONS) & (var0 > 0)
+    result = {name: np.full(n_series, np.nan) for name in
+              ('omega', 'alpha', 'beta', 'persistence', 'long_run_variance', 'next_variance', 'log_likelihood')}
+    result.update(mu=mu, observations=observations, iterations=np.zeros(n_series, dtype=int),
+                  converged=np.zeros(n_series, dtype=bool))
+    if not fitted.any():
+        return result
+
+    cols = np.flatnonzero(fitted)
+    e2, valid, var0 = e2[:, cols], valid[:, cols], var0[cols]
+
+    # Starting point: best of a small grid, evaluated for all series at once
+    alpha, beta = np.full(len(cols), INITIAL_GRID[0][0]), np.full(len(cols), INITIAL_GRID[0][1])
+    best = np.full(len(cols), -np.inf)
+    for a, b in INITIAL_GRID:
+        candidate, _ = garch_recursion(e2, valid, np.full(len(cols), a), np.full(len(cols), b), var0)
+        better = candidate > best
+        alpha, beta, best = np.where(better, a, alpha), np.where(better, b, beta), np.where(better, candidate, best)
+
+    # BHHH iterations; each series stops on its own once its step is below tolerance
+    active = np.ones(len(cols), dtype=bool)
+    iterations = np.zeros(len(cols), dtype=int)
+    for _ in range(max_iterations):
+        idx = np.flatnonzero(active)
+        if len(idx) == 0:
+            break
+        loglik, _, score, outer = garch_recursion(e2[:, idx], valid[:, idx], alpha[idx], beta[idx], var0[idx],
+                                                  gradient=True)
+        outer = outer + 1e-10 * np.eye(2)
+        direction = np.linalg.solve(outer, score[:, :, None])[:, :, 0]
+        iterations[idx] += 1
+
+        # Batched backtracking: halve the step of every series that has not improved
+        step = np.ones(len(idx))
+        accepted = np.zeros(len(idx), dtype=bool)
+        new_alpha, new_beta = alpha[idx].copy(), beta[idx].copy()
+        for _ in range(MAX_HALVINGS):
+            pending = np.flatnonzero(~accepted)
+            if len(pending) == 0:
+                break
+            cand_alpha, cand_beta = _project(alpha[idx[pending]] + step[pending] * direction[pending, 0],
+                                             beta[idx[pending]] + step[pending] * direction[pending, 1])
+            cand_loglik, _ = garch_recursion(e2[:, idx[pending]], valid[:, idx[pending]], cand_alpha, cand_beta,
+                                             var0[idx[pending]])
+            improved = cand_loglik >= loglik[pending]
+            new_alpha[pending[improved]], new_beta[pending[improved]] = cand_alpha[improved], cand_beta[improved]
+            accepted[pending[improved]] = True
+            step[pending[~improved]] *= 0.5
+
+        moved = np.maximum(np.abs(new_alpha - alpha[idx]), np.abs(new_beta - beta[idx]))
+        alpha[idx], beta[idx] = new_alpha, new_beta
+        done = (moved < tolerance) | ~accepted
+        result['converged'][cols[idx[done]]] = True
+        active[idx[done]] = False
+
+    loglik, next_variance = garch_recursion(e2, valid, alpha, beta, var0)
+    result['iterations'][cols] = iterations
+    result['alpha'][cols], result['beta'][cols] = alpha, beta
+    result['omega'][cols] = var0 * (1 - alpha - beta)
+    result['persistence'][cols] = alpha + beta
+    result['long_run_variance'][cols] = var0
+    result['next_variance'][cols] = next_variance
+    result['log_likelihood'][cols] = loglik
+    return result
+
+
+def forecast_variance(fit, horizon=FORECAST_HORIZON):
+    """
+    Daily variance forecasts for 1..horizon days ahead.
+
+    sigma²_t+h = s² + (alpha + beta)^(h-1) (sigma²_t+1 - s²)
+
+    Returns:
+        (series x horizon) array
+    """
+    decay = fit['persistence'][:, None] ** np.arange(horizon)[None, :]
+    long_run = fit['long_run_variance'][:, None]
+    return long_run + decay * (fit['next_variance'][:, None] - long_run)
+
+
+def _fit_block(returns):
+    return fit_garch(returns)
+
+
+def fit_garch_frame(returns_df, horizon=FORECAST_HORIZON, workers=None):
+    """
+    Fit and forecast every column of a (date x series) returns DataFrame.
+
+    Args:
+        returns_df: Daily returns, NaN where a series has no observation
+        horizon: Days ahead for the multi-day forecast
+        workers: Processes (default: all cores once there are PARALLEL_MIN_SERIES series, else 1)
+
+    Returns:
+        DataFrame indexed by series with the fitted parameters, convergence info and
+        annualized forecast volatilities: forecast_vol_1d (next day) and
+        forecast_vol_{horizon}d (average variance over the next horizon days)
+    """
+    returns = returns_df.to_numpy(dtype=float)
+    n_series = returns.shape[1]
+    if workers is None:
+        workers = (os.cpu_count() or 1) if n_series >= PARALLEL_MIN_SERIES else 1
+
+    if workers <= 1:
+        fit = fit_garch(returns)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        bounds = np.linspace(0, n_series, min(n_series, workers * 4) + 1).astype(int)
+        blocks = [returns[:, lo:hi] for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            fits = list(pool.map(_fit_block, blocks))
+        fit = {name: np.concatenate([f[name] for f in fits]) for name in fits[0]}
+
+    variance_path = forecast_variance(fit, horizon)
+    df = pd.DataFrame(fit, index=returns_df.columns)
+    df['forecast_vol_1d'] = np.sqrt(fit['next_variance'] * ANNUALIZATION)
+    df[f'forecast_vol_{horizon}d'] = np.sqrt(variance_path.mean(axis=1) * ANNUALIZATION)
+    df['long_run_vol'] = np.sqrt(fit['long_run_variance'] * ANNUALIZATION)
+    return df
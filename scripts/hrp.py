@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+CryptoRisk Analytics - Correlation Clustering and Hierarchical Risk Parity
+Clusters symbols on correlation distance and allocates with hierarchical risk
+parity (Lopez de Prado, 2016), for the whole universe or any subset of it.
+
+Steps (N symbols):
+    distance        d_ij = sqrt((1 - rho_ij) / 2), one array expression
+    clustering      single linkage via Prim's minimum spanning tree: N vectorized
+                    O(N) updates instead of an O(N²) Python scan per merge
+    quasi-diagonal  dendrogram leaf order, so correlated symbols sit next to each other
+    bisection       the ordered list is split in halves level by level; all splits of
+                    a level are weighted at once, with cluster variances read from 2-D
+                    prefix sums of the inverse-variance-weighted covariance
+
+The linkage matrix has the scipy layout (left, right, distance, size), so it can be
+handed to scipy.cluster.hierarchy.dendrogram when scipy is installed.
+
+Usage:
+    allocation = hrp_allocation(cov_df, corr_df)    # cluster_id, dendrogram_order, hrp_weight
+"""
+
+import numpy as np
+import pandas as pd
+
+# Configuration
+N_CLUSTERS = 6                  # Clusters reported when cutting the universe dendrogram
+
+
+def correlation_distance(corr):
+    """Correlation distance sqrt((1 - rho) / 2); missing correlations count as uncorrelated."""
+    corr = np.nan_to_num(np.asarray(corr, dtype=float), nan=0.0)
+    distance = np.sqrt(np.clip((1 - corr) / 2, 0.0, 1.0))
+    np.fill_diagonal(distance, 0.0)
+    return distance
+
+
+def single_linkage(distance):
+    """
+    Single-linkage clustering of a square distance matrix.
+
+    Builds the minimum spanning tree with Prim's algorithm (each step is one
+    vectorized pass over the N distances to the tree), then merges its edges in
+    increasing distance order, which is exactly single linkage.
+
+    Returns:
+        (N-1 x 4) linkage matrix: merged cluster ids, merge distance, new cluster size.
+        Leaves are 0..N-1 and the cluster formed by row k is N+k.
+    """
+    n = len(distance)
+    if n < 2:
+        return np.empty((0, 4))
+    in_tree = np.zeros(n, dtype=bool)
+    in_tree[0] = True
+    nearest = distance[0].copy()
+    parent = np.zeros(n, dtype=int)
+    edges = np.empty((n - 1, 3))
+    for k in range(n - 1):
+        j = int(np.argmin(np.where(in_tree, np.inf, nearest)))
+        edges[k] = parent[j], j, nearest[j]
+        in_tree[j] = True
+        closer = distance[j] < nearest
+        nearest = np.where(closer, distance[j], nearest)
+        parent = np.where(closer, j, parent)
+
+    # Kruskal order over the tree edges; union-find maps leaves to current clusters
+    edges = edges[np.argsort(edges[:, 2], kind='stable')]
+    root = np.arange(2 * n - 1)
+    size = np.ones(2 * n - 1)
+    linkage = np.empty((n - 1, 4))
+
+    def find(x):
+        while root[x] != x:
+            root[x] = root[root[x]]
+            x = root[x]
+        return x
+
+    for k, (a, b, d) in enumerate(edges):
+        left, right = sorted((find(int(a)), find(int(b))))
+        root[left] = root[right] = n + k
+        size[n + k] = size[left] + size[right]
+        linkage[k] = left, right, d, size[n + k]
+    return linkage
+
+
+def quasi_diagonal_order(linkage):
+    """
+    Dendrogram leaf order (quasi-diagonalization).
+
+    Every cluster occupies a contiguous run of positions; walking the merges from
+    the root down, the left child starts where its parent starts and the right
+    child right after the left one.
+    """
+    n = len(linkage) + 1
+    size = np.ones(2 * n - 1, dtype=int)
+    size[n:] = linkage[:, 3]
+    start = np.zeros(2 * n - 1, dtype=int)
+    children = linkage[:, :2].astype(int)
+    for k in range(n - 2, -1, -1):
+        left, right = children[k]
+        start[left] = start[n + k]
+        start[right] = start[n + k] + size[left]
+    return np.argsort(start[:n], kind='stable')
+
+
+def cut_clusters(linkage, n_clusters):
+    """
+    Flat cluster labels from undoing the last n_clusters - 1 merges.
+
+    Returns:
+        (N,) int array of labels 1..n_clusters, numbered in dendrogram order
+    """
+    n = len(linkage) + 1
+    n_clusters = int(np.clip(n_clusters, 1, n))
+    cutoff = 2 * n - n_clusters       # Clusters with id >= cutoff are undone
+    parent = np.arange(2 * n - 1)
+    children = linkage[:, :2].astype(int)
+    parent[children[:, 0]] = parent[children[:, 1]] = np.arange(n, 2 * n - 1)
+    jump = np.where(parent < cutoff, parent, np.arange(2 * n - 1))
+
+    # Pointer doubling: every node reaches its highest kept ancestor in O(log depth) passes
+    while True:
+        next_jump = jump[jump]
+        if np.array_equal(next_jump, jump):
+            break
+        jump = next_jump
+    roots = jump[:n]
+    ordered_roots = roots[quasi_diagonal_order(linkage)]
+    _, first_seen = np.unique(ordered_roots, return_index=True)
+    label = np.zeros(2 * n - 1, dtype=int)
+    label[ordered_roots[np.sort(first_seen)]] = np.arange(1, len(first_seen) + 1)
+    return label[roots]
+
+
+def hrp_weights(cov, order):
+    """
+    Hierarchical risk parity weights by recursive bisection of the ordered covariance.
+
+    The variance of a segment under inverse-variance weights is
+    sum(ivp_i ivp_j cov_ij) / sum(ivp_i)², a block sum of M = ivp ivp' * cov, so
+    one 2-D prefix sum of M gives every segment's variance in O(1).
+
+    Args:
+        cov: (N x N) covariance array (positive diagonal)
+        order: Quasi-diagonal leaf order
+
+    Returns:
+        (N,) weights in the original symbol order, summing to 1
+    """
+    n = len(order)
+    ordered = np.asarray(cov, dtype=float)[np.ix_(order, order)]
+    ivp = 1.0 / np.diag(ordered)
+    prefix = np.zeros((n + 1, n + 1))
+    prefix[1:, 1:] = (ivp[:, None] * ordered * ivp[None, :]).cumsum(axis=0).cumsum(axis=1)
+    ivp_sum = np.concatenate([[0.0], np.cumsum(ivp)])
+
+    def segment_variance(a, b):
+        return (prefix[b, b] - prefix[a, b] - prefix[b, a] + prefix[a, a]) / (ivp_sum[b] - ivp_sum[a]) ** 2
+
+    weights = np.ones(n)
+    starts, ends = np.array([0]), np.array([n])
+    while len(starts):
+        mids = starts + (ends - starts) // 2
+        left_var, right_var = segment_variance(starts, mids), segment_variance(mids, ends)
+        total = left_var + right_var
+        alpha = np.where(total > 0, 1 - left_var / np.where(total > 0, total, 1), 0.5)
+
+        # Segments partition their level, so per-position factors are a repeat over segment halves
+        factors = np.column_stack([alpha, 1 - alpha]).ravel()
+        lengths = np.column_stack([mids - starts, ends - mids]).ravel()
+        sizes = ends - starts
+        positions = np.arange(sizes.sum()) + np.repeat(starts - np.cumsum(sizes) + sizes, sizes)
+        weights[positions] *= np.repeat(factors, lengths)
+
+        starts, ends = np.concatenate([starts, mids]), np.concatenate([mids, ends])
+        keep = ends - starts > 1
+        starts, ends = starts[keep], ends[keep]
+
+    result = np.empty(n)
+    result[order] = weights
+    return result
+
+
+def hrp_allocation(cov, corr=None, n_clusters=N_CLUSTERS):
+    """
+    Cluster symbols and compute their HRP weights.
+
+    Symbols whose variance is missing or zero cannot be weighted and are dropped;
+    missing covariances between the remaining symbols are treated as 0.
+
+    Args:
+        cov: Symbol-indexed covariance DataFrame
+        corr: Matching correlation DataFrame (derived from cov if omitted)
+        n_clusters: Flat clusters to cut the dendrogram into
+
+    Returns:
+        DataFrame indexed by symbol with cluster_id, dendrogram_order (0-based),
+        hrp_weight and ivp_weight (plain inverse-variance weight, for comparison)
+    """
+    variance = pd.Series(np.diag(cov.to_numpy(dtype=float)), index=cov.index)
+    symbols = variance.index[variance.notna() & (variance > 0)]
+    cov_values = np.nan_to_num(cov.loc[symbols, symbols].to_numpy(dtype=float), nan=0.0)
+    np.fill_diagonal(cov_values, variance[symbols].to_numpy())
+    if corr is None:
+        std = np.sqrt(np.diag(cov_values))
+        corr_values = cov_values / np.outer(std, std)
+    else:
+        corr_values = corr.loc[symbols, symbols].to_numpy(dtype=float)
+
+    n = len(symbols)
+    result = pd.DataFrame(index=pd.Index(symbols, name='symbol'),
+                          columns=['cluster_id', 'dendrogram_order', 'hrp_weight', 'ivp_weight'])
+    if n == 0:
+        return result
+    linkage = single_linkage(correlation_distance(corr_values))
+    order = quasi_diagonal_order(linkage) if n > 1 else np.zeros(1, dtype=int)
+    ivp = 1.0 / np.diag(cov_values)
+
+    result['cluster_id'] = cut_clusters(linkage, n_clusters) if n > 1 else 1
+    result['dendrogram_order'] = np.argsort(order)
+    result['hrp_weight'] = hrp_weights(cov_values, order)
+    result['ivp_weight'] = ivp / ivp.sum()
+    return result
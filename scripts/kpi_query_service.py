@@ -0,0 +1,528 @@
+#!/usr/bin/env python3
+"""
+CryptoRisk Analytics - KPI Query Service
+Small asyncio HTTP service answering point queries against the pipeline outputs
+without re-reading whole CSVs: every KPI table is loaded once and indexed by
+entity (portfolio, symbol) with its rows sorted by date, prices come from the
+memory-mapped price matrix store, and serialized responses are kept in a bounded
+LRU cache. Cache hits are answered on the event loop; misses are computed and
+JSON-encoded in a worker thread, and row responses are paged (DEFAULT_ROW_LIMIT
+rows unless ?limit= asks for up to MAX_ROW_LIMIT), so one large table cannot
+stall every other connection.
+
+Source files are re-checked every check_interval seconds. Once a change has been
+stable for one interval (so a pipeline run in progress is not half-loaded) the
+tables are reloaded in a background thread and swapped in; requests never wait
+on a reload and the cache is cleared on swap.
+
+Endpoints (JSON, GET only):
+    /health                                      generation, load time, cache stats
+    /tables                                      tables with key column and entity count
+    /kpi/<table>/<entity>?days=90                rows in the last N days (or start=/end=)
+                                                 of one entity; other columns filter by
+                                                 equality, e.g. &benchmark=BTC
+    /latest/<table>/<entity>                     rows on the entity's latest date
+    /price/<symbol>?days=30                      close, volume, daily_return
+    ...&limit=500&offset=1000                    page through /kpi, /latest and /price rows;
+                                                 responses carry total_rows and next_offset
+    /correlation?symbols=SOL,ETH&days=90         pairwise-complete return correlation
+
+Usage:
+    python3 cryptorisk_cli.py serve --port 8765
+    curl 'http://127.0.0.1:8765/kpi/volatility/PF002?days=90'
+    python3 cryptorisk_cli.py serve --load-test 20000 --concurrency 64
+"""
+
+import asyncio
+import json
+import multiprocessing
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from prepare_crypto_data_with_kpis import KPI_TABLES
+from price_matrix_store import INDEX_FILE, MATRIX_DIR, PriceMatrices
+
+# Configuration
+DATA_DIR = Path(__file__).parent.parent / "data" / "raw"
+PRICES_FILE = 'crypto_prices_daily_2020_2024.csv'
+EXTRA_TABLES = {
+    'market': {'file': 'market_metrics_daily.csv', 'date_column': 'date'},
+    'risk': {'file': 'risk_metrics_portfolio.csv', 'date_column': 'as_of_date'},
+}
+KEY_COLUMNS = ('portfolio_id', 'entity_id', 'symbol')   # First one present keys a table
+ALL_ENTITIES = 'ALL'                                      # Key of tables without an entity column
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+CACHE_SIZE = 4096
+CHECK_INTERVAL = 2.0
+DEFAULT_CORRELATION_DAYS = 90
+DEFAULT_ROW_LIMIT = 1000      # Rows per response unless ?limit= is given
+MAX_ROW_LIMIT = 10000         # Largest ?limit= accepted; ?offset= pages through the rest
+
+
+class QueryError(Exception):
+    """A request that cannot be answered; carries the HTTP status."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def table_specs():
+    """Table name -> file and date column, for every KPI table plus the market/risk facts."""
+    specs = {name: {'file': spec['file'], 'date_column': spec['date_column']} for name, spec in KPI_TABLES.items()}
+    specs.update(EXTRA_TABLES)
+    return specs
+
+
+def source_fingerprints(data_dir):
+    """Size and mtime of every file the service loads (None if missing)."""
+    paths = [spec['file'] for spec in table_specs().values()] + [PRICES_FILE, f"{MATRIX_DIR}/{INDEX_FILE}"]
+    fingerprints = {}
+    for name in paths:
+        path = Path(data_dir) / name
+        fingerprints[name] = [path.stat().st_size, path.stat().st_mtime_ns] if path.exists() else None
+    return fingerprints
+
+
+def _python_rows(df):
+    """DataFrame rows as tuples of JSON-safe Python values (NaN -> None)."""
+    columns = []
+    for name in df.columns:
+        values = df[name]
+        if pd.api.types.is_float_dtype(values):
+            columns.append([None if v != v else v for v in values.tolist()])
+        else:
+            columns.append(values.astype(object).where(values.notna(), None).tolist())
+    return list(zip(*columns))
+
+
+def _page(params):
+    """Pop limit/offset from the query parameters and validate them."""
+    limit = int(params.pop('limit', DEFAULT_ROW_LIMIT))
+    offset = int(params.pop('offset', 0))
+    if not 0 < limit <= MAX_ROW_LIMIT or offset < 0:
+        raise QueryError(400, f"limit must be between 1 and {MAX_ROW_LIMIT} and offset must be >= 0")
+    return limit, offset
+
+
+def _paginate(rows, limit, offset):
+    """One page of rows plus the total and the offset of the next page (None on the last page)."""
+    page = rows[offset:offset + limit]
+    following = offset + len(page)
+    return {'rows': page, 'total_rows': len(rows), 'offset': offset,
+            'next_offset': following if following < len(rows) else None}
+
+
+class IndexedTable:
+    """One table split by entity, each entity's rows sorted by date with a date array for range lookups."""
+
+    def __init__(self, name, df, date_column):
+        self.name = name
+        self.date_column = date_column
+        self.key = next((c for c in KEY_COLUMNS if c in df.columns), None)
+        self.columns = list(df.columns)
+        self.rows = len(df)
+
+        dates = pd.to_datetime(df[date_column])
+        df = df.assign(**{date_column: dates.dt.strftime('%Y-%m-%d')})
+        df['_date'] = dates.to_numpy(dtype='datetime64[D]')
+        keys = df[self.key].astype(str) if self.key else pd.Series(ALL_ENTITIES, index=df.index)
+        self.entities = {}
+        for entity, group in df.groupby(keys, sort=True):
+            group = group.sort_values('_date', kind='stable')
+            self.entities[entity] = (group['_date'].to_numpy(), _python_rows(group[self.columns]))
+
+    def describe(self):
+        return {'key': self.key or ALL_ENTITIES, 'date_column': self.date_column,
+                'rows': self.rows, 'entities': len(self.entities), 'columns': self.columns}
+
+    def _entity(self, entity):
+        if entity not in self.entities:
+            raise QueryError(404, f"Unknown {self.key or 'entity'} '{entity}' in table '{self.name}'")
+        return self.entities[entity]
+
+    def _filter(self, rows, filters):
+        if not filters:
+            return rows
+        unknown = [c for c in filters if c not in self.columns]
+        if unknown:
+            raise QueryError(400, f"Unknown column(s) for table '{self.name}': {', '.join(unknown)}")
+        positions = [(self.columns.index(c), value) for c, value in filters.items()]
+        return [row for row in rows if all(str(row[i]) == value for i, value in positions)]
+
+    def window(self, entity, days=None, start=None, end=None, filters=None):
+        """Rows of one entity within [start, end], or the last `days` calendar days up to its latest date."""
+        dates, rows = self._entity(entity)
+        if len(dates) == 0:
+            return []
+        stop = len(dates) if end is None else int(dates.searchsorted(np.datetime64(end, 'D'), side='right'))
+        if days is not None:
+            last = dates[stop - 1] if stop else dates[0]
+            first = int(dates.searchsorted(last - np.timedelta64(days - 1, 'D')))
+        else:
+            first = 0 if start is None else int(dates.searchsorted(np.datetime64(start, 'D')))
+        return self._filter(rows[first:stop], filters)
+
+    def latest(self, entity, filters=None):
+        """Rows of one entity on its latest date."""
+        dates, rows = self._entity(entity)
+        if len(dates) == 0:
+            return []
+        first = int(dates.searchsorted(dates[-1]))
+        return self._filter(rows[first:], filters)
+
+
+class QueryData:
+    """Immutable snapshot of every loaded table plus the price matrices."""
+
+    def __init__(self, data_dir):
+        self.data_dir = Path(data_dir)
+        self.fingerprints = source_fingerprints(self.data_dir)
+        self.tables = {}
+        for name, spec in table_specs().items():
+            path = self.data_dir / spec['file']
+            if path.exists():
+                self.tables[name] = IndexedTable(name, pd.read_csv(path), spec['date_column'])
+        self.prices = self._load_prices()
+        self.loaded_at = time.time()
+
+    def _load_prices(self):
+        """Map the price matrix store if it is newer than the prices file, otherwise build from the CSV."""
+        prices_path = self.data_dir / PRICES_FILE
+        index_path = self.data_dir / MATRIX_DIR / INDEX_FILE
+        if index_path.exists() and (not prices_path.exists()
+                                    or index_path.stat().st_mtime_ns >= prices_path.stat().st_mtime_ns):
+            return PriceMatrices.open(self.data_dir / MATRIX_DIR)
+        if prices_path.exists():
+            return PriceMatrices.from_prices(pd.read_csv(prices_path, parse_dates=['date']))
+        return None
+
+
+class KPIQueryService:
+    """Routes queries to the current QueryData snapshot through an LRU cache of serialized responses."""
+
+    def __init__(self, data_dir=None, cache_size=CACHE_SIZE, check_interval=CHECK_INTERVAL):
+        self.data_dir = Path(data_dir or DATA_DIR)
+        self.cache_size = cache_size
+        self.check_interval = check_interval
+        self.data = QueryData(self.data_dir)
+        self.generation = 1
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._pending = None
+        self._watcher = None
+
+    # --- Query handling --------------------------------------------------------
+
+    def respond(self, target):
+        """Answer one request target ('/path?query'); returns (status, JSON bytes)."""
+        body = self._cached(target)
+        if body is not None:
+            return 200, body
+        status, body, cacheable = self._compute(target)
+        if cacheable:
+            self._store(target, body)
+        return status, body
+
+    async def respond_async(self, target):
+        """Like respond(), but computes cache misses in a worker thread to keep the event loop free."""
+        body = self._cached(target)
+        if body is not None:
+            return 200, body
+        generation = self.generation
+        status, body, cacheable = await asyncio.to_thread(self._compute, target)
+        if cacheable and generation == self.generation:
+            self._store(target, body)
+        return status, body
+
+    def _cached(self, target):
+        body = self._cache.get(target)
+        if body is None:
+            self.misses += 1
+            return None
+        self._cache.move_to_end(target)
+        self.hits += 1
+        return body
+
+    def _store(self, target, body):
+        self._cache[target] = body
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _compute(self, target):
+        """Route and serialize one target; returns (status, JSON bytes, cacheable)."""
+        try:
+            payload, cacheable = self._route(target)
+        except QueryError as e:
+            return e.status, json.dumps({'error': str(e)}).encode(), False
+        except (ValueError, KeyError) as e:
+            return 400, json.dumps({'error': str(e)}).encode(), False
+        return 200, json.dumps(payload, separators=(',', ':')).encode(), cacheable
+
+    def _route(self, target):
+        url = urlsplit(target)
+        parts = [unquote(p) for p in url.path.split('/') if p]
+        params = dict(parse_qsl(url.query))
+        if parts == ['health']:
+            return self.health(), False
+        if parts == ['tables']:
+            return {name: table.describe() for name, table in self.data.tables.items()}, True
+        if len(parts) == 3 and parts[0] in ('kpi', 'latest'):
+            return self.kpi(parts[0], parts[1], parts[2], params), True
+        if len(parts) == 2 and parts[0] == 'price':
+            return self.price(parts[1], params), True
+        if parts == ['correlation']:
+            return self.correlation(params), True
+        raise QueryError(404, f"Unknown endpoint: {url.path}")
+
+    def _table(self, name):
+        if name not in self.data.tables:
+            raise QueryError(404, f"Unknown table '{name}'. Choose from: {', '.join(self.data.tables)}")
+        return self.data.tables[name]
+
+    def kpi(self, mode, name, entity, params):
+        """One page of rows of one table for one entity: a date window (mode 'kpi') or the latest date (mode 'latest')."""
+        table = self._table(name)
+        limit, offset = _page(params)
+        days = int(params.pop('days')) if 'days' in params else None
+        start, end = params.pop('start', None), params.pop('end', None)
+        if mode == 'latest':
+            rows = table.latest(entity, filters=params)
+        else:
+            rows = table.window(entity, days=days, start=start, end=end, filters=params)
+        return {'table': name, 'entity': entity, 'columns': table.columns, **_paginate(rows, limit, offset)}
+
+    def _prices(self):
+        if self.data.prices is None:
+            raise QueryError(404, f"No prices loaded from {self.data_dir}")
+        return self.data.prices
+
+    def _start(self, matrices, days, end):
+        """First date of a trailing `days`-day window ending at `end` (default: latest price date)."""
+        last = matrices.dates[-1] if end is None else pd.Timestamp(end)
+        return last - pd.Timedelta(days=days - 1), last
+
+    def price(self, symbol, params):
+        """One page of the daily close, volume and return of one symbol."""
+        matrices = self._prices()
+        if symbol not in matrices:
+            raise QueryError(404, f"Unknown symbol '{symbol}'")
+        limit, offset = _page(params)
+        start, end = params.get('start'), params.get('end')
+        if 'days' in params:
+            start, end = self._start(matrices, int(params['days']), end)
+        frame = pd.DataFrame({field: matrices.frame(field, [symbol], start, end)[symbol]
+                              for field in ('close', 'volume', 'returns')}).dropna(how='all')
+        frame.insert(0, 'date', frame.index.strftime('%Y-%m-%d'))
+        frame = frame.rename(columns={'returns': 'daily_return'})
+        return {'symbol': symbol, 'columns': list(frame.columns), **_paginate(_python_rows(frame), limit, offset)}
+
+    def correlation(self, params):
+        """Pairwise-complete Pearson correlation of daily returns over a trailing window."""
+        matrices = self._prices()
+        symbols = [s for s in params.get('symbols', '').split(',') if s]
+        if len(symbols) < 2:
+            raise QueryError(400, "correlation needs symbols=A,B[,...]")
+        unknown = [s for s in symbols if s not in matrices]
+        if unknown:
+            raise QueryError(404, f"Unknown symbol(s): {', '.join(unknown)}")
+        days = int(params.get('days', DEFAULT_CORRELATION_DAYS))
+        start, end = self._start(matrices, days, params.get('end'))
+        returns = matrices.frame('returns', symbols, start, end)
+        correlation = returns.corr(min_periods=2)
+        pairs = [{'a': a, 'b': b, 'correlation': None if pd.isna(correlation.loc[a, b]) else round(float(correlation.loc[a, b]), 6),
+                  'observations': int((returns[a].notna() & returns[b].notna()).sum())}
+                 for i, a in enumerate(symbols) for b in symbols[i + 1:]]
+        return {'start': str(start.date()), 'end': str(end.date()), 'days': days, 'pairs': pairs}
+
+    def health(self):
+        return {'status': 'ok', 'generation': self.generation, 'data_dir': str(self.data_dir),
+                'loaded_at': pd.Timestamp(self.data.loaded_at, unit='s').isoformat(),
+                'tables': len(self.data.tables), 'cache_entries': len(self._cache),
+                'cache_hits': self.hits, 'cache_misses': self.misses}
+
+    # --- Hot reload -----------------------------------------------------------
+
+    def swap(self, data):
+        """Install a new snapshot and drop responses cached from the old one."""
+        self.data = data
+        self.generation += 1
+        self._cache.clear()
+
+    async def watch(self):
+        """Reload once changed source files have been stable for one check interval."""
+        while True:
+            await asyncio.sleep(self.check_interval)
+            current = await asyncio.to_thread(source_fingerprints, self.data_dir)
+            if current == self.data.fingerprints:
+                self._pending = None
+            elif current != self._pending:
+                self._pending = current
+            else:
+                try:
+                    self.swap(await asyncio.to_thread(QueryData, self.data_dir))
+                    print(f"🔄 Reloaded tables (generation {self.generation})")
+                except Exception as e:
+                    print(f"⚠️  Reload failed, keeping generation {self.generation}: {e}")
+                self._pending = None
+
+    # --- HTTP -----------------------------------------------------------------
+
+    async def handle(self, reader, writer):
+        """Serve HTTP/1.1 requests on one (keep-alive) connection."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip().lower()
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    break
+                if method != 'GET':
+                    status, body = 405, json.dumps({'error': 'Only GET is supported'}).encode()
+                else:
+                    status, body = await self.respond_async(target)
+                keep_alive = (headers.get('connection') != 'close' if version == 'HTTP/1.1'
+                              else headers.get('connection') == 'keep-alive')
+                writer.write(_response(status, body, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        """Start listening and the reload watcher; returns the asyncio server."""
+        server = await asyncio.start_server(self.handle, host, port)
+        self._watcher = asyncio.create_task(self.watch())
+        return server
+
+
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed'}
+
+
+def _response(status, body, keep_alive):
+    return (f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode() + body
+
+
+def sample_targets(service, per_table=5):
+    """Representative point queries over the loaded data, for load tests."""
+    targets = ['/tables']
+    for name, table in service.data.tables.items():
+        for entity in list(table.entities)[:per_table]:
+            targets += [f'/latest/{name}/{entity}', f'/kpi/{name}/{entity}?days=90']
+    matrices = service.data.prices
+    if matrices is not None:
+        symbols = matrices.symbols[:per_table * 2]
+        targets += [f'/price/{s}?days=30' for s in symbols]
+        targets += [f'/correlation?symbols={a},{b}' for a, b in zip(symbols, symbols[1:])]
+    return targets
+
+
+async def load_test(host, port, targets, requests=10000, concurrency=32):
+    """
+    Fire `requests` GETs over `concurrency` keep-alive connections, cycling through targets.
+
+    Returns:
+        dict with request count, errors, throughput and p50/p95/p99/max latency in ms
+    """
+    latencies = []
+    errors = 0
+
+    async def client(worker):
+        nonlocal errors
+        reader, writer = await asyncio.open_connection(host, port)
+        for i in range(worker, requests, concurrency):
+            target = targets[i % len(targets)]
+            started = time.perf_counter()
+            writer.write(f"GET {target} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while (line := await reader.readline()) not in (b'\r\n', b''):
+                if line.lower().startswith(b'content-length:'):
+                    length = int(line.split(b':')[1])
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - started)
+            errors += status != 200
+        writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(w) for w in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    ms = np.array(latencies) * 1000
+    return {'requests': len(latencies), 'errors': errors, 'concurrency': concurrency,
+            'requests_per_sec': round(len(latencies) / elapsed, 1),
+            'p50_ms': round(float(np.percentile(ms, 50)), 3), 'p95_ms': round(float(np.percentile(ms, 95)), 3),
+            'p99_ms': round(float(np.percentile(ms, 99)), 3), 'max_ms': round(float(ms.max()), 3)}
+
+
+def _load_test_process(host, port, targets, requests, concurrency):
+    """Entry point of the load-test client process: its own interpreter and event loop."""
+    return asyncio.run(load_test(host, port, targets, requests, concurrency))
+
+
+async def _serve(data_dir, host, port, cache_size, load_test_requests, concurrency):
+    start = time.perf_counter()
+    service = KPIQueryService(data_dir, cache_size=cache_size)
+    print(f"✓ Loaded {len(service.data.tables)} tables from {service.data_dir} in {time.perf_counter() - start:.2f}s")
+    server = await service.start(host, port)
+    host, port = server.sockets[0].getsockname()[:2]
+    if load_test_requests:
+        targets = sample_targets(service)
+        print(f"⚡ Load test: {load_test_requests:,} requests over {len(targets)} targets, {concurrency} connections")
+        # The client runs in a separate process so its work does not share the server's loop
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            result = await asyncio.get_running_loop().run_in_executor(
+                pool, _load_test_process, host, port, targets, load_test_requests, concurrency)
+        for key, value in result.items():
+            print(f"   {key:>16}: {value}")
+        server.close()
+        await server.wait_closed()
+        return result
+    print(f"🌐 Serving on http://{host}:{port} (Ctrl+C to stop)")
+    async with server:
+        await server.serve_forever()
+
+
+def main(data_dir=None, host=DEFAULT_HOST, port=DEFAULT_PORT, cache_size=CACHE_SIZE,
+         load_test_requests=0, concurrency=32):
+    """
+    Run the query service until interrupted, or run a load test against it on localhost.
+
+    Args:
+        load_test_requests: If > 0, start the service, fire this many requests from a
+            separate client process and exit
+        concurrency: Concurrent connections for the load test
+    """
+    print("\n" + "="*70)
+    print("CryptoRisk Analytics - KPI Query Service")
+    print("="*70)
+    try:
+        return asyncio.run(_serve(data_dir or DATA_DIR, host, port, cache_size, load_test_requests, concurrency))
+    except KeyboardInterrupt:
+        print("\n✓ Stopped")
+
+
+if __name__ == "__main__":
+    main()
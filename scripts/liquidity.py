@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+CryptoRisk Analytics - Liquidity Metrics
+Market liquidity of every symbol on every date, and of positions held in them,
+from the close and volume columns already in the price panel.
+
+Metrics (trailing window of ADV_WINDOW days, NaN with fewer than MIN_OBSERVATIONS):
+    avg_dollar_volume   mean of close * volume
+    amihud_illiquidity  Amihud (2002) mean of |return| / dollar volume, per $1M traded;
+                        the price move caused by trading $1M in a day
+    days_to_liquidate   position value / (PARTICIPATION_RATE * avg_dollar_volume),
+                        days to sell without exceeding that share of daily volume
+
+A position is liquid when its symbol trades at least LIQUID_MIN_DOLLAR_VOLUME a
+day on average and the position can be sold within LIQUID_MAX_DAYS.
+
+All windows are trailing sums from one cumulative sum over the (date x symbol)
+matrices, so the whole universe costs a few array passes whatever its size.
+
+Usage:
+    panel = liquidity_panel(matrices)                   # dict of (date x symbol) arrays
+    df = position_liquidity(positions_df, matrices)     # one row per position row
+"""
+
+import numpy as np
+import pandas as pd
+
+# Configuration
+ADV_WINDOW = 30                         # Trailing days for dollar volume and Amihud averages
+MIN_OBSERVATIONS = 10                   # Fewer valid days in the window -> NaN
+PARTICIPATION_RATE = 0.10               # Share of average daily dollar volume sold per day
+LIQUID_MAX_DAYS = 1.0                   # Liquid positions can be sold within this many days
+LIQUID_MIN_DOLLAR_VOLUME = 10_000_000   # Liquid symbols trade at least this much per day
+AMIHUD_SCALE = 1_000_000                # Amihud ratio per $1M traded
+
+
+def rolling_mean(values, window, min_observations=MIN_OBSERVATIONS):
+    """Trailing mean along axis 0 over the non-NaN values of each window."""
+    valid = ~np.isnan(values)
+    sums = np.cumsum(np.where(valid, values, 0.0), axis=0)
+    counts = np.cumsum(valid, axis=0)
+    sums[window:] -= sums[:-window].copy()
+    counts[window:] -= counts[:-window].copy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(counts >= min_observations, sums / counts, np.nan)
+
+
+def liquidity_panel(matrices, window=ADV_WINDOW):
+    """
+    Liquidity of every symbol on every date.
+
+    Args:
+        matrices: PriceMatrices with close, volume and returns (see price_matrix_store.py)
+        window: Trailing days averaged
+
+    Returns:
+        dict of (date x symbol) arrays: dollar_volume, avg_dollar_volume, amihud_illiquidity
+    """
+    dollar_volume = matrices.array('close') * matrices.array('volume')
+    returns = matrices.array('returns')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        amihud = np.where(dollar_volume > 0, np.abs(returns) / dollar_volume * AMIHUD_SCALE, np.nan)
+    return {
+        'dollar_volume': dollar_volume,
+        'avg_dollar_volume': rolling_mean(dollar_volume, window),
+        'amihud_illiquidity': rolling_mean(amihud, window),
+    }
+
+
+def days_to_liquidate(position_value, avg_dollar_volume, participation_rate=PARTICIPATION_RATE):
+    """Days to sell position_value at participation_rate of average dollar volume (inf without volume)."""
+    capacity = participation_rate * np.asarray(avg_dollar_volume, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        days = np.abs(np.asarray(position_value, dtype=float)) / capacity
+    return np.where(capacity > 0, days, np.where(np.isnan(capacity), np.nan, np.inf))
+
+
+def position_liquidity(positions_df, matrices, window=ADV_WINDOW, panel=None):
+    """
+    Liquidity of each position row on its as_of_date (latest price date on or before it).
+
+    Args:
+        positions_df: Frame with symbol, as_of_date and position_value
+        matrices: PriceMatrices of the prices the positions are valued with
+        window: Trailing days averaged
+        panel: Precomputed liquidity_panel(matrices, window), if at hand
+
+    Returns:
+        DataFrame aligned with positions_df: avg_dollar_volume, amihud_illiquidity,
+        days_to_liquidate, is_liquid (symbols without price history are not liquid)
+    """
+    panel = liquidity_panel(matrices, window) if panel is None else panel
+
+    # Symbols and dates are looked up once per distinct value, then gathered per row;
+    # the appended -1 is where missing values (code -1) land
+    symbol_codes, symbols = pd.factorize(positions_df['symbol'])
+    columns = np.append(pd.Index(matrices.symbols).get_indexer(symbols), -1)[symbol_codes]
+    date_codes, dates = pd.factorize(pd.to_datetime(positions_df['as_of_date']))
+    rows = np.append(matrices.dates.searchsorted(pd.DatetimeIndex(dates), side='right') - 1, -1)[date_codes]
+    found = (columns >= 0) & (rows >= 0)
+
+    result = pd.DataFrame(index=positions_df.index)
+    for name in ('avg_dollar_volume', 'amihud_illiquidity'):
+        values = np.full(len(positions_df), np.nan)
+        values[found] = panel[name][rows[found], columns[found]]
+        result[name] = values
+    result['days_to_liquidate'] = days_to_liquidate(positions_df['position_value'], result['avg_dollar_volume'])
+    result['is_liquid'] = ((result['avg_dollar_volume'] >= LIQUID_MIN_DOLLAR_VOLUME)
+                           & (result['days_to_liquidate'] <= LIQUID_MAX_DAYS))
+    return result
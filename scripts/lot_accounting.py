@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+"""
+CryptoRisk Analytics - Lot Accounting Engine
+Turns the trade stream into realized P&L, open lots and cost basis over time,
+matching every SELL against the actual lots it closes instead of today's avg_cost.
+
+Methods (both computed in the same pass):
+    fifo       Sells close the oldest open lots first
+    average    Sells are costed at the running average cost of the position
+
+BUY fees are added to the lot cost; SELL fees reduce proceeds. A SELL larger than
+the open quantity only realizes P&L on the matched part; the rest is reported as
+unmatched_sell_quantity (no short lots are opened).
+
+Trades are sorted by (portfolio, symbol, date, trade_id) and run through one tight
+loop over numpy arrays, compiled with numba when it is installed; without numba the
+same results come from whole-array operations (match_lots_vectorized). Large inputs are
+hash-partitioned by (portfolio, symbol) and the partitions run in parallel;
+process_trades_file() streams a CSV in chunks, spilling each partition to disk,
+so the full trade table never has to fit in memory.
+
+Usage:
+    daily_df, lots_df = process_trades(trades_df)
+    daily_df, lots_df = process_trades_file('trades_history_sample.csv', workers=8)
+"""
+
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(func=None, **kwargs):
+        return func if func is not None else (lambda f: f)
+
+# Configuration
+KEY_COLUMNS = ['portfolio_id', 'symbol']
+TRADE_COLUMNS = ['trade_id', 'trade_date', 'portfolio_id', 'portfolio_name', 'symbol',
+                 'trade_type', 'quantity', 'price', 'fee']
+CHUNK_SIZE = 1_000_000              # Rows per CSV chunk when streaming
+PARALLEL_MIN_TRADES = 2_000_000     # Below this, partitioning costs more than it saves
+QTY_EPSILON = 1e-12                 # Lot quantities below this count as closed
+RESCALE_LOG = 200.0                 # Vectorized average cost rescales after the held fraction shrinks by e^200
+
+_shared = {}
+
+
+@njit(cache=True)
+def match_lots(key_codes, is_sell, quantity, price, fee):
+    """
+    Run FIFO and average-cost lot matching over trades sorted by key then time.
+
+    All arguments are 1-D arrays of equal length; key_codes changes value at each
+    new (portfolio, symbol). Returns per-trade arrays:
+        realized_fifo, realized_avg, position_qty, cost_basis_fifo, cost_basis_avg,
+        unmatched_qty, remaining_qty (open quantity left in each BUY lot)
+    """
+    n = len(key_codes)
+    realized_fifo = np.zeros(n)
+    realized_avg = np.zeros(n)
+    position_qty = np.zeros(n)
+    cost_basis_fifo = np.zeros(n)
+    cost_basis_avg = np.zeros(n)
+    unmatched_qty = np.zeros(n)
+    remaining_qty = np.zeros(n)
+
+    # Open FIFO lots live in remaining_qty[lot_index[head:tail]]
+    lot_index = np.empty(n, dtype=np.int64)
+    lot_unit_cost = np.zeros(n)
+    head = 0
+    tail = 0
+    qty_held = 0.0
+    fifo_cost = 0.0
+    avg_cost_total = 0.0
+
+    for i in range(n):
+        if i == 0 or key_codes[i] != key_codes[i - 1]:
+            head = 0
+            tail = 0
+            qty_held = 0.0
+            fifo_cost = 0.0
+            avg_cost_total = 0.0
+
+        q = quantity[i]
+        if not is_sell[i]:
+            lot_cost = q * price[i] + fee[i]
+            remaining_qty[i] = q
+            lot_index[tail] = i
+            lot_unit_cost[tail] = lot_cost / q if q > 0 else 0.0
+            tail += 1
+            qty_held += q
+            fifo_cost += lot_cost
+            avg_cost_total += lot_cost
+        else:
+            matched = min(q, qty_held)
+            fee_share = fee[i] * matched / q if q > 0 else 0.0
+
+            # Average cost: close at the running average
+            avg_removed = avg_cost_total * matched / qty_held if qty_held > 0 else 0.0
+            realized_avg[i] = matched * price[i] - avg_removed - fee_share
+            avg_cost_total -= avg_removed
+
+            # FIFO: consume the oldest lots
+            to_close = matched
+            fifo_removed = 0.0
+            while to_close > QTY_EPSILON and head < tail:
+                lot = lot_index[head]
+                take = min(remaining_qty[lot], to_close)
+                fifo_removed += take * lot_unit_cost[head]
+                remaining_qty[lot] -= take
+                to_close -= take
+                if remaining_qty[lot] <= QTY_EPSILON:
+                    remaining_qty[lot] = 0.0
+                    head += 1
+            realized_fifo[i] = matched * price[i] - fifo_removed - fee_share
+            fifo_cost -= fifo_removed
+
+            qty_held -= matched
+            unmatched_qty[i] = q - matched
+            if qty_held <= QTY_EPSILON:
+                qty_held = 0.0
+                fifo_cost = 0.0
+                avg_cost_total = 0.0
+
+        position_qty[i] = qty_held
+        cost_basis_fifo[i] = fifo_cost
+        cost_basis_avg[i] = avg_cost_total
+
+    return (realized_fifo, realized_avg, position_qty, cost_basis_fifo, cost_basis_avg,
+            unmatched_qty, remaining_qty)
+
+
+def _group_scan(values, groups, how):
+    """Cumulative sum/prod/min of values restarting at every new group id (groups sorted)."""
+    return getattr(pd.Series(values).groupby(groups, sort=False), how)().to_numpy(dtype=float, copy=True)
+
+
+def match_lots_vectorized(key_codes, is_sell, quantity, price, fee):
+    """
+    Same results as match_lots(), from whole-array operations instead of a per-trade loop.
+
+    Used when numba is not installed, where the interpreted loop takes seconds per
+    million trades. The position follows from a running minimum (sells never go
+    short), FIFO cost from interpolating each sell's consumed quantity range on the
+    cumulative quantity/cost curve of the buys, and average cost from a cumulative
+    product of the fraction kept by each sell.
+    """
+    n = len(key_codes)
+    if n == 0:
+        return tuple(np.zeros(0) for _ in range(7))
+    is_sell = np.asarray(is_sell, dtype=bool)
+    is_buy = ~is_sell
+    group_start = np.r_[True, key_codes[1:] != key_codes[:-1]]
+    groups = np.cumsum(group_start)
+
+    # Position: running total reflected at zero, closed positions snap to zero
+    flows = _group_scan(np.where(is_sell, -quantity, quantity), groups, 'cumsum')
+    position_qty = flows - np.minimum(_group_scan(flows, groups, 'cummin'), 0.0)
+    closed = is_sell & (position_qty <= QTY_EPSILON)
+    position_qty[closed] = 0.0
+    held_before = np.where(group_start, 0.0, np.r_[0.0, position_qty[:-1]])
+    matched = np.where(is_sell, np.minimum(quantity, held_before), 0.0)
+    unmatched_qty = np.where(is_sell, quantity - matched, 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fee_share = np.where(is_sell & (quantity > 0), fee * matched / quantity, 0.0)
+    lot_cost = np.where(is_buy, quantity * price + fee, 0.0)
+    # Holding periods restart after every sell that closes the position
+    periods = groups + np.cumsum(np.r_[False, closed[:-1]])
+
+    # FIFO: cost of the first x units bought in a group, x = cumulative matched quantity.
+    # Buys are searched by (group, cumulative quantity) as complex numbers, which numpy
+    # orders lexicographically; zero-quantity buys add no units and are never closed.
+    lots = np.flatnonzero(is_buy & (quantity > 0))
+    lot_qty_end = _group_scan(quantity[lots], groups[lots], 'cumsum')
+    lot_cost_end = _group_scan(lot_cost[lots], groups[lots], 'cumsum')
+    lot_unit_cost = lot_cost[lots] / quantity[lots]
+    lot_keys = groups[lots] + 1j * lot_qty_end
+    consumed = _group_scan(matched, groups, 'cumsum')
+    removed = np.zeros(n)
+    sells = np.flatnonzero(matched > 0)
+    if len(sells):
+        def cost_of_first(units):
+            k = np.minimum(np.searchsorted(lot_keys, groups[sells] + 1j * units), len(lots) - 1)
+            k = np.where(groups[lots][k] == groups[sells], k, k - 1)
+            return np.where(units > 0, lot_cost_end[k] - (lot_qty_end[k] - units) * lot_unit_cost[k], 0.0)
+        removed[sells] = cost_of_first(consumed[sells]) - cost_of_first(consumed[sells] - matched[sells])
+    realized_fifo = np.where(is_sell, matched * price - removed - fee_share, 0.0)
+    cost_basis_fifo = _group_scan(lot_cost - removed, periods, 'cumsum')
+    cost_basis_fifo[closed] = 0.0
+
+    remaining_qty = np.zeros(n)
+    group_consumed = consumed[np.r_[np.flatnonzero(group_start)[1:] - 1, n - 1]][groups[lots] - 1]
+    left = np.clip(lot_qty_end - group_consumed, 0.0, quantity[lots])
+    remaining_qty[lots] = np.where((left <= QTY_EPSILON) & (left < quantity[lots]), 0.0, left)
+
+    # Average cost: each sell keeps (held after / held before) of the cost; buys add theirs.
+    # Within a segment, cost = scale * cumsum(lot_cost / scale) with scale the product of the
+    # kept fractions since the segment start. A segment ends with its holding period or once
+    # that product has shrunk by e^RESCALE_LOG, so it neither underflows nor overflows; the
+    # rare segments that continue a period carry the previous segment's closing cost.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        kept = np.where(is_sell & (held_before > 0), position_qty / held_before, 1.0)
+    kept[closed] = 1.0
+    log_kept = _group_scan(np.log(kept), periods, 'cumsum')
+    period_start = np.r_[True, periods[1:] != periods[:-1]]
+    block = np.floor(log_kept / -RESCALE_LOG)
+    segment_start = period_start | np.r_[False, block[1:] != block[:-1]]
+    segments = np.cumsum(segment_start) - 1
+    starts = np.flatnonzero(segment_start)
+    log_base = np.where(period_start[starts], 0.0, log_kept[np.maximum(starts - 1, 0)])
+    scale = np.exp(log_kept - log_base[segments])
+    segment_cost = _group_scan(lot_cost / scale, segments, 'cumsum')
+    carry = np.zeros(len(starts))
+    for first in starts[~period_start[starts]]:
+        last = first - 1
+        carry[segments[first]] = scale[last] * (carry[segments[last]] + segment_cost[last])
+    cost_basis_avg = scale * (carry[segments] + segment_cost)
+    cost_basis_avg[closed] = 0.0
+    avg_before = np.where(group_start, 0.0, np.r_[0.0, cost_basis_avg[:-1]])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg_removed = np.where(held_before > 0, avg_before * matched / held_before, 0.0)
+    realized_avg = np.where(is_sell, matched * price - avg_removed - fee_share, 0.0)
+
+    return (realized_fifo, realized_avg, position_qty, cost_basis_fifo, cost_basis_avg,
+            unmatched_qty, remaining_qty)
+
+
+def lot_ledger(trades_df):
+    """
+    Per-trade lot accounting results.
+
+    Output: trade columns (sorted by portfolio, symbol, date, trade_id) plus
+            realized_pnl, realized_pnl_avg_cost, position_quantity, cost_basis,
+            cost_basis_avg_cost, unmatched_sell_quantity, remaining_quantity
+    """
+    df = trades_df[TRADE_COLUMNS].sort_values(KEY_COLUMNS + ['trade_date', 'trade_id']).reset_index(drop=True)
+    key_codes = df.groupby(KEY_COLUMNS, sort=False).ngroup().to_numpy(np.int64)
+
+    matcher = match_lots if NUMBA_AVAILABLE else match_lots_vectorized
+    (realized_fifo, realized_avg, position_qty, cost_basis_fifo, cost_basis_avg,
+     unmatched_qty, remaining_qty) = matcher(
+        key_codes,
+        (df['trade_type'] == 'SELL').to_numpy(),
+        df['quantity'].to_numpy(np.float64),
+        df['price'].to_numpy(np.float64),
+        df['fee'].fillna(0).to_numpy(np.float64),
+    )
+
+    df['realized_pnl'] = realized_fifo
+    df['realized_pnl_avg_cost'] = realized_avg
+    df['position_quantity'] = position_qty
+    df['cost_basis'] = cost_basis_fifo
+    df['cost_basis_avg_cost'] = cost_basis_avg
+    df['unmatched_sell_quantity'] = unmatched_qty
+    df['remaining_quantity'] = remaining_qty
+    return df
+
+
+def _summarize(ledger):
+    """
+    Reduce a per-trade ledger to (daily P&L / cost basis, open lots).
+    """
+    is_sell = ledger['trade_type'] == 'SELL'
+    ledger = ledger.assign(
+        buy_quantity=ledger['quantity'].where(~is_sell, 0.0),
+        sell_quantity=ledger['quantity'].where(is_sell, 0.0),
+    )
+    keys = KEY_COLUMNS + ['trade_date']
+    grouped = ledger.groupby(keys, sort=False)
+    daily = grouped.agg(
+        portfolio_name=('portfolio_name', 'first'),
+        trades=('trade_id', 'size'),
+        buy_quantity=('buy_quantity', 'sum'),
+        sell_quantity=('sell_quantity', 'sum'),
+        realized_pnl=('realized_pnl', 'sum'),
+        realized_pnl_avg_cost=('realized_pnl_avg_cost', 'sum'),
+        unmatched_sell_quantity=('unmatched_sell_quantity', 'sum'),
+        position_quantity=('position_quantity', 'last'),
+        cost_basis=('cost_basis', 'last'),
+        cost_basis_avg_cost=('cost_basis_avg_cost', 'last'),
+    ).reset_index().rename(columns={'trade_date': 'date'})
+
+    by_key = daily.groupby(KEY_COLUMNS, sort=False)
+    daily['cumulative_realized_pnl'] = by_key['realized_pnl'].cumsum()
+    daily['cumulative_realized_pnl_avg_cost'] = by_key['realized_pnl_avg_cost'].cumsum()
+    held = daily['position_quantity'] > 0
+    daily['avg_cost'] = (daily['cost_basis'] / daily['position_quantity']).where(held)
+
+    daily = daily[['portfolio_id', 'portfolio_name', 'symbol', 'date', 'trades',
+                   'buy_quantity', 'sell_quantity', 'unmatched_sell_quantity',
+                   'realized_pnl', 'cumulative_realized_pnl',
+                   'realized_pnl_avg_cost', 'cumulative_realized_pnl_avg_cost',
+                   'position_quantity', 'cost_basis', 'cost_basis_avg_cost', 'avg_cost']]
+
+    lots = ledger[(~is_sell) & (ledger['remaining_quantity'] > 0)]
+    lots = pd.DataFrame({
+        'portfolio_id': lots['portfolio_id'],
+        'portfolio_name': lots['portfolio_name'],
+        'symbol': lots['symbol'],
+        'trade_id': lots['trade_id'],
+        'acquired_date': lots['trade_date'],
+        'original_quantity': lots['quantity'],
+        'remaining_quantity': lots['remaining_quantity'],
+        'unit_cost': (lots['quantity'] * lots['price'] + lots['fee'].fillna(0)) / lots['quantity'],
+    })
+    lots['remaining_cost'] = lots['remaining_quantity'] * lots['unit_cost']
+    return daily.reset_index(drop=True), lots.reset_index(drop=True)
+
+
+def _process_partition(trades_df):
+    """Worker entry point: lot-match one partition of trades."""
+    return _summarize(lot_ledger(trades_df))
+
+
+def _process_spilled_partition(paths):
+    """Worker entry point: load a partition spilled by process_trades_file and match it."""
+    frames = [pd.read_pickle(path) for path in paths]
+    return _process_partition(pd.concat(frames, ignore_index=True))
+
+
+def partition_codes(trades_df, partitions):
+    """Stable partition number per trade, hashed on (portfolio_id, symbol)."""
+    keys = (trades_df['portfolio_id'].astype(str) + '|' + trades_df['symbol'].astype(str)).to_numpy(object)
+    return (pd.util.hash_array(keys) % np.uint64(partitions)).astype(np.int64)
+
+
+def _combine(results):
+    """Concatenate per-partition results into sorted, rounded (daily, lots) frames."""
+    daily = pd.concat([r[0] for r in results], ignore_index=True)
+    lots = pd.concat([r[1] for r in results], ignore_index=True)
+    daily = daily.sort_values(KEY_COLUMNS + ['date']).reset_index(drop=True)
+    lots = lots.sort_values(KEY_COLUMNS + ['acquired_date', 'trade_id']).reset_index(drop=True)
+    daily = daily.round({'buy_quantity': 8, 'sell_quantity': 8, 'unmatched_sell_quantity': 8,
+                         'realized_pnl': 2, 'cumulative_realized_pnl': 2,
+                         'realized_pnl_avg_cost': 2, 'cumulative_realized_pnl_avg_cost': 2,
+                         'position_quantity': 8, 'cost_basis': 2, 'cost_basis_avg_cost': 2, 'avg_cost': 8})
+    lots = lots.round({'remaining_quantity': 8, 'unit_cost': 8, 'remaining_cost': 2})
+    return daily, lots
+
+
+def process_trades(trades_df, workers=None, partitions=None):
+    """
+    Lot-match an in-memory trade table.
+
+    Args:
+        trades_df: Trades with the TRADE_COLUMNS fields
+        workers: Processes (default: all cores once the table reaches PARALLEL_MIN_TRADES, else 1)
+        partitions: Number of (portfolio, symbol) hash partitions (default: 4 per worker)
+
+    Returns:
+        (daily_df, lots_df) - realized P&L / cost basis per (portfolio, symbol, date)
+        and the lots still open after the last trade
+    """
+    if workers is None:
+        workers = (os.cpu_count() or 1) if len(trades_df) >= PARALLEL_MIN_TRADES else 1
+    if workers <= 1:
+        return _combine([_process_partition(trades_df)])
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    partitions = partitions or workers * 4
+    codes = partition_codes(trades_df, partitions)
+    parts = [trades_df[codes == p] for p in range(partitions)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(_process_partition, [p for p in parts if len(p)]))
+    return _combine(results)
+
+
+def process_trades_file(path, workers=None, partitions=None, chunksize=CHUNK_SIZE):
+    """
+    Lot-match a trades CSV that may not fit in memory.
+
+    The file is read in chunks and each chunk is split by (portfolio, symbol) hash
+    into partition spill files; the partitions are then matched in parallel.
+    Memory use is bounded by the largest partition rather than the whole file.
+
+    Returns:
+        (daily_df, lots_df) as for process_trades()
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    workers = workers or os.cpu_count() or 1
+    partitions = partitions or workers * 4
+    spilled = [[] for _ in range(partitions)]
+
+    with tempfile.TemporaryDirectory(prefix='cryptorisk_lots_') as spill_dir:
+        reader = pd.read_csv(path, usecols=TRADE_COLUMNS, parse_dates=['trade_date'], chunksize=chunksize)
+        for chunk_number, chunk in enumerate(reader):
+            codes = partition_codes(chunk, partitions)
+            for p in np.unique(codes):
+                spill_path = Path(spill_dir) / f"part{p:04d}_{chunk_number:06d}.pkl"
+                chunk[codes == p].to_pickle(spill_path)
+                spilled[p].append(spill_path)
+
+        jobs = [paths for paths in spilled if paths]
+        if workers <= 1:
+            results = [_process_spilled_partition(paths) for paths in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(_process_spilled_partition, jobs))
+    return _combine(results)
+
+
+def trades_hash(trades_df):
+    """Hex digest of the TRADE_COLUMNS values; the wrapping sum of row hashes ignores row order."""
+    row_hashes = pd.util.hash_pandas_object(trades_df[TRADE_COLUMNS], index=False).to_numpy()
+    return format(int(row_hashes.sum(dtype=np.uint64)), '016x')
+
+
+def shared_lots(trades_df):
+    """
+    Return process_trades(trades_df), reusing a result computed earlier in this process.
+
+    Keyed by the row count and a content hash of the trade columns, so the realized P&L
+    and open-lots KPI tables share one matching pass and edited trades are re-matched.
+    """
+    fingerprint = (len(trades_df), trades_hash(trades_df))
+    if fingerprint not in _shared:
+        _shared.clear()
+        _shared[fingerprint] = process_trades(trades_df)
+    return _shared[fingerprint]
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+CryptoRisk Analytics - Pipeline Instrumentation
+Records wall time, CPU time, peak memory, rows in/out and bytes written for each
+pipeline stage and writes a structured JSON run report plus a summary table.
+
+Usage inside a pipeline script:
+
+    run = start_run('prepare_crypto_data', output_dir=DATA_DIR)
+
+    @instrument_stage()
+    def generate_trades(positions_df): ...
+
+    with run.stage('custom step', rows_in=len(df)) as stage:
+        ...
+        stage.rows_out = len(result)
+
+    run.finish(DATA_DIR / 'run_report_prepare_crypto_data.json')
+
+Optional per-stage captures (cProfile .prof files, tracemalloc top allocations)
+are enabled with profile=True / trace_memory=True, or the CRYPTORISK_PROFILE=1 /
+CRYPTORISK_TRACEMALLOC=1 environment variables. Only the standard library is
+imported so instrumenting a script adds no start-up cost.
+"""
+
+import contextlib
+import cProfile
+import functools
+import json
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import resource  # Unix only
+except ImportError:
+    resource = None
+
+TOP_N = 10
+
+_active_run = None
+
+
+def current_rss_mb():
+    """Current resident set size in MB (Linux /proc, falls back to peak RSS)."""
+    if resource is None:
+        return 0.0
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / (1024 * 1024)
+    except OSError:
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB."""
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _reset_peak_rss():
+    """
+    Reset the kernel's peak-RSS counter (Linux VmHWM) so each stage gets its own peak.
+
+    This also resets ru_maxrss, so callers keep their own running maxima.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _stage_peak_rss_mb():
+    """Peak RSS since the last _reset_peak_rss() call, in MB."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return peak_rss_mb()
+
+
+def _row_count(value):
+    """Rows in a DataFrame-like value (or the sum over a tuple of them)."""
+    if isinstance(value, tuple):
+        counts = [_row_count(v) for v in value]
+        counts = [c for c in counts if c is not None]
+        return sum(counts) if counts else None
+    if hasattr(value, 'shape') and hasattr(value, '__len__'):
+        return len(value)
+    return None
+
+
+def _written_bytes(directory, since):
+    """Total size of files under directory modified at or after `since` (epoch seconds)."""
+    if directory is None or not Path(directory).exists():
+        return 0
+    total = 0
+    for path in Path(directory).rglob('*'):
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        if path.is_file() and stat.st_mtime >= since:
+            total += stat.st_size
+    return total
+
+
+class StageRecord:
+    """Measurements for one stage; rows_out/bytes_written may be set by the caller."""
+
+    def __init__(self, name, rows_in=None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.bytes_written = None
+        self.status = 'ok'
+        self.error = None
+        self.metrics = {}
+
+    def to_dict(self):
+        return {
+            'stage': self.name,
+            'status': self.status,
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'bytes_written': self.bytes_written,
+            **self.metrics,
+            **({'error': self.error} if self.error else {}),
+        }
+
+
+class PipelineRun:
+    """Collects StageRecords for one pipeline execution."""
+
+    def __init__(self, name, output_dir=None, profile=False, trace_memory=False):
+        self.name = name
+        self.output_dir = Path(output_dir) if output_dir else None
+        self.profile = profile
+        self.trace_memory = trace_memory
+        self.started_at = datetime.now()
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.process_time()
+        self._depth = 0
+        self._peak_rss = 0.0       # Running max of every peak seen; resets hide earlier ones
+        self._open_peaks = []      # Peak so far of each enclosing stage, innermost last
+        self.stages = []
+        self.finished = False
+
+    @contextlib.contextmanager
+    def stage(self, name, rows_in=None):
+        """Context manager measuring one stage. Yields the StageRecord."""
+        record = StageRecord(name, rows_in)
+        outermost = self._depth == 0
+        self._depth += 1
+
+        profiler = cProfile.Profile() if self.profile and outermost else None
+        started_tracing = False
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            tracemalloc.reset_peak()
+
+        # Fold the high-water mark reached so far into the run and every enclosing
+        # stage before resetting it, so a nested stage does not hide their peaks
+        self._fold_peak(_stage_peak_rss_mb())
+        peak_reset = _reset_peak_rss()
+        self._open_peaks.append(0.0)
+        rss_before = current_rss_mb()
+        peak_before = _stage_peak_rss_mb()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        epoch_start = time.time()
+        if profiler:
+            profiler.enable()
+
+        try:
+            yield record
+        except BaseException as e:
+            record.status = 'error'
+            record.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            if profiler:
+                profiler.disable()
+            wall_time = time.perf_counter() - wall_start
+            cpu_time = time.process_time() - cpu_start
+            peak_rss = max(self._open_peaks.pop(), _stage_peak_rss_mb())
+            self._fold_peak(peak_rss)
+            if not peak_reset and peak_rss <= peak_before:
+                # The high-water mark only moves if this stage set a new one; otherwise
+                # the RSS across the stage is the best available bound.
+                peak_rss = max(rss_before, current_rss_mb())
+
+            record.metrics.update({
+                'wall_time_s': round(wall_time, 4),
+                'cpu_time_s': round(cpu_time, 4),
+                'rss_before_mb': round(rss_before, 1),
+                'peak_rss_mb': round(peak_rss, 1),
+                'peak_mem_delta_mb': round(max(0.0, peak_rss - rss_before), 1),
+            })
+            if record.bytes_written is None:
+                record.bytes_written = _written_bytes(self.output_dir, epoch_start)
+
+            if self.trace_memory:
+                _, traced_peak = tracemalloc.get_traced_memory()
+                top = tracemalloc.take_snapshot().statistics('lineno')[:TOP_N]
+                record.metrics['tracemalloc_peak_mb'] = round(traced_peak / (1024 * 1024), 2)
+                record.metrics['top_allocations'] = [
+                    {'location': str(stat.traceback), 'size_kb': round(stat.size / 1024, 1)} for stat in top
+                ]
+                if started_tracing:
+                    tracemalloc.stop()
+
+            if profiler:
+                record.metrics.update(self._profile_summary(profiler, name))
+
+            self._depth -= 1
+            self.stages.append(record)
+
+    def _fold_peak(self, peak_mb):
+        self._peak_rss = max(self._peak_rss, peak_mb)
+        self._open_peaks = [max(p, peak_mb) for p in self._open_peaks]
+
+    def _profile_summary(self, profiler, stage_name):
+        summary = {}
+        if self.output_dir is not None:
+            profile_dir = self.output_dir / 'profiles'
+            profile_dir.mkdir(parents=True, exist_ok=True)
+            profile_path = profile_dir / f"{self.name}_{stage_name}.prof"
+            profiler.dump_stats(profile_path)
+            summary['profile_file'] = str(profile_path)
+
+        stats = pstats.Stats(profiler).sort_stats('cumulative')
+        top = []
+        for func in stats.fcn_list[:TOP_N]:
+            calls, _, total_time, cumulative_time, _ = stats.stats[func]
+            top.append({
+                'function': f"{Path(func[0]).name}:{func[1]}({func[2]})",
+                'calls': calls,
+                'total_time_s': round(total_time, 4),
+                'cumulative_time_s': round(cumulative_time, 4),
+            })
+        summary['top_functions'] = top
+        return summary
+
+    def report(self):
+        """Structured run report as a dict."""
+        return {
+            'run': self.name,
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'wall_time_s': round(time.perf_counter() - self._start_wall, 4),
+            'cpu_time_s': round(time.process_time() - self._start_cpu, 4),
+            'peak_rss_mb': round(max(self._peak_rss, _stage_peak_rss_mb()), 1),
+            'stages': [s.to_dict() for s in self.stages],
+        }
+
+    def summary_table(self):
+        """Fixed-width summary of all stages in run order; the slowest is marked with ⏱."""
+        header = f"{'Stage':<45} {'Wall s':>9} {'CPU s':>9} {'ΔMem MB':>9} {'Rows in':>11} {'Rows out':>11} {'MB out':>8}"
+        lines = [header, '-' * len(header)]
+        slowest = max(self.stages, key=lambda s: s.metrics.get('wall_time_s', 0), default=None)
+        for record in self.stages:
+            m = record.metrics
+            marker = ' ⏱' if record is slowest else ''
+            rows_in = f"{record.rows_in:,}" if record.rows_in is not None else '-'
+            rows_out = f"{record.rows_out:,}" if record.rows_out is not None else '-'
+            mb_out = f"{(record.bytes_written or 0) / (1024 * 1024):.2f}"
+            lines.append(f"{record.name:<45} {m.get('wall_time_s', 0):>9.3f} {m.get('cpu_time_s', 0):>9.3f} "
+                         f"{m.get('peak_mem_delta_mb', 0):>9.1f} {rows_in:>11} {rows_out:>11} {mb_out:>8}{marker}")
+        return '\n'.join(lines)
+
+    def finish(self, report_path=None):
+        """Stop the run, write the JSON report (if a path is given) and print the summary."""
+        global _active_run
+        report = self.report()
+        if report_path is not None:
+            report_path = Path(report_path)
+            report_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(report_path, 'w') as f:
+                json.dump(report, f, indent=2, default=str)
+
+        print("\n⏱  Stage timings:")
+        print(self.summary_table())
+        if report_path is not None:
+            print(f"\n✓ Run report written to {report_path}")
+
+        self.finished = True
+        if _active_run is self:
+            _active_run = None
+        return report
+
+
+def start_run(name, output_dir=None, profile=None, trace_memory=None):
+    """Start a run and make it the target of @instrument_stage-decorated functions."""
+    global _active_run
+    if profile is None:
+        profile = os.environ.get('CRYPTORISK_PROFILE') == '1'
+    if trace_memory is None:
+        trace_memory = os.environ.get('CRYPTORISK_TRACEMALLOC') == '1'
+    _active_run = PipelineRun(name, output_dir, profile, trace_memory)
+    return _active_run
+
+
+def active_run():
+    """The run currently recording stages, or None."""
+    return _active_run
+
+
+def instrument_stage(name=None):
+    """
+    Decorator recording a function call as a stage of the active run.
+
+    rows_in is taken from the first DataFrame-like argument and rows_out from the
+    return value. Without an active run the function is called directly.
+    """
+    def decorator(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            run = _active_run
+            if run is None:
+                return func(*args, **kwargs)
+            rows_in = next((_row_count(a) for a in args if _row_count(a) is not None), None)
+            with run.stage(stage_name, rows_in=rows_in) as record:
+                result = func(*args, **kwargs)
+                record.rows_out = _row_count(result)
+            return result
+
+        return wrapper
+
+    return decorator
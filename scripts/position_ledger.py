@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+CryptoRisk Analytics - Position Ledger
+Daily positions derived from the trade history instead of fabricated snapshots,
+so positions and trades reconcile by construction.
+
+Signed trade quantities (BUY +, SELL -) are netted per (portfolio, symbol, date),
+cumulatively summed per (portfolio, symbol) and held from each position's first
+trade onward over the price dates, then valued at the day's close. Quantities are
+plain running sums: a SELL larger than the holding leaves a negative (short)
+quantity, flagged with is_short.
+
+Quantities live in (key x date) arrays with spare capacity, one row per
+(portfolio, symbol) key. New trades add their cumulative sums to the cells of the
+keys they touch on and after each key's first new trade date; new price dates
+append columns that carry the last quantities forward. Nothing else is rewritten,
+copied or sorted. State saved after a run (an .npz file) is reused by the next one
+when the trades up to its watermark and the price dates it covered are unchanged,
+so the daily refresh costs time proportional to the new trades and dates rather
+than the full history.
+
+Usage:
+    ledger = PositionLedger.from_trades(trades_df, prices_df, state_path=DATA_DIR / STATE_FILE)
+    positions_df = ledger.positions
+    ledger.update(new_trades_df, prices_df)
+"""
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from price_matrix_store import prices_fingerprint, shared_matrices
+
+# Configuration
+STATE_FILE = 'position_ledger_state.npz'
+KEY_COLUMNS = ['portfolio_id', 'symbol']
+LEDGER_COLUMNS = ['portfolio_id', 'portfolio_name', 'symbol', 'as_of_date', 'quantity',
+                  'net_quantity_change', 'trade_count', 'current_price', 'position_value', 'is_short']
+GROWTH = 1.5               # capacity factor when the key or date arrays fill up
+
+
+def price_dates(prices_df):
+    """Sorted distinct price dates."""
+    return pd.DatetimeIndex(np.sort(pd.to_datetime(prices_df['date']).unique()))
+
+
+def signed_quantities(trades_df):
+    """Trade quantities signed by side (BUY +, SELL -)."""
+    return np.where(trades_df['trade_type'] == 'SELL', -1.0, 1.0) * trades_df['quantity'].to_numpy(float)
+
+
+def signed_flows(trades_df, dates):
+    """
+    Net signed quantity and trade count per (portfolio, symbol, price date).
+
+    Trades on a date without prices are booked on the next price date; trades after
+    the last price date are left out (they are picked up once prices catch up).
+    """
+    trade_dates = pd.to_datetime(trades_df['trade_date'])
+    date_index = dates.searchsorted(trade_dates, side='left')
+    in_range = date_index < len(dates)
+    signed = signed_quantities(trades_df)
+
+    flows = pd.DataFrame({
+        'portfolio_id': trades_df['portfolio_id'].to_numpy()[in_range],
+        'portfolio_name': trades_df['portfolio_name'].to_numpy()[in_range],
+        'symbol': trades_df['symbol'].to_numpy()[in_range],
+        'date_index': date_index[in_range],
+        'net_quantity_change': signed[in_range],
+    })
+    return flows.groupby(KEY_COLUMNS + ['date_index'], sort=True).agg(
+        portfolio_name=('portfolio_name', 'first'),
+        net_quantity_change=('net_quantity_change', 'sum'),
+        trade_count=('net_quantity_change', 'size'),
+    ).reset_index()
+
+
+def trades_fingerprint(trades_df):
+    """
+    (count, content hash) of the trades' portfolio, symbol, trade date and signed quantity.
+
+    The hash is the wrapping sum of per-row hashes, so it does not depend on row order
+    and the fingerprints of disjoint batches of trades add up (see combine_fingerprints).
+    """
+    rows = trades_df[KEY_COLUMNS].assign(
+        trade_date=pd.to_datetime(trades_df['trade_date']).astype('datetime64[ns]'),
+        signed_quantity=signed_quantities(trades_df),
+    )
+    row_hashes = pd.util.hash_pandas_object(rows, index=False).to_numpy()
+    return len(trades_df), int(row_hashes.sum(dtype=np.uint64))
+
+
+def combine_fingerprints(a, b):
+    """Fingerprint of the union of two disjoint batches of trades."""
+    return a[0] + b[0], (a[1] + b[1]) % 2**64
+
+
+def reserve(array, rows, columns, fill):
+    """Return array with capacity for at least rows x columns, growing it by GROWTH when full."""
+    capacity = array.shape
+    if rows <= capacity[0] and columns <= capacity[1]:
+        return array
+    shape = (capacity[0] if rows <= capacity[0] else max(rows, int(capacity[0] * GROWTH)),
+             capacity[1] if columns <= capacity[1] else max(columns, int(capacity[1] * GROWTH)))
+    grown = np.full(shape, fill, dtype=array.dtype)
+    grown[:capacity[0], :capacity[1]] = array
+    return grown
+
+
+class PositionLedger:
+    """Daily positions per (portfolio, symbol) maintained from trades."""
+
+    def __init__(self):
+        self.dates = pd.DatetimeIndex([])
+        self.watermark = None
+        self.fingerprint = (0, 0)
+        # One entry per (portfolio, symbol) key, in the order the keys were first seen
+        self._keys = pd.MultiIndex.from_arrays([[], []], names=KEY_COLUMNS)
+        self._names = np.array([], dtype=object)
+        self._start = np.array([], dtype=np.int64)
+        self._key_symbol = np.array([], dtype=np.int64)
+        # (key x date) arrays; cells before a key's start date are unused
+        self._quantity = np.full((0, 0), np.nan)
+        self._net_change = np.zeros((0, 0))
+        self._trade_count = np.zeros((0, 0), dtype=np.int64)
+        # (symbol x date) closes of the traded symbols
+        self._symbols = pd.Index([], dtype=object)
+        self._close = np.full((0, 0), np.nan)
+
+    @classmethod
+    def from_trades(cls, trades_df, prices_df, state_path=None):
+        """
+        Build a ledger from trades and prices, resuming from saved state when possible.
+
+        Saved state is reused if its price dates are a prefix of the current ones and the
+        trades up to its watermark match what it processed; only later trades and price
+        dates are applied. Otherwise the ledger is rebuilt from all trades.
+        """
+        dates = price_dates(prices_df)
+        trade_dates = pd.to_datetime(trades_df['trade_date'])
+        ledger = None
+        if state_path is not None and Path(state_path).exists():
+            ledger = cls.load(state_path)
+            known = ledger.dates
+            seen = trades_df[trade_dates <= ledger.watermark] if ledger.watermark is not None else trades_df.iloc[:0]
+            if (len(known) > len(dates) or not known.equals(dates[:len(known)])
+                    or trades_fingerprint(seen) != ledger.fingerprint):
+                ledger = None
+        if ledger is None:
+            ledger = cls()
+        ledger.extend(prices_df)
+        new_trades = trades_df[trade_dates > ledger.watermark] if ledger.watermark is not None else trades_df
+        ledger.update(new_trades, prices_df)
+        return ledger
+
+    def __len__(self):
+        return int((len(self.dates) - self._start).sum())
+
+    @property
+    def positions(self):
+        """Ledger rows in LEDGER_COLUMNS order, sorted by portfolio, symbol and date."""
+        n_dates = len(self.dates)
+        # Only the keys are sorted; each key's rows are already in date order
+        order = self._keys.argsort()
+        lengths = n_dates - self._start[order]
+        row_key = np.repeat(order, lengths)
+        offsets = np.cumsum(lengths) - lengths
+        row_date = np.arange(int(lengths.sum())) - np.repeat(offsets, lengths) + np.repeat(self._start[order], lengths)
+
+        quantity = self._quantity[row_key, row_date]
+        current_price = self._close[self._key_symbol[row_key], row_date]
+        return pd.DataFrame({
+            'portfolio_id': self._keys.get_level_values('portfolio_id')[row_key],
+            'portfolio_name': self._names[row_key],
+            'symbol': self._keys.get_level_values('symbol')[row_key],
+            'as_of_date': self.dates[row_date],
+            'quantity': quantity,
+            'net_quantity_change': self._net_change[row_key, row_date],
+            'trade_count': self._trade_count[row_key, row_date],
+            'current_price': current_price,
+            'position_value': quantity * current_price,
+            'is_short': quantity < 0,
+        })[LEDGER_COLUMNS]
+
+    def _closes(self, prices_df, symbols, dates):
+        """(symbol x date) close prices from the shared price matrices (NaN where missing)."""
+        close = shared_matrices(prices_df).frame('close', start=dates[0], end=dates[-1])
+        return close.reindex(index=dates, columns=symbols).to_numpy(dtype=float).T
+
+    def extend(self, prices_df):
+        """
+        Carry every key's last quantity forward over price dates the ledger has not seen.
+
+        Returns the number of rows added.
+        """
+        dates = price_dates(prices_df)
+        first, last = len(self.dates), len(dates)
+        self.dates = dates
+        if last == first:
+            return 0
+
+        n_keys, n_symbols = len(self._keys), len(self._symbols)
+        self._quantity = reserve(self._quantity, n_keys, last, np.nan)
+        self._net_change = reserve(self._net_change, n_keys, last, 0.0)
+        self._trade_count = reserve(self._trade_count, n_keys, last, 0)
+        self._close = reserve(self._close, n_symbols, last, np.nan)
+        if n_symbols:
+            self._close[:n_symbols, first:last] = self._closes(prices_df, self._symbols, dates[first:])
+        if n_keys:
+            self._quantity[:n_keys, first:last] = self._quantity[:n_keys, first - 1:first]
+        return n_keys * (last - first)
+
+    def _add_keys(self, keys, names, prices_df):
+        """Append rows for (portfolio, symbol) keys not in the ledger yet."""
+        new_symbols = keys.get_level_values('symbol').unique().difference(self._symbols)
+        if len(new_symbols):
+            n_symbols = len(self._symbols)
+            self._symbols = self._symbols.append(new_symbols)
+            self._close = reserve(self._close, len(self._symbols), len(self.dates), np.nan)
+            self._close[n_symbols:len(self._symbols), :len(self.dates)] = self._closes(prices_df, new_symbols, self.dates)
+
+        self._keys = self._keys.append(keys)
+        self._names = np.concatenate([self._names, names])
+        self._start = np.concatenate([self._start, np.full(len(keys), len(self.dates), dtype=np.int64)])
+        self._key_symbol = np.concatenate([self._key_symbol, self._symbols.get_indexer(keys.get_level_values('symbol'))])
+        n_keys = len(self._keys)
+        self._quantity = reserve(self._quantity, n_keys, len(self.dates), np.nan)
+        self._net_change = reserve(self._net_change, n_keys, len(self.dates), 0.0)
+        self._trade_count = reserve(self._trade_count, n_keys, len(self.dates), 0)
+
+    def update(self, new_trades_df, prices_df):
+        """
+        Apply new trades. Only the cells of the (portfolio, symbol) keys they touch, from
+        each key's first new trade date onward, are rewritten.
+
+        Call extend() first when prices_df has new dates (from_trades does both).
+        Returns the number of rows rewritten.
+        """
+        if len(self.dates) == 0:
+            self.extend(prices_df)
+        flows = signed_flows(new_trades_df, self.dates)
+        if flows.empty:
+            return 0
+
+        # Flows are sorted by key and date, so each key's first flow is its first new date
+        by_key = flows.groupby(KEY_COLUMNS, sort=False)
+        touched = by_key.agg(first=('date_index', 'min'), portfolio_name=('portfolio_name', 'first'))
+        rows = self._keys.get_indexer(touched.index)
+        unseen = rows < 0
+        if unseen.any():
+            rows[unseen] = np.arange(len(self._keys), len(self._keys) + unseen.sum())
+            self._add_keys(touched.index[unseen], touched['portfolio_name'].to_numpy()[unseen], prices_df)
+
+        # Cells from each touched key's first new date to the last date, key by key
+        first = touched['first'].to_numpy()
+        lengths = len(self.dates) - first
+        offsets = np.cumsum(lengths) - lengths
+        cell_key = np.repeat(rows, lengths)
+        cell_date = np.arange(int(lengths.sum())) - np.repeat(offsets, lengths) + np.repeat(first, lengths)
+
+        # Cumulative new quantity at each flow, forward filled; every key's cells start on a flow
+        flow_key = by_key.ngroup().to_numpy()
+        flow_dates = flows['date_index'].to_numpy()
+        flow_cells = offsets[flow_key] + flow_dates - first[flow_key]
+        delta = np.full(len(cell_key), np.nan)
+        delta[flow_cells] = by_key['net_quantity_change'].cumsum().to_numpy()
+        delta = pd.Series(delta).ffill().to_numpy()
+
+        held = self._quantity[cell_key, cell_date]
+        held = np.where(cell_date < np.repeat(self._start[rows], lengths), 0.0, held)
+        self._quantity[cell_key, cell_date] = held + delta
+        self._start[rows] = np.minimum(self._start[rows], first)
+        self._net_change[rows[flow_key], flow_dates] += flows['net_quantity_change'].to_numpy()
+        self._trade_count[rows[flow_key], flow_dates] += flows['trade_count'].to_numpy()
+
+        # Trades after the last price date were not booked; leave them for the next update
+        trade_dates = pd.to_datetime(new_trades_df['trade_date'])
+        booked = new_trades_df[trade_dates <= self.dates[-1]]
+        if len(booked):
+            self.fingerprint = combine_fingerprints(self.fingerprint, trades_fingerprint(booked))
+            latest = trade_dates[trade_dates <= self.dates[-1]].max()
+            self.watermark = latest if self.watermark is None else max(self.watermark, latest)
+        return len(cell_key)
+
+    def save(self, path):
+        """Persist the ledger arrays, price dates and trade watermark for incremental reuse."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        n_keys, n_symbols, n_dates = len(self._keys), len(self._symbols), len(self.dates)
+        np.savez_compressed(
+            path,
+            dates=self.dates.to_numpy(),
+            portfolio_ids=self._keys.get_level_values('portfolio_id').to_numpy(dtype=str),
+            key_symbols=self._keys.get_level_values('symbol').to_numpy(dtype=str),
+            portfolio_names=self._names.astype(str),
+            start=self._start,
+            quantity=self._quantity[:n_keys, :n_dates],
+            net_quantity_change=self._net_change[:n_keys, :n_dates],
+            trade_count=self._trade_count[:n_keys, :n_dates],
+            symbols=self._symbols.to_numpy(dtype=str),
+            close=self._close[:n_symbols, :n_dates],
+            watermark=np.datetime64(self.watermark if self.watermark is not None else 'NaT', 'ns'),
+            trades_seen=np.int64(self.fingerprint[0]),
+            trades_hash=np.uint64(self.fingerprint[1]),
+        )
+
+    @classmethod
+    def load(cls, path):
+        """Load a ledger saved with save()."""
+        data = np.load(path, allow_pickle=False)
+        ledger = cls()
+        ledger.dates = pd.DatetimeIndex(data['dates'])
+        ledger._keys = pd.MultiIndex.from_arrays([data['portfolio_ids'].astype(object), data['key_symbols'].astype(object)],
+                                                 names=KEY_COLUMNS)
+        ledger._names = data['portfolio_names'].astype(object)
+        ledger._start = data['start']
+        ledger._symbols = pd.Index(data['symbols'].astype(object))
+        ledger._key_symbol = ledger._symbols.get_indexer(ledger._keys.get_level_values('symbol'))
+        ledger._quantity = data['quantity']
+        ledger._net_change = data['net_quantity_change']
+        ledger._trade_count = data['trade_count']
+        ledger._close = data['close']
+        watermark = data['watermark'][()]
+        ledger.watermark = None if np.isnat(watermark) else pd.Timestamp(watermark)
+        ledger.fingerprint = (int(data['trades_seen']), int(data['trades_hash']))
+        return ledger
+
+
+_shared = {}
+
+
+def shared_ledger(trades_df, prices_df, state_path=None):
+    """
+    Return a PositionLedger for these inputs, reusing one built earlier in this process.
+
+    Keyed by the trades fingerprint and the prices fingerprint (rows, symbols, first/last
+    date, content hash).
+    """
+    fingerprint = (trades_fingerprint(trades_df), *prices_fingerprint(prices_df))
+    if fingerprint not in _shared:
+        _shared.clear()
+        _shared[fingerprint] = PositionLedger.from_trades(trades_df, prices_df, state_path=state_path)
+    return _shared[fingerprint]
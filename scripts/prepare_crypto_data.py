@@ -5,65 +5,150 @@ Downloads REAL cryptocurrency data from Yahoo Finance (yfinance) for Tableau Nex
 Includes data quality validation, risk calculations, and pre-joined outputs.
 """
 
+import json
 import pandas as pd
 import numpy as np
-import requests
-import os
 from datetime import datetime, timedelta
 from pathlib import Path
 import warnings
 warnings.filterwarnings('ignore')
 
-# Try to import yfinance
-try:
-    import yfinance as yf
-    YFINANCE_AVAILABLE = True
-    print("✓ yfinance library found - will fetch REAL data")
-except ImportError:
-    YFINANCE_AVAILABLE = False
-    print("⚠️  yfinance not found. Install with: pip install yfinance")
-    print("   Falling back to synthetic data generation")
+from anomaly_rules import FLAG_COLUMN, RULE_TYPES as ANOMALY_RULE_TYPES, apply_anomaly_rule
+from covariance_engine import pairwise_moments, shared_engine
+from pipeline_instrumentation import instrument_stage, start_run
+from price_matrix_store import shared_matrices
+from price_store import shared_store
+from synthetic_generator import symbol_ohlcv
+
+_yfinance = None
+
+def import_yfinance():
+    """Import yfinance on first use (it is slow to import). Returns the module or None."""
+    global _yfinance
+    if _yfinance is None:
+        try:
+            import yfinance
+            _yfinance = yfinance
+            print("✓ yfinance library found - will fetch REAL data")
+        except ImportError:
+            _yfinance = False
+            print("⚠️  yfinance not found. Install with: pip install yfinance")
+            print("   Falling back to synthetic data generation")
+    return _yfinance or None
 
 # Configuration
 DATA_DIR = Path(__file__).parent.parent / "data" / "raw"
-DATA_DIR.mkdir(parents=True, exist_ok=True)
 
 # Date ranges for analysis (UP TO TODAY!)
 # Extended to 2015 for more data volume (targeting 100MB+)
 START_DATE = "2015-01-01"
 END_DATE = datetime.now().strftime("%Y-%m-%d")  # TODAY!
 
-# Crypto universe (top assets by market cap)
-# Yahoo Finance tickers use -USD suffix (e.g., BTC-USD)
-# Extended list to generate more data (100MB+ target)
-CRYPTO_UNIVERSE = {
-    'BTC': {'name': 'Bitcoin', 'category': 'Layer 1', 'launch_year': 2009, 'yf_ticker': 'BTC-USD'},
-    'ETH': {'name': 'Ethereum', 'category': 'Layer 1', 'launch_year': 2015, 'yf_ticker': 'ETH-USD'},
-    'BNB': {'name': 'Binance Coin', 'category': 'Exchange Token', 'launch_year': 2017, 'yf_ticker': 'BNB-USD'},
-    'SOL': {'name': 'Solana', 'category': 'Layer 1', 'launch_year': 2020, 'yf_ticker': 'SOL-USD'},
-    'XRP': {'name': 'Ripple', 'category': 'Payment', 'launch_year': 2012, 'yf_ticker': 'XRP-USD'},
-    'ADA': {'name': 'Cardano', 'category': 'Layer 1', 'launch_year': 2017, 'yf_ticker': 'ADA-USD'},
-    'AVAX': {'name': 'Avalanche', 'category': 'Layer 1', 'launch_year': 2020, 'yf_ticker': 'AVAX-USD'},
-    'DOGE': {'name': 'Dogecoin', 'category': 'Meme', 'launch_year': 2013, 'yf_ticker': 'DOGE-USD'},
-    'DOT': {'name': 'Polkadot', 'category': 'Layer 0', 'launch_year': 2020, 'yf_ticker': 'DOT-USD'},
-    'MATIC': {'name': 'Polygon', 'category': 'Layer 2', 'launch_year': 2017, 'yf_ticker': 'MATIC-USD'},
-    'LINK': {'name': 'Chainlink', 'category': 'Oracle', 'launch_year': 2017, 'yf_ticker': 'LINK-USD'},
-    'UNI': {'name': 'Uniswap', 'category': 'DeFi', 'launch_year': 2020, 'yf_ticker': 'UNI-USD'},
-    'ATOM': {'name': 'Cosmos', 'category': 'Layer 0', 'launch_year': 2019, 'yf_ticker': 'ATOM-USD'},
-    'LTC': {'name': 'Litecoin', 'category': 'Payment', 'launch_year': 2011, 'yf_ticker': 'LTC-USD'},
-    'ALGO': {'name': 'Algorand', 'category': 'Layer 1', 'launch_year': 2019, 'yf_ticker': 'ALGO-USD'},
-    # Additional cryptos for more data volume
-    'BCH': {'name': 'Bitcoin Cash', 'category': 'Payment', 'launch_year': 2017, 'yf_ticker': 'BCH-USD'},
-    'SHIB': {'name': 'Shiba Inu', 'category': 'Meme', 'launch_year': 2020, 'yf_ticker': 'SHIB-USD'},
-    'TRX': {'name': 'Tron', 'category': 'Layer 1', 'launch_year': 2017, 'yf_ticker': 'TRX-USD'},
-    'ETC': {'name': 'Ethereum Classic', 'category': 'Layer 1', 'launch_year': 2015, 'yf_ticker': 'ETC-USD'},
-    'XLM': {'name': 'Stellar', 'category': 'Payment', 'launch_year': 2014, 'yf_ticker': 'XLM-USD'},
-    'AAVE': {'name': 'Aave', 'category': 'DeFi', 'launch_year': 2020, 'yf_ticker': 'AAVE-USD'},
-    'FIL': {'name': 'Filecoin', 'category': 'Storage', 'launch_year': 2020, 'yf_ticker': 'FIL-USD'},
-    'ICP': {'name': 'Internet Computer', 'category': 'Layer 1', 'launch_year': 2021, 'yf_ticker': 'ICP-USD'},
-    'VET': {'name': 'VeChain', 'category': 'Enterprise', 'launch_year': 2018, 'yf_ticker': 'VET-USD'},
-    'HBAR': {'name': 'Hedera', 'category': 'Enterprise', 'launch_year': 2019, 'yf_ticker': 'HBAR-USD'}
-}
+# Fewest days two symbols must both trade for their correlation to be reported
+MIN_CORRELATION_DAYS = 30
+
+# Optional date dimension written next to the prices file (one row per price date)
+DATE_TABLE_FILE = 'date_dimension.csv'
+
+def load_universe(path):
+    """
+    Load a crypto universe from a CSV or JSON file.
+    
+    CSV files need a symbol column plus any of name, category, launch_year, yf_ticker,
+    is_stablecoin, is_active. JSON files map symbol -> {name, category, ...}.
+    Missing yf_ticker values default to '<SYMBOL>-USD'.
+    """
+    path = Path(path)
+    if path.suffix.lower() == '.json':
+        with open(path) as f:
+            raw = json.load(f)
+    else:
+        raw = {row.pop('symbol'): row for row in pd.read_csv(path).to_dict('records')}
+    
+    def value(info, key, default):
+        item = info.get(key)
+        return default if item is None or (not isinstance(item, str) and pd.isna(item)) or item == '' else item
+    
+    universe = {}
+    for symbol, info in raw.items():
+        symbol = str(symbol).upper()
+        launch_year = value(info, 'launch_year', None)
+        universe[symbol] = {
+            'name': value(info, 'name', symbol),
+            'category': value(info, 'category', 'Other'),
+            'launch_year': int(launch_year) if launch_year is not None else None,
+            'yf_ticker': value(info, 'yf_ticker', f"{symbol}-USD"),
+            'is_stablecoin': bool(value(info, 'is_stablecoin', False)),
+            'is_active': bool(value(info, 'is_active', True)),
+        }
+    return universe
+
+def symbol_category(symbols):
+    """
+    Symbol column as a categorical: one integer code per row plus the sorted symbol list
+    (the universe and any other symbols present). Strings are hashed once, here.
+    """
+    categories = sorted(set(crypto_universe()) | set(pd.unique(symbols)))
+    return pd.Categorical(symbols, categories=categories)
+
+def symbol_codes(symbols, reference=None):
+    """
+    Integer codes for a symbol column.
+    
+    Without a reference, codes number the distinct symbols in sorted order, so
+    ordering or grouping by code matches ordering or grouping by symbol. With a
+    reference (sequence of symbols), codes are positions in it (-1 = not listed);
+    only the distinct symbols are looked up. Categorical columns (symbol_category)
+    reuse their codes; other columns are factorized, hashing each row once.
+    """
+    symbols = pd.Series(symbols)
+    if isinstance(symbols.dtype, pd.CategoricalDtype) and symbols.cat.categories.is_monotonic_increasing:
+        codes, uniques = symbols.cat.codes.to_numpy(), symbols.cat.categories
+    else:
+        codes, uniques = pd.factorize(symbols, sort=True)
+    if reference is None:
+        return codes
+    lookup = pd.Index(reference).get_indexer(uniques)
+    return np.where(codes >= 0, lookup[codes], -1)
+
+def date_dimension(dates):
+    """
+    Date attributes computed once per distinct date.
+    
+    Returns:
+        (codes, dim): codes maps each input row to its row in dim (-1 = missing date);
+        dim has one row per distinct date, in order, with date ('YYYY-MM-DD'), year,
+        month, quarter, day_of_week and is_weekend
+    """
+    codes, uniques = pd.factorize(pd.to_datetime(pd.Series(dates)), sort=True)
+    uniques = pd.DatetimeIndex(uniques)
+    dim = pd.DataFrame({
+        'date': uniques.strftime('%Y-%m-%d'),
+        'year': uniques.year,
+        'month': uniques.month,
+        'quarter': uniques.quarter,
+        'day_of_week': uniques.day_name(),
+        'is_weekend': uniques.dayofweek >= 5,
+    })
+    return codes, dim
+
+def broadcast_dates(dim, codes, columns=None):
+    """Rows of a date dimension (or some of its columns) repeated per input row, by code."""
+    dim = dim if columns is None else dim[columns]
+    rows = dim.take(codes) if (codes >= 0).all() else dim.reindex(codes)
+    return rows.reset_index(drop=True)
+
+def format_dates(dates):
+    """'YYYY-MM-DD' strings for a date column, formatting each distinct date once."""
+    codes, dim = date_dimension(dates)
+    return broadcast_dates(dim, codes, 'date').to_numpy()
+
+# Crypto universe (top assets by market cap), one row per symbol in config/crypto_universe.csv
+# Yahoo Finance tickers use -USD suffix (e.g., BTC-USD); any number of symbols is supported.
+# Loaded on first use (crypto_universe()), so importing this module never reads the file;
+# configure(universe=...) replaces it. Also readable as prepare_crypto_data.CRYPTO_UNIVERSE.
+UNIVERSE_FILE = Path(__file__).parent.parent / "config" / "crypto_universe.csv"
+_universe = None
 
 # Quality Rules
 QUALITY_RULES = {
@@ -71,14 +156,73 @@ QUALITY_RULES = {
         {'name': 'price > 0', 'field': 'close', 'type': 'range', 'min': 0.0000001, 'action': 'remove'},
         {'name': 'volume >= 0', 'field': 'volume', 'type': 'range', 'min': 0, 'auto_fix': 'cap'},
         {'name': 'valid date range', 'field': 'date', 'type': 'date_range', 'start': START_DATE, 'end': END_DATE, 'action': 'remove'},
-        {'name': 'no duplicate ticker-date', 'field': ['symbol', 'date'], 'type': 'unique', 'action': 'remove'}
+        {'name': 'no duplicate ticker-date', 'field': ['symbol', 'date'], 'type': 'unique', 'action': 'remove'},
+        # Anomaly rules (see anomaly_rules.py), evaluated per symbol over the whole panel
+        {'name': 'return spike (12 MADs, 31-day window)', 'field': 'close', 'type': 'outlier', 'method': 'mad',
+         'transform': 'log_return', 'window': 31, 'center': True, 'threshold': 12, 'min_scale': 0.001, 'action': 'flag'},
+        {'name': 'high >= low', 'field': ['high', 'low'], 'type': 'expression', 'expression': 'high >= low', 'action': 'remove'},
+        {'name': 'open/close within [low, high]', 'field': ['open', 'close'], 'type': 'expression',
+         'expression': '(low <= open <= high) and (low <= close <= high)', 'lower': 'low', 'upper': 'high', 'action': 'clip'},
+        {'name': 'zero-volume streak (3+ days)', 'field': 'volume', 'type': 'expression', 'expression': 'volume > 0',
+         'min_run': 3, 'action': 'flag'},
+        {'name': 'no calendar gaps', 'field': ['open', 'high', 'low', 'close'], 'type': 'calendar_gap', 'freq': '1D', 'action': 'flag'}
     ],
     'portfolio_positions': [
         {'name': 'quantity > 0', 'field': 'quantity', 'type': 'range', 'min': 0.0000001, 'action': 'remove'},
-        {'name': 'valid symbol', 'field': 'symbol', 'type': 'reference', 'valid_values': list(CRYPTO_UNIVERSE.keys()), 'action': 'remove'}
+        {'name': 'valid symbol', 'field': 'symbol', 'type': 'reference', 'valid_values': None, 'action': 'remove'}  # universe symbols
     ]
 }
 
+PRICE_COLUMNS = ['date', 'symbol', 'open', 'high', 'low', 'close', 'volume',
+                 'daily_return', 'ma_7', 'ma_30', 'volatility_30d',
+                 'bb_middle', 'bb_upper', 'bb_lower', 'bb_bandwidth', 'bb_percent', FLAG_COLUMN]
+
+def crypto_universe():
+    """The crypto universe, loaded from UNIVERSE_FILE the first time it is needed."""
+    global _universe
+    if _universe is None:
+        _universe = load_universe(UNIVERSE_FILE)
+        sync_quality_rules()
+    return _universe
+
+def __getattr__(name):
+    # Module attribute CRYPTO_UNIVERSE (e.g. `from prepare_crypto_data import CRYPTO_UNIVERSE`)
+    if name == 'CRYPTO_UNIVERSE':
+        return crypto_universe()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def sync_quality_rules():
+    """Point the quality rules at the configured date range and (once loaded) the universe symbols."""
+    for rule in QUALITY_RULES['crypto_prices']:
+        if rule['type'] == 'date_range':
+            rule['start'], rule['end'] = START_DATE, END_DATE
+    for rule in QUALITY_RULES['portfolio_positions']:
+        if rule['type'] == 'reference' and _universe is not None:
+            rule['valid_values'] = list(_universe.keys())
+
+def configure(data_dir=None, start_date=None, end_date=None, universe=None):
+    """
+    Override the module configuration before running stages.
+    
+    Keeps the quality rules (date range, valid symbols) in sync with the new settings.
+    
+    Args:
+        data_dir: Output directory for generated CSVs
+        start_date / end_date: 'YYYY-MM-DD' strings bounding the price history
+        universe: dict in CRYPTO_UNIVERSE format (see load_universe)
+    """
+    global DATA_DIR, START_DATE, END_DATE, _universe
+    if data_dir is not None:
+        DATA_DIR = Path(data_dir)
+    if start_date is not None:
+        START_DATE = start_date
+    if end_date is not None:
+        END_DATE = end_date
+    if universe is not None:
+        _universe = universe
+    
+    sync_quality_rules()
+
 def validate_and_clean_data(df, dataset_name, rules):
     """Validate data quality and clean according to rules."""
     print(f"\n🔍 Validating {dataset_name}...")
@@ -139,6 +283,8 @@ def validate_and_clean_data(df, dataset_name, rules):
                         print(f"      ✓ Removed duplicate records")
         
         elif rule_type == 'reference':
+            if rule.get('valid_values', []) is None:
+                crypto_universe()  # universe-backed rule, filled on first load
             valid_values = rule.get('valid_values', [])
             if field in df.columns and valid_values:
                 invalid = df[~df[field].isin(valid_values)]
@@ -148,6 +294,13 @@ def validate_and_clean_data(df, dataset_name, rules):
                     if rule.get('action') == 'remove':
                         df = df[df[field].isin(valid_values)]
                         print(f"      ✓ Removed invalid records")
+        
+        elif rule_type in ANOMALY_RULE_TYPES:
+            df, issues, summary = apply_anomaly_rule(df, rule)
+            if issues > 0:
+                print(f"   ⚠️  {issues} records: {rule_name}")
+                print(f"      ✓ {summary}")
+                issues_found += issues
     
     records_after = len(df)
     records_removed = records_before - records_after
@@ -160,6 +313,15 @@ def validate_and_clean_data(df, dataset_name, rules):
     
     return df
 
+def add_price_metrics(df):
+    """Add daily_return, ma_7, ma_30 and volatility_30d per symbol (rows in date order within each symbol)."""
+    codes = symbol_codes(df['symbol'])
+    df['daily_return'] = df.groupby(codes)['close'].pct_change()
+    df['ma_7'] = df.groupby(codes)['close'].transform(lambda x: x.rolling(7, min_periods=1).mean())
+    df['ma_30'] = df.groupby(codes)['close'].transform(lambda x: x.rolling(30, min_periods=1).mean())
+    df['volatility_30d'] = df.groupby(codes)['daily_return'].transform(lambda x: x.rolling(30, min_periods=1).std() * np.sqrt(365))
+    return df
+
 def calculate_bollinger_bands(df, window=20, num_std=2):
     """
     Calculate Bollinger Bands for each cryptocurrency.
@@ -172,16 +334,19 @@ def calculate_bollinger_bands(df, window=20, num_std=2):
     Returns:
         DataFrame with added columns: bb_middle, bb_upper, bb_lower, bb_bandwidth, bb_percent
     """
-    # Sort by symbol and date to ensure proper rolling calculation
-    df = df.sort_values(['symbol', 'date']).reset_index(drop=True)
+    # Sort by symbol and date to ensure proper rolling calculation (integer symbol codes sort like the symbols)
+    codes = symbol_codes(df['symbol'])
+    order = np.lexsort((pd.to_datetime(df['date']).to_numpy(), codes))
+    df = df.iloc[order].reset_index(drop=True)
+    codes = codes[order]
     
     # Calculate Middle Band (20-day SMA)
-    df['bb_middle'] = df.groupby('symbol')['close'].transform(
+    df['bb_middle'] = df.groupby(codes)['close'].transform(
         lambda x: x.rolling(window=window, min_periods=window).mean()
     )
     
     # Calculate Standard Deviation (20-day)
-    df['bb_std'] = df.groupby('symbol')['close'].transform(
+    df['bb_std'] = df.groupby(codes)['close'].transform(
         lambda x: x.rolling(window=window, min_periods=window).std()
     )
     
@@ -215,6 +380,7 @@ def calculate_bollinger_bands(df, window=20, num_std=2):
     
     return df
 
+@instrument_stage()
 def calculate_correlation_matrix(prices_df, lookback_days=365):
     """
     Calculate pairwise correlation matrix between cryptocurrency returns.
@@ -224,34 +390,35 @@ def calculate_correlation_matrix(prices_df, lookback_days=365):
         lookback_days: Number of recent days to use for correlation (default 365 for 1 year)
     
     Returns:
-        DataFrame with columns: crypto1, crypto2, correlation, period_start, period_end
+        DataFrame with columns: crypto1, crypto2, correlation, correlation_ewma,
+        correlation_shrunk, period_start, period_end
     """
     print(f"\n=== Calculating Correlation Matrix ({lookback_days}-day) ===")
     
-    # Sort and get most recent data
-    prices_df = prices_df.sort_values(['symbol', 'date']).copy()
-    
     # Get the most recent date and filter for lookback period
     max_date = prices_df['date'].max()
     if isinstance(max_date, str):
         max_date = pd.to_datetime(max_date)
     
     cutoff_date = max_date - timedelta(days=lookback_days)
-    recent_prices = prices_df[pd.to_datetime(prices_df['date']) >= cutoff_date].copy()
+    recent_prices = shared_store(prices_df).between(start=cutoff_date)
     
     print(f"   Using data from {cutoff_date.date()} to {max_date.date()}")
     print(f"   Cryptocurrencies: {recent_prices['symbol'].nunique()}")
     
-    # Pivot data to have symbols as columns and dates as rows
-    returns_pivot = recent_prices.pivot(index='date', columns='symbol', values='daily_return')
-    
-    # Drop rows with any NaN values (for clean correlation calculation)
-    returns_pivot = returns_pivot.dropna()
+    # Date-aligned (date x symbol) returns with missing days left as NaN; each pair is
+    # estimated on the days both symbols trade, so a new listing only shortens its own pairs
+    returns_panel = shared_matrices(prices_df).frame('returns', start=cutoff_date, end=max_date)
+    returns_panel = returns_panel.loc[:, returns_panel.columns.isin(recent_prices['symbol'].unique())]
+    pair_days, _, correlation = pairwise_moments(returns_panel.to_numpy(), min_periods=MIN_CORRELATION_DAYS)
+    corr_matrix = pd.DataFrame(correlation, index=returns_panel.columns, columns=returns_panel.columns)
     
-    print(f"   Trading days with complete data: {len(returns_pivot)}")
+    print(f"   Trading days: {len(returns_panel)} (fewest shared by a pair: {int(pair_days.min(initial=len(returns_panel)))})")
     
-    # Calculate correlation matrix
-    corr_matrix = returns_pivot.corr()
+    # EWMA (RiskMetrics) and Ledoit-Wolf shrunk correlations from the shared covariance engine
+    engine = shared_engine(prices_df, window=lookback_days)
+    ewma_matrix = engine.correlation(max_date, 'ewma', corr_matrix.columns)
+    shrunk_matrix = engine.correlation(max_date, 'ledoit_wolf', corr_matrix.columns)
     
     # Convert correlation matrix to long format for Tableau
     correlation_data = []
@@ -263,6 +430,8 @@ def calculate_correlation_matrix(prices_df, lookback_days=365):
                 'crypto1': crypto1,
                 'crypto2': crypto2,
                 'correlation': round(corr_matrix.loc[crypto1, crypto2], 4),
+                'correlation_ewma': round(ewma_matrix.loc[crypto1, crypto2], 4),
+                'correlation_shrunk': round(shrunk_matrix.loc[crypto1, crypto2], 4),
                 'is_self_correlation': crypto1 == crypto2,
                 'period_days': lookback_days,
                 'period_start': cutoff_date.strftime('%Y-%m-%d'),
@@ -273,6 +442,7 @@ def calculate_correlation_matrix(prices_df, lookback_days=365):
     
     # Add correlation strength categories for filtering
     df_corr['correlation_strength'] = df_corr['correlation'].apply(lambda x: 
+        'Insufficient Data' if pd.isna(x) else
         'Perfect' if abs(x) == 1.0 else
         'Very Strong' if abs(x) >= 0.8 else
         'Strong' if abs(x) >= 0.6 else
@@ -283,7 +453,7 @@ def calculate_correlation_matrix(prices_df, lookback_days=365):
     
     # Add correlation direction
     df_corr['correlation_direction'] = df_corr['correlation'].apply(lambda x:
-        'Neutral' if x == 0 else
+        'Neutral' if pd.isna(x) or x == 0 else
         'Positive' if x > 0 else
         'Negative'
     )
@@ -297,13 +467,17 @@ def fetch_real_crypto_prices():
     """Fetch REAL cryptocurrency price data from Yahoo Finance."""
     print("\n=== Fetching REAL Cryptocurrency Price Data ===")
     print(f"📅 Date Range: {START_DATE} to {END_DATE} (TODAY!)")
-    print(f"🪙 Fetching {len(CRYPTO_UNIVERSE)} cryptocurrencies from Yahoo Finance...")
+    print(f"🪙 Fetching {len(crypto_universe())} cryptocurrencies from Yahoo Finance...")
     
     all_prices = []
     successful_fetches = 0
     failed_symbols = []
     
-    for symbol, info in CRYPTO_UNIVERSE.items():
+    yf = import_yfinance()
+    if yf is None:
+        raise ImportError("yfinance is not installed")
+    
+    for symbol, info in crypto_universe().items():
         yf_ticker = info['yf_ticker']
         print(f"   Downloading {symbol} ({info['name']})...", end=" ")
         
@@ -347,26 +521,24 @@ def fetch_real_crypto_prices():
     # Combine all data
     df = pd.concat(all_prices, ignore_index=True)
     df['date'] = pd.to_datetime(df['date'])
+    df['symbol'] = symbol_category(df['symbol'])
     
-    print(f"\n✅ Successfully fetched {successful_fetches}/{len(CRYPTO_UNIVERSE)} cryptocurrencies")
+    print(f"\n✅ Successfully fetched {successful_fetches}/{len(crypto_universe())} cryptocurrencies")
     if failed_symbols:
         print(f"⚠️  Failed: {', '.join(failed_symbols)}")
     
+    # Validate before deriving returns, so cleaned prices feed every metric
+    df = validate_and_clean_data(df, "Crypto Prices", QUALITY_RULES['crypto_prices'])
+    
     # Calculate additional metrics
     print("📊 Calculating returns and moving averages...")
     df = df.sort_values(['symbol', 'date']).reset_index(drop=True)
-    df['daily_return'] = df.groupby('symbol')['close'].pct_change()
-    df['ma_7'] = df.groupby('symbol')['close'].transform(lambda x: x.rolling(7, min_periods=1).mean())
-    df['ma_30'] = df.groupby('symbol')['close'].transform(lambda x: x.rolling(30, min_periods=1).mean())
-    df['volatility_30d'] = df.groupby('symbol')['daily_return'].transform(lambda x: x.rolling(30, min_periods=1).std() * np.sqrt(365))
+    df = add_price_metrics(df)
     
     # Calculate Bollinger Bands
     print("📊 Calculating Bollinger Bands (20-day, 2 std dev)...")
     df = calculate_bollinger_bands(df, window=20, num_std=2)
     
-    # Validate
-    df = validate_and_clean_data(df, "Crypto Prices", QUALITY_RULES['crypto_prices'])
-    
     return df
 
 def generate_crypto_prices_synthetic():
@@ -379,73 +551,49 @@ def generate_crypto_prices_synthetic():
     
     all_prices = []
     
-    for symbol, info in CRYPTO_UNIVERSE.items():
-        # Set realistic starting price and volatility by asset
-        if symbol == 'BTC':
-            base_price = 30000
-            volatility = 0.04
-        elif symbol == 'ETH':
-            base_price = 2000
-            volatility = 0.05
-        elif symbol in ['BNB', 'SOL']:
-            base_price = 150
-            volatility = 0.06
-        elif symbol in ['ADA', 'DOT', 'AVAX']:
-            base_price = 1.5
-            volatility = 0.07
-        elif symbol == 'DOGE':
-            base_price = 0.08
-            volatility = 0.10
-        else:
-            base_price = 10
-            volatility = 0.06
-        
-        # Generate price series with realistic trends
-        np.random.seed(hash(symbol) % 2**32)
-        returns = np.random.normal(0.0005, volatility, len(dates))
-        
-        # Add some trend and seasonality
-        trend = np.linspace(0, 0.3, len(dates)) if symbol in ['ETH', 'SOL'] else np.linspace(0, 0.1, len(dates))
-        prices = base_price * np.exp(np.cumsum(returns) + trend)
-        
-        # Generate OHLCV data
-        for i, date in enumerate(dates):
-            close = prices[i]
-            open_price = close * (1 + np.random.uniform(-0.02, 0.02))
-            high = max(open_price, close) * (1 + abs(np.random.uniform(0, 0.03)))
-            low = min(open_price, close) * (1 - abs(np.random.uniform(0, 0.03)))
-            volume = abs(np.random.lognormal(18, 2)) if symbol in ['BTC', 'ETH'] else abs(np.random.lognormal(16, 2))
-            
-            all_prices.append({
-                'date': date,
-                'symbol': symbol,
-                'open': round(open_price, 8),
-                'high': round(high, 8),
-                'low': round(low, 8),
-                'close': round(close, 8),
-                'volume': round(volume, 2)
-            })
+    for symbol in crypto_universe():
+        # Per-symbol SeedSequence stream: reproducible across processes and independent
+        # of universe order (see synthetic_generator.py for the price model)
+        ohlcv = symbol_ohlcv(symbol, len(dates))
+        all_prices.append(pd.DataFrame({
+            'date': dates,
+            'symbol': symbol,
+            'open': ohlcv['open'].round(8),
+            'high': ohlcv['high'].round(8),
+            'low': ohlcv['low'].round(8),
+            'close': ohlcv['close'].round(8),
+            'volume': ohlcv['volume'].round(2),
+        }))
+    
+    df = pd.concat(all_prices, ignore_index=True)
+    df['symbol'] = symbol_category(df['symbol'])
     
-    df = pd.DataFrame(all_prices)
+    # Validate before deriving returns, so cleaned prices feed every metric
+    df = validate_and_clean_data(df, "Crypto Prices", QUALITY_RULES['crypto_prices'])
     
     # Calculate additional metrics
-    df['daily_return'] = df.groupby('symbol')['close'].pct_change()
-    df['ma_7'] = df.groupby('symbol')['close'].transform(lambda x: x.rolling(7, min_periods=1).mean())
-    df['ma_30'] = df.groupby('symbol')['close'].transform(lambda x: x.rolling(30, min_periods=1).mean())
-    df['volatility_30d'] = df.groupby('symbol')['daily_return'].transform(lambda x: x.rolling(30, min_periods=1).std() * np.sqrt(365))
+    df = add_price_metrics(df)
     
     # Calculate Bollinger Bands
     print("📊 Calculating Bollinger Bands (20-day, 2 std dev)...")
     df = calculate_bollinger_bands(df, window=20, num_std=2)
     
-    # Validate
-    df = validate_and_clean_data(df, "Crypto Prices", QUALITY_RULES['crypto_prices'])
-    
     return df
 
-def generate_crypto_prices():
-    """Main wrapper: Try to fetch real data, fallback to synthetic."""
-    if YFINANCE_AVAILABLE:
+@instrument_stage()
+def generate_crypto_prices(source='auto'):
+    """
+    Main wrapper: Try to fetch real data, fallback to synthetic.
+    
+    Args:
+        source: 'auto' (Yahoo Finance, synthetic fallback), 'yahoo' (fail if the
+            download fails) or 'synthetic' (never touch the network)
+    """
+    if source == 'synthetic':
+        return generate_crypto_prices_synthetic()
+    if source == 'yahoo':
+        return fetch_real_crypto_prices()
+    if import_yfinance() is not None:
         try:
             return fetch_real_crypto_prices()
         except Exception as e:
@@ -455,22 +603,13 @@ def generate_crypto_prices():
     else:
         return generate_crypto_prices_synthetic()
 
+@instrument_stage()
 def create_crypto_reference():
     """Create cryptocurrency reference table."""
     print("\n=== Creating Cryptocurrency Reference ===")
     
-    ref_data = []
-    for symbol, info in CRYPTO_UNIVERSE.items():
-        ref_data.append({
-            'symbol': symbol,
-            'name': info['name'],
-            'category': info['category'],
-            'launch_year': info['launch_year'],
-            'is_stablecoin': False,
-            'is_active': True
-        })
-    
-    df = pd.DataFrame(ref_data)
+    df = pd.DataFrame.from_dict(crypto_universe(), orient='index').rename_axis('symbol').reset_index()
+    df = df[['symbol', 'name', 'category', 'launch_year', 'is_stablecoin', 'is_active']]
     
     # NOTE: market_cap_tier should be a calculated field in the DMO, not in the CSV
     # It will be calculated in Data Cloud as:
@@ -478,12 +617,14 @@ def create_crypto_reference():
     #      WHEN category IN ('Layer 2', 'DeFi', 'Exchange Token') THEN 'Mid Cap'
     #      ELSE 'Small Cap' END
     
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
     output_path = DATA_DIR / 'crypto_reference.csv'
     df.to_csv(output_path, index=False)
     file_size_mb = output_path.stat().st_size / (1024 * 1024)
     print(f"✓ Created {output_path} ({len(df)} cryptos, {file_size_mb:.2f} MB)")
     return df
 
+@instrument_stage()
 def generate_portfolio_positions(prices_df):
     """Generate sample portfolio positions - HISTORICAL SNAPSHOTS for 100MB+ data."""
     print("\n=== Generating Portfolio Positions (Historical Snapshots) ===")
@@ -511,9 +652,10 @@ def generate_portfolio_positions(prices_df):
     
     print(f"   Generating {len(snapshot_dates)} daily snapshots × 3 portfolios...")
     
+    store = shared_store(prices_df)
     for snapshot_date in snapshot_dates:
         # Get prices for this date
-        daily_prices = prices_df[prices_df['date'] == snapshot_date].set_index('symbol')['close']
+        daily_prices = store.cross_section(snapshot_date).set_index('symbol')['close']
         
         if len(daily_prices) == 0:
             continue
@@ -571,8 +713,15 @@ def generate_portfolio_positions(prices_df):
     
     return df
 
-def generate_trades(positions_df):
-    """Generate sample trade history."""
+@instrument_stage()
+def generate_trades(positions_df, trades_per_position=(200, 500)):
+    """
+    Generate sample trade history.
+    
+    Args:
+        positions_df: Portfolio positions to generate trades for
+        trades_per_position: (low, high) range for the number of trades per position
+    """
     print("\n=== Generating Trade History ===")
     
     trades = []
@@ -581,8 +730,8 @@ def generate_trades(positions_df):
     # Generate MANY MORE trades for each position (aiming for 100MB total data)
     # Generate trades spanning the entire date range for volume
     for _, position in positions_df.iterrows():
-        # Generate 200-500 trades per position (significantly more data)
-        num_trades = np.random.randint(200, 500)
+        # Generate 200-500 trades per position by default (significantly more data)
+        num_trades = np.random.randint(*trades_per_position)
         
         for i in range(num_trades):
             # Random date spanning full history (2015-2026)
@@ -629,6 +778,7 @@ def generate_trades(positions_df):
     
     return df
 
+@instrument_stage()
 def calculate_market_metrics(prices_df):
     """Calculate market-wide metrics by date."""
     print("\n=== Calculating Market Metrics ===")
@@ -636,8 +786,9 @@ def calculate_market_metrics(prices_df):
     # Aggregate by date
     daily_metrics = []
     
+    store = shared_store(prices_df)
     for date in prices_df['date'].unique():
-        day_prices = prices_df[prices_df['date'] == date]
+        day_prices = store.cross_section(date)
         
         # Calculate market metrics
         total_volume = day_prices['volume'].sum()
@@ -671,11 +822,14 @@ def calculate_market_metrics(prices_df):
     
     return df
 
+@instrument_stage()
 def calculate_portfolio_risk_metrics(positions_df, prices_df):
     """Calculate comprehensive risk metrics by portfolio."""
     print("\n=== Calculating Portfolio Risk Metrics ===")
     
     risk_metrics = []
+    store = shared_store(prices_df)
+    btc_returns = store.get('BTC')['daily_return'].dropna()
     
     for portfolio_id in positions_df['portfolio_id'].unique():
         pf_positions = positions_df[positions_df['portfolio_id'] == portfolio_id]
@@ -689,7 +843,7 @@ def calculate_portfolio_risk_metrics(positions_df, prices_df):
         # Calculate portfolio returns (weighted)
         portfolio_returns = []
         for symbol, weight in zip(symbols, weights):
-            asset_returns = prices_df[prices_df['symbol'] == symbol]['daily_return'].dropna()
+            asset_returns = store.get(symbol)['daily_return'].dropna()
             portfolio_returns.append(asset_returns * weight)
         
         if portfolio_returns:
@@ -721,7 +875,6 @@ def calculate_portfolio_risk_metrics(positions_df, prices_df):
             max_drawdown = drawdown.min() if len(drawdown) > 0 else 0
             
             # Beta vs BTC
-            btc_returns = prices_df[prices_df['symbol'] == 'BTC']['daily_return'].dropna()
             if len(btc_returns) > 0 and len(pf_returns) > 0:
                 # Align series
                 common_idx = pf_returns.index.intersection(btc_returns.index)
@@ -762,26 +915,28 @@ def calculate_portfolio_risk_metrics(positions_df, prices_df):
     df = pd.DataFrame(risk_metrics)
     return df
 
-def create_enriched_datasets(prices_df, positions_df, trades_df, market_df, risk_df, crypto_ref_df, corr_df):
-    """Create pre-joined datasets ready for Data Cloud."""
-    print("\n=== Creating Enriched Datasets ===")
-    
-    # 1. Crypto Prices Enriched (prices + crypto metadata + date attributes)
-    prices_enriched = prices_df.merge(crypto_ref_df, on='symbol', how='left')
-    
-    # Ensure date is datetime
-    prices_enriched['date'] = pd.to_datetime(prices_enriched['date'])
+def save_prices(prices_df, crypto_ref_df, date_table=False):
+    """
+    Write prices enriched with crypto metadata and date attributes.
     
-    # Add date attributes
-    prices_enriched['year'] = prices_enriched['date'].dt.year
-    prices_enriched['month'] = prices_enriched['date'].dt.month
-    prices_enriched['quarter'] = prices_enriched['date'].dt.quarter
-    prices_enriched['day_of_week'] = prices_enriched['date'].dt.day_name()
-    prices_enriched['is_weekend'] = prices_enriched['date'].dt.dayofweek >= 5
+    With date_table=True the date dimension (one row per price date) is also
+    written to DATE_TABLE_FILE.
+    """
+    # Reference join as an array lookup: each price row's symbol code is its reference row
+    codes = symbol_codes(prices_df['symbol'], crypto_ref_df['symbol'])
+    metadata = crypto_ref_df.drop(columns='symbol').reset_index(drop=True)
+    metadata = metadata.take(codes) if (codes >= 0).all() else metadata.reindex(codes)
+    prices_enriched = pd.concat([prices_df.reset_index(drop=True), metadata.reset_index(drop=True)], axis=1)
+    
+    # Add date attributes, computed per distinct date and broadcast to the rows;
+    # date is formatted as YYYY-MM-DD string for Data Cloud compatibility
+    date_codes, dates = date_dimension(prices_enriched['date'])
+    for column, values in broadcast_dates(dates, date_codes).items():
+        prices_enriched[column] = values
     
     # Ensure daily_return exists and fill NaN with 0 for first day of each symbol
     if 'daily_return' not in prices_enriched.columns:
-        prices_enriched['daily_return'] = prices_enriched.groupby('symbol')['close'].pct_change()
+        prices_enriched['daily_return'] = prices_enriched.groupby(codes)['close'].pct_change()
     
     prices_enriched['daily_return'] = prices_enriched['daily_return'].fillna(0)
     
@@ -794,16 +949,14 @@ def create_enriched_datasets(prices_df, positions_df, trades_df, market_df, risk
         'symbol', 'name', 'category', 'launch_year', 'is_stablecoin', 'is_active',
         'open', 'high', 'low', 'close', 'volume',
         'daily_return', 'ma_7', 'ma_30', 'volatility_30d',
-        'bb_middle', 'bb_upper', 'bb_lower', 'bb_bandwidth', 'bb_percent'
+        'bb_middle', 'bb_upper', 'bb_lower', 'bb_bandwidth', 'bb_percent', FLAG_COLUMN
     ]
     
     # Only include columns that exist
     column_order = [col for col in column_order if col in prices_enriched.columns]
     prices_enriched = prices_enriched[column_order]
     
-    # Format date as YYYY-MM-DD string for Data Cloud compatibility
-    prices_enriched['date'] = prices_enriched['date'].dt.strftime('%Y-%m-%d')
-    
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
     output_path = DATA_DIR / 'crypto_prices_daily_2020_2024.csv'
     prices_enriched.to_csv(output_path, index=False)
     print(f"✓ Created {output_path} ({len(prices_enriched):,} records)")
@@ -812,6 +965,36 @@ def create_enriched_datasets(prices_df, positions_df, trades_df, market_df, risk
     file_size_mb = output_path.stat().st_size / (1024 * 1024)
     print(f"   File size: {file_size_mb:.2f} MB")
     
+    if date_table:
+        date_path = DATA_DIR / DATE_TABLE_FILE
+        dates.to_csv(date_path, index=False)
+        print(f"✓ Created {date_path} ({len(dates):,} dates)")
+
+    return output_path
+
+def load_prices(path=None):
+    """
+    Load a previously written prices file back into pipeline form.
+    
+    Enrichment columns (metadata, date attributes) are dropped so the frame can be
+    fed to the downstream stages exactly like freshly generated prices.
+    """
+    path = Path(path) if path else DATA_DIR / 'crypto_prices_daily_2020_2024.csv'
+    prices_df = pd.read_csv(path, parse_dates=['date'])
+    prices_df = prices_df[[col for col in PRICE_COLUMNS if col in prices_df.columns]]
+    prices_df['symbol'] = symbol_category(prices_df['symbol'])
+    print(f"✓ Loaded {len(prices_df):,} price records from {path}")
+    return prices_df.sort_values(['symbol', 'date']).reset_index(drop=True)
+
+@instrument_stage()
+def create_enriched_datasets(prices_df, positions_df, trades_df, market_df, risk_df, crypto_ref_df, corr_df,
+                             date_table=False):
+    """Create pre-joined datasets ready for Data Cloud."""
+    print("\n=== Creating Enriched Datasets ===")
+    
+    # 1. Crypto Prices Enriched (prices + crypto metadata + date attributes)
+    save_prices(prices_df, crypto_ref_df, date_table=date_table)
+    
     # 2. Portfolio Positions Current (already enriched)
     output_path = DATA_DIR / 'portfolio_positions_current.csv'
     positions_df.to_csv(output_path, index=False)
@@ -820,7 +1003,7 @@ def create_enriched_datasets(prices_df, positions_df, trades_df, market_df, risk
     
     # 3. Trades History (already enriched)
     # Format dates as strings
-    trades_df['trade_date'] = pd.to_datetime(trades_df['trade_date']).dt.strftime('%Y-%m-%d')
+    trades_df['trade_date'] = format_dates(trades_df['trade_date'])
     output_path = DATA_DIR / 'trades_history_sample.csv'
     trades_df.to_csv(output_path, index=False)
     file_size_mb = output_path.stat().st_size / (1024 * 1024)
@@ -828,7 +1011,7 @@ def create_enriched_datasets(prices_df, positions_df, trades_df, market_df, risk
     
     # 4. Market Metrics Daily
     # Format dates as strings
-    market_df['date'] = pd.to_datetime(market_df['date']).dt.strftime('%Y-%m-%d')
+    market_df['date'] = format_dates(market_df['date'])
     output_path = DATA_DIR / 'market_metrics_daily.csv'
     market_df.to_csv(output_path, index=False)
     file_size_mb = output_path.stat().st_size / (1024 * 1024)
@@ -836,7 +1019,7 @@ def create_enriched_datasets(prices_df, positions_df, trades_df, market_df, risk
     
     # 5. Risk Metrics Portfolio
     # Format dates as strings
-    risk_df['as_of_date'] = pd.to_datetime(risk_df['as_of_date']).dt.strftime('%Y-%m-%d')
+    risk_df['as_of_date'] = format_dates(risk_df['as_of_date'])
     output_path = DATA_DIR / 'risk_metrics_portfolio.csv'
     risk_df.to_csv(output_path, index=False)
     file_size_mb = output_path.stat().st_size / (1024 * 1024)
@@ -859,6 +1042,7 @@ def create_enriched_datasets(prices_df, positions_df, trades_df, market_df, risk
     ]]) / (1024 * 1024)
     print(f"\n📦 Total data size: {total_size:.2f} MB")
 
+@instrument_stage()
 def generate_summary_stats(prices_df, positions_df, trades_df, market_df, risk_df):
     """Generate summary statistics."""
     print("\n" + "="*70)
@@ -906,15 +1090,25 @@ def generate_summary_stats(prices_df, positions_df, trades_df, market_df, risk_d
     print(f"📁 Output directory: {DATA_DIR}")
     print("="*70)
 
-def main():
-    """Main execution function."""
+def main(source='auto', reuse_prices=False, date_table=False):
+    """
+    Main execution function.
+    
+    Args:
+        source: Price source passed to generate_crypto_prices ('auto', 'yahoo', 'synthetic')
+        reuse_prices: Start from the prices file already in DATA_DIR (written by a
+            previous run or the CLI 'fetch' command) instead of fetching again
+        date_table: Also write the date dimension (DATE_TABLE_FILE)
+    """
     print("\n" + "="*70)
     print("CryptoRisk Analytics - Data Preparation Pipeline")
     print("="*70)
     print(f"Output directory: {DATA_DIR}\n")
     
+    run = start_run('prepare_crypto_data', output_dir=DATA_DIR)
+    
     # Step 1: Generate crypto prices
-    prices_df = generate_crypto_prices()
+    prices_df = load_prices() if reuse_prices else generate_crypto_prices(source)
     
     # Step 2: Create crypto reference
     crypto_ref_df = create_crypto_reference()
@@ -935,11 +1129,14 @@ def main():
     corr_df = calculate_correlation_matrix(prices_df, lookback_days=365)
     
     # Step 8: Create enriched datasets
-    create_enriched_datasets(prices_df, positions_df, trades_df, market_df, risk_df, crypto_ref_df, corr_df)
+    create_enriched_datasets(prices_df, positions_df, trades_df, market_df, risk_df, crypto_ref_df, corr_df,
+                             date_table=date_table)
     
     # Step 9: Generate summary
     generate_summary_stats(prices_df, positions_df, trades_df, market_df, risk_df)
     
+    run.finish(DATA_DIR / 'run_report_prepare_crypto_data.json')
+    
     print("\n✅ All datasets prepared successfully!")
     print("\nNext steps:")
     print("1. Review the generated CSV files in /data/raw/")
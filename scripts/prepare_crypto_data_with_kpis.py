@@ -14,9 +14,35 @@ from pathlib import Path
 import warnings
 warnings.filterwarnings('ignore')
 
+from covariance_engine import STATE_FILE, shared_engine
+from lot_accounting import shared_lots
+from position_ledger import STATE_FILE as LEDGER_STATE_FILE, shared_ledger
+from price_matrix_store import MATRIX_DIR, build_matrix_store, shared_matrices
+from price_store import shared_store
+from garch import FORECAST_HORIZON, fit_garch_frame
+from hrp import N_CLUSTERS, hrp_allocation
+from liquidity import ADV_WINDOW, PARTICIPATION_RATE, position_liquidity
+from risk_bootstrap import BLOCK_SIZE, N_RESAMPLES, bootstrap_intervals
+from pipeline_instrumentation import active_run, instrument_stage, start_run
+
 # Configuration
 DATA_DIR = Path(__file__).parent.parent / "data" / "raw"
 
+# Rolling beta/alpha/correlation settings
+ROLLING_WINDOWS = [30, 90, 365]
+ROLLING_BENCHMARKS = ['BTC']  # Add 'ETH' for a second benchmark
+
+# Bootstrap confidence interval settings
+BOOTSTRAP_WINDOW = 365        # Trailing days of portfolio returns resampled
+BOOTSTRAP_RESAMPLES = N_RESAMPLES
+
+# GARCH(1,1) forecast settings
+GARCH_INCLUDE_PORTFOLIOS = True   # Also fit each portfolio's daily return series
+
+# Correlation clustering / hierarchical risk parity settings
+HRP_COVARIANCE_METHOD = 'ledoit_wolf'   # Trailing-window estimate from the covariance engine
+
+@instrument_stage()
 def load_existing_data():
     """Load data generated by prepare_crypto_data.py"""
     print("\n=== Loading Existing Data ===")
@@ -33,6 +59,7 @@ def load_existing_data():
     
     return prices_df, positions_df, trades_df, crypto_ref_df
 
+@instrument_stage()
 def calculate_portfolio_volatility_timeseries(prices_df, positions_df):
     """
     Calculate rolling volatility for each portfolio for each date.
@@ -41,6 +68,7 @@ def calculate_portfolio_volatility_timeseries(prices_df, positions_df):
     print("\n=== Calculating Portfolio Volatility Time Series ===")
     
     volatility_records = []
+    matrices = shared_matrices(prices_df, DATA_DIR / MATRIX_DIR)
     
     # Get unique portfolios and their allocations
     portfolios = positions_df.groupby(['portfolio_id', 'portfolio_name']).agg({
@@ -56,17 +84,10 @@ def calculate_portfolio_volatility_timeseries(prices_df, positions_df):
         
         print(f"   Processing {portfolio_name} ({len(symbols)} assets)...")
         
-        # Get returns for all assets in portfolio
-        portfolio_returns = []
-        for symbol in symbols:
-            asset_returns = prices_df[prices_df['symbol'] == symbol][['date', 'daily_return']].copy()
-            asset_returns = asset_returns.rename(columns={'daily_return': symbol})
-            asset_returns = asset_returns.set_index('date')
-            portfolio_returns.append(asset_returns)
-        
-        # Combine into single dataframe
-        if portfolio_returns:
-            combined_returns = pd.concat(portfolio_returns, axis=1)
+        # Get returns for all assets in portfolio (dates where any of them traded)
+        held = [symbol for symbol in symbols if symbol in matrices]
+        if held:
+            combined_returns = matrices.frame('returns', symbols=held).dropna(how='all')
             
             # Calculate weighted portfolio returns
             weighted_returns = pd.Series(0.0, index=combined_returns.index)
@@ -108,14 +129,19 @@ def calculate_portfolio_volatility_timeseries(prices_df, positions_df):
     
     return df
 
+@instrument_stage()
 def calculate_portfolio_var_current(prices_df, positions_df):
     """
     Calculate VaR for each portfolio using LATEST positions only.
-    Output: portfolio_id, as_of_date, var_95, var_99, portfolio_value
+    Historical VaR uses the full return history; parametric VaR uses the shared
+    EWMA covariance (RiskMetrics) at the latest date.
+    Output: portfolio_id, as_of_date, var_95, var_99, portfolio_value, var_*_ewma
     """
     print("\n=== Calculating Current Portfolio VaR ===")
     
     var_records = []
+    engine = shared_engine(prices_df, state_path=DATA_DIR / STATE_FILE)
+    matrices = shared_matrices(prices_df, DATA_DIR / MATRIX_DIR)
     
     # Get latest date
     latest_date = positions_df['as_of_date'].max()
@@ -133,9 +159,7 @@ def calculate_portfolio_var_current(prices_df, positions_df):
         weights = (pf_positions['position_value'] / portfolio_value).tolist()
         
         # Calculate portfolio returns (align dates)
-        portfolio_returns_df = prices_df[prices_df['symbol'].isin(symbols)][['date', 'symbol', 'daily_return']].pivot(
-            index='date', columns='symbol', values='daily_return'
-        )
+        portfolio_returns_df = matrices.frame('returns', symbols=symbols).dropna(how='all')
         
         # Calculate weighted portfolio returns
         pf_returns = pd.Series(0.0, index=portfolio_returns_df.index)
@@ -154,6 +178,11 @@ def calculate_portfolio_var_current(prices_df, positions_df):
             var_95 = var_95_pct * portfolio_value
             var_99 = var_99_pct * portfolio_value
             
+            # Parametric (normal) VaR from the EWMA covariance: z * sqrt(w' Σ w)
+            sigma_ewma = engine.portfolio_volatility(dict(zip(symbols, weights)), method='ewma')
+            var_95_ewma_pct = -1.6449 * sigma_ewma
+            var_99_ewma_pct = -2.3263 * sigma_ewma
+            
             var_records.append({
                 'portfolio_id': portfolio_id,
                 'portfolio_name': portfolio_name,
@@ -162,7 +191,11 @@ def calculate_portfolio_var_current(prices_df, positions_df):
                 'var_95': round(var_95, 2),
                 'var_99': round(var_99, 2),
                 'var_95_pct': round(var_95_pct * 100, 4),
-                'var_99_pct': round(var_99_pct * 100, 4)
+                'var_99_pct': round(var_99_pct * 100, 4),
+                'var_95_ewma': round(var_95_ewma_pct * portfolio_value, 2),
+                'var_99_ewma': round(var_99_ewma_pct * portfolio_value, 2),
+                'var_95_ewma_pct': round(var_95_ewma_pct * 100, 4),
+                'var_99_ewma_pct': round(var_99_ewma_pct * 100, 4)
             })
             
             print(f"   {portfolio_name}: VaR 95% = ${var_95:,.2f}, VaR 99% = ${var_99:,.2f}")
@@ -170,6 +203,7 @@ def calculate_portfolio_var_current(prices_df, positions_df):
     df = pd.DataFrame(var_records)
     return df
 
+@instrument_stage()
 def calculate_portfolio_risk_adjusted_returns(prices_df, positions_df, volatility_df):
     """
     Calculate Sharpe, Sortino, Beta, Alpha, Correlation for each portfolio.
@@ -186,7 +220,8 @@ def calculate_portfolio_risk_adjusted_returns(prices_df, positions_df, volatilit
     latest_volatility = volatility_df[volatility_df['date'] == latest_date]
     
     # Get BTC returns for beta/alpha/correlation
-    btc_returns = prices_df[prices_df['symbol'] == 'BTC'][['date', 'daily_return']].copy()
+    store = shared_store(prices_df)
+    btc_returns = store.get('BTC')[['date', 'daily_return']].copy()
     btc_returns = btc_returns.rename(columns={'daily_return': 'btc_return'})
     
     for portfolio_id in latest_positions['portfolio_id'].unique():
@@ -216,7 +251,7 @@ def calculate_portfolio_risk_adjusted_returns(prices_df, positions_df, volatilit
         
         portfolio_returns_list = []
         for symbol, weight in zip(symbols, weights):
-            asset_returns = prices_df[prices_df['symbol'] == symbol][['date', 'daily_return']].copy()
+            asset_returns = store.get(symbol)[['date', 'daily_return']].copy()
             asset_returns['weighted_return'] = asset_returns['daily_return'] * weight
             portfolio_returns_list.append(asset_returns[['date', 'weighted_return']])
         
@@ -276,198 +311,945 @@ def calculate_portfolio_risk_adjusted_returns(prices_df, positions_df, volatilit
     df = pd.DataFrame(metrics_records)
     return df
 
-def calculate_portfolio_concentration_metrics(positions_df):
+def _concentration_frame(positions_df, prices_df):
+    """
+    Position weights, HHI, liquid share and drift for every (portfolio, snapshot) at once.
+    Uses groupby transforms over the whole positions table (linear in rows); liquidity
+    comes from each position's traded volume on its snapshot date (see liquidity.py).
+    """
+    keys = ['portfolio_id', 'as_of_date']
+    df = positions_df[['portfolio_id', 'portfolio_name', 'as_of_date', 'symbol',
+                       'position_value', 'target_weight']].copy()
+    
+    groups = df.groupby(keys, sort=False)
+    total_value = groups['position_value'].transform('sum')
+    weight = (df['position_value'] / total_value).where(total_value > 0, 0.0)
+    drift = weight - df['target_weight']
+    
+    # Liquid positions: enough average dollar volume to be sold within LIQUID_MAX_DAYS
+    liquid = position_liquidity(df, shared_matrices(prices_df, DATA_DIR / MATRIX_DIR))['is_liquid']
+    liquid_value = df['position_value'].where(liquid, 0.0)
+    liquid_total = liquid_value.groupby([df[k] for k in keys], sort=False).transform('sum')
+    
+    df['position_value'] = df['position_value'].round(2)
+    df['position_weight'] = weight.round(6)
+    df['weight_drift'] = drift.round(6)
+    df['is_overweight'] = weight > df['target_weight'] + 0.10
+    df['is_underweight'] = weight < df['target_weight'] - 0.10
+    df['portfolio_hhi'] = (weight ** 2).groupby([df[k] for k in keys], sort=False).transform('sum').round(6)
+    df['portfolio_liquid_assets_pct'] = (liquid_total / total_value * 100).where(total_value > 0, 0.0).round(2)
+    df['portfolio_max_abs_drift'] = drift.abs().groupby([df[k] for k in keys], sort=False).transform('max').round(6)
+    return df[['portfolio_id', 'portfolio_name', 'as_of_date', 'symbol', 'position_value', 'position_weight',
+               'target_weight', 'weight_drift', 'is_overweight', 'is_underweight', 'portfolio_hhi',
+               'portfolio_liquid_assets_pct', 'portfolio_max_abs_drift']]
+
+@instrument_stage()
+def calculate_portfolio_concentration_metrics(positions_df, prices_df):
     """
     Calculate position-level metrics and portfolio concentration.
     Output: portfolio_id, as_of_date, symbol, position_weight, hhi, liquid_assets_pct
     """
     print("\n=== Calculating Portfolio Concentration Metrics ===")
     
-    concentration_records = []
-    
     # Get latest date
     latest_date = positions_df['as_of_date'].max()
-    latest_positions = positions_df[positions_df['as_of_date'] == latest_date]
+    df = _concentration_frame(positions_df[positions_df['as_of_date'] == latest_date], prices_df)
+    df = df.drop(columns=['portfolio_max_abs_drift']).reset_index(drop=True)
     
-    for portfolio_id in latest_positions['portfolio_id'].unique():
-        pf_positions = latest_positions[latest_positions['portfolio_id'] == portfolio_id]
-        portfolio_name = pf_positions['portfolio_name'].iloc[0]
-        total_value = pf_positions['position_value'].sum()
-        
-        # Calculate position weights
-        pf_positions['position_weight'] = pf_positions['position_value'] / total_value
-        
-        # Calculate HHI (Herfindahl Index)
-        hhi = (pf_positions['position_weight'] ** 2).sum()
-        
-        # Identify liquid assets (Layer 1 and Exchange Token categories)
-        # We'll need to merge with crypto reference
-        # For now, assuming BTC, ETH, BNB are liquid
-        liquid_symbols = ['BTC', 'ETH', 'BNB', 'SOL', 'ADA', 'XRP', 'DOT']
-        liquid_value = pf_positions[pf_positions['symbol'].isin(liquid_symbols)]['position_value'].sum()
-        liquid_assets_pct = (liquid_value / total_value) * 100 if total_value > 0 else 0
-        
-        # Per-position records
-        for _, position in pf_positions.iterrows():
-            concentration_records.append({
-                'portfolio_id': portfolio_id,
-                'portfolio_name': portfolio_name,
-                'as_of_date': latest_date,
-                'symbol': position['symbol'],
-                'position_value': round(position['position_value'], 2),
-                'position_weight': round(position['position_weight'], 6),
-                'target_weight': position['target_weight'],
-                'weight_drift': round(position['position_weight'] - position['target_weight'], 6),
-                'is_overweight': position['position_weight'] > position['target_weight'] + 0.10,
-                'is_underweight': position['position_weight'] < position['target_weight'] - 0.10,
-                'portfolio_hhi': round(hhi, 6),
-                'portfolio_liquid_assets_pct': round(liquid_assets_pct, 2)
-            })
-        
-        print(f"   {portfolio_name}: HHI={hhi:.4f}, Liquid Assets={liquid_assets_pct:.1f}%")
+    for _, portfolio in df.drop_duplicates('portfolio_id').iterrows():
+        print(f"   {portfolio['portfolio_name']}: HHI={portfolio['portfolio_hhi']:.4f}, "
+              f"Liquid Assets={portfolio['portfolio_liquid_assets_pct']:.1f}%")
     
-    df = pd.DataFrame(concentration_records)
     return df
 
-def calculate_portfolio_24h_change(positions_df):
+@instrument_stage()
+def calculate_portfolio_concentration_history(positions_df, prices_df):
     """
-    Calculate 24h change for each portfolio.
-    Output: portfolio_id, date, portfolio_value, change_24h, change_24h_pct
+    Calculate concentration and drift metrics for EVERY snapshot date.
+    Output: portfolio_id, as_of_date, symbol, position_weight, weight_drift,
+            is_overweight, is_underweight, portfolio_hhi, portfolio_liquid_assets_pct,
+            portfolio_max_abs_drift
     """
-    print("\n=== Calculating Portfolio 24h Change ===")
+    print("\n=== Calculating Portfolio Concentration History ===")
+    
+    df = _concentration_frame(positions_df, prices_df)
+    df = df.sort_values(['portfolio_id', 'as_of_date', 'symbol']).reset_index(drop=True)
     
-    change_records = []
+    snapshots = df[['portfolio_id', 'as_of_date']].drop_duplicates()
+    print(f"   Generated {len(df):,} position records across {len(snapshots):,} portfolio snapshots")
+    
+    return df
+
+@instrument_stage()
+def calculate_portfolio_24h_change(positions_df):
+    """
+    Calculate 24h, 7d, 30d and YTD value change for each portfolio on every date.
+    One grouped pass over the daily portfolio values (no per-portfolio or per-row loops).
+    
+    24h compares with the previous snapshot; 7d/30d with the snapshot exactly 7/30
+    calendar days earlier (empty if missing); YTD with the last snapshot of the prior
+    year, or the first snapshot of the year when no earlier data exists.
+    Output: portfolio_id, date, portfolio_value, change_24h, change_24h_pct,
+            change_7d(_pct), change_30d(_pct), change_ytd(_pct)
+    """
+    print("\n=== Calculating Portfolio 24h / 7d / 30d / YTD Change ===")
     
     # Group by portfolio and date
     daily_values = positions_df.groupby(['portfolio_id', 'portfolio_name', 'as_of_date'])['position_value'].sum().reset_index()
-    daily_values = daily_values.sort_values(['portfolio_id', 'as_of_date'])
+    daily_values = daily_values.sort_values(['portfolio_id', 'as_of_date']).reset_index(drop=True)
+    value = daily_values['position_value']
+    
+    df = daily_values[['portfolio_id', 'portfolio_name']].copy()
+    df['date'] = daily_values['as_of_date']
+    df['portfolio_value'] = value.round(2)
+    
+    def add_change(label, base_value):
+        change = value - base_value
+        df[f'change_{label}'] = change.round(2)
+        df[f'change_{label}_pct'] = (change / base_value * 100).round(4)
+    
+    # 24h: previous snapshot within each portfolio
+    add_change('24h', daily_values.groupby('portfolio_id')['position_value'].shift(1))
+    
+    # 7d / 30d: exact calendar lookups through an indexed (portfolio_id, date) join
+    value_by_key = daily_values.set_index(['portfolio_id', 'as_of_date'])['position_value']
+    for days in (7, 30):
+        lookup = pd.MultiIndex.from_arrays([daily_values['portfolio_id'],
+                                            daily_values['as_of_date'] - pd.Timedelta(days=days)])
+        add_change(f'{days}d', pd.Series(value_by_key.reindex(lookup).to_numpy(), index=daily_values.index))
+    
+    # YTD: last value of the previous year, else first value of the current year
+    year = daily_values['as_of_date'].dt.year
+    by_year = daily_values.groupby(['portfolio_id', year])['position_value']
+    year_end = by_year.last()
+    year_end.index = year_end.index.set_levels(year_end.index.levels[1] + 1, level=1)
+    prior_year_end = year_end.reindex(pd.MultiIndex.from_arrays([daily_values['portfolio_id'], year])).to_numpy()
+    ytd_base = pd.Series(prior_year_end, index=daily_values.index).fillna(by_year.transform('first'))
+    add_change('ytd', ytd_base)
+    
+    df = df[df['change_24h'].notna()].reset_index(drop=True)
+    print(f"   Generated {len(df):,} daily change records")
+    
+    return df
+
+def build_portfolio_returns_matrix(prices_df, positions_df):
+    """
+    Daily weighted returns of every portfolio as one (date x portfolio) matrix.
+    
+    Uses each portfolio's latest target weight per symbol (as the volatility
+    time series does); missing asset returns count as 0.
+    
+    Returns:
+        (returns DataFrame indexed by date with one column per portfolio_id,
+         dict of portfolio_id -> portfolio_name)
+    """
+    weights = (positions_df.drop_duplicates(['portfolio_id', 'symbol'], keep='last')
+               .pivot(index='symbol', columns='portfolio_id', values='target_weight')
+               .fillna(0.0))
+    asset_returns = (shared_matrices(prices_df, DATA_DIR / MATRIX_DIR)
+                     .frame('returns', symbols=weights.index).dropna(how='all')
+                     .reindex(columns=weights.index)
+                     .fillna(0.0))
+    portfolio_returns = pd.DataFrame(asset_returns.to_numpy() @ weights.to_numpy(),
+                                     index=asset_returns.index, columns=weights.columns)
+    names = positions_df.drop_duplicates('portfolio_id').set_index('portfolio_id')['portfolio_name'].to_dict()
+    return portfolio_returns, names
+
+@instrument_stage()
+def calculate_portfolio_drawdown_timeseries(prices_df, positions_df):
+    """
+    Calculate drawdown for every portfolio on every date in one vectorized pass.
+    
+    Works on the (date x portfolio) cumulative-return matrix with running-max ops,
+    replacing the WINDOW_MIN(... RUNNING_MAX ...) table calculation.
+    Output: portfolio_id, date, portfolio_index, running_peak, drawdown,
+            max_drawdown_to_date, drawdown_duration_days, time_to_recovery_days
+    
+    drawdown_duration_days counts days since the last peak. time_to_recovery_days is
+    the peak-to-recovery length of the episode the date belongs to (0 at a peak,
+    empty while the drawdown has not recovered yet).
+    """
+    print("\n=== Calculating Portfolio Drawdown Time Series ===")
+    
+    returns, names = build_portfolio_returns_matrix(prices_df, positions_df)
+    dates = pd.to_datetime(returns.index)
+    n_dates, n_portfolios = returns.shape
+    
+    wealth = np.cumprod(1 + returns.to_numpy(), axis=0)
+    running_peak = np.maximum.accumulate(wealth, axis=0)
+    drawdown = wealth / running_peak - 1
+    max_drawdown = np.minimum.accumulate(drawdown, axis=0)
+    
+    # Row of the last peak at or before each date, and of the first peak at or after it
+    row = np.arange(n_dates)[:, None]
+    at_peak = wealth >= running_peak
+    last_peak = np.maximum.accumulate(np.where(at_peak, row, 0), axis=0)
+    next_peak = np.minimum.accumulate(np.where(at_peak, row, n_dates)[::-1], axis=0)[::-1]
+    
+    day_number = ((dates - dates[0]).days.to_numpy())[:, None].repeat(n_portfolios, axis=1)
+    duration = day_number - np.take_along_axis(day_number, last_peak, axis=0)
+    recovered = next_peak < n_dates
+    recovery_day = np.take_along_axis(day_number, np.minimum(next_peak, n_dates - 1), axis=0)
+    time_to_recovery = np.where(recovered, recovery_day - np.take_along_axis(day_number, last_peak, axis=0), np.nan)
+    time_to_recovery[at_peak] = 0
+    
+    portfolio_ids = returns.columns.to_numpy()
+    df = pd.DataFrame({
+        'portfolio_id': np.tile(portfolio_ids, n_dates),
+        'portfolio_name': [names.get(pid) for pid in np.tile(portfolio_ids, n_dates)],
+        'date': np.repeat(dates.to_numpy(), n_portfolios),
+        'portfolio_index': wealth.ravel().round(6),
+        'running_peak': running_peak.ravel().round(6),
+        'drawdown': drawdown.ravel().round(6),
+        'max_drawdown_to_date': max_drawdown.ravel().round(6),
+        'drawdown_duration_days': duration.ravel(),
+        'time_to_recovery_days': time_to_recovery.ravel(),
+        'is_underwater': ~at_peak.ravel(),
+    })
+    df['time_to_recovery_days'] = df['time_to_recovery_days'].astype('Int64')
+    df = df.sort_values(['portfolio_id', 'date']).reset_index(drop=True)
+    
+    print(f"   Generated {len(df):,} drawdown records ({n_portfolios} portfolios × {n_dates:,} dates)")
+    
+    return df
+
+def _rolling_window_sums(values, window):
+    """Trailing window sums along axis 0 from one cumulative sum (O(n) for any window)."""
+    cumulative = np.cumsum(values, axis=0)
+    sums = cumulative.copy()
+    sums[window:] -= cumulative[:-window]
+    return sums
+
+def rolling_beta_alpha_correlation(returns, benchmark, window):
+    """
+    Rolling beta, alpha and correlation of every column of `returns` vs `benchmark`.
+    
+    Shares window sums of x, y, x², y² and xy across all dates and columns instead
+    of fitting a regression per date. Windows use pairwise-complete observations
+    and need a full `window` of them, otherwise the result is NaN.
+    
+    Args:
+        returns: (dates x entities) array of daily returns (NaN = missing)
+        benchmark: (dates,) array of benchmark daily returns
+        window: Window length in observations
+    
+    Returns:
+        (beta, alpha annualized, correlation) arrays shaped like `returns`
+    """
+    y = np.asarray(returns, dtype=float)
+    x = np.broadcast_to(np.asarray(benchmark, dtype=float)[:, None], y.shape)
+    valid = ~(np.isnan(x) | np.isnan(y))
+    x = np.where(valid, x, 0.0)
+    y = np.where(valid, y, 0.0)
+    
+    n = _rolling_window_sums(valid.astype(float), window)
+    sx = _rolling_window_sums(x, window)
+    sy = _rolling_window_sums(y, window)
+    sxx = _rolling_window_sums(x * x, window)
+    syy = _rolling_window_sums(y * y, window)
+    sxy = _rolling_window_sums(x * y, window)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = (sxy - sx * sy / n) / (n - 1)
+        var_x = (sxx - sx * sx / n) / (n - 1)
+        var_y = (syy - sy * sy / n) / (n - 1)
+        beta = cov / var_x
+        correlation = cov / np.sqrt(var_x * var_y)
+        alpha = (sy / n - beta * sx / n) * 365
+    
+    full = n >= window
+    beta[~full] = np.nan
+    alpha[~full] = np.nan
+    correlation[~full] = np.nan
+    return beta, alpha, np.clip(correlation, -1, 1)
+
+@instrument_stage()
+def calculate_rolling_beta_timeseries(prices_df, positions_df):
+    """
+    Calculate rolling beta, alpha and correlation vs each benchmark (ROLLING_BENCHMARKS)
+    for every portfolio and every symbol, for each window in ROLLING_WINDOWS.
+    Output: entity_type, entity_id, entity_name, benchmark, date,
+            beta_{w}d, alpha_{w}d, correlation_{w}d for each window
+    """
+    print("\n=== Calculating Rolling Beta / Alpha / Correlation ===")
+    
+    portfolio_returns, names = build_portfolio_returns_matrix(prices_df, positions_df)
+    symbol_returns = shared_matrices(prices_df, DATA_DIR / MATRIX_DIR).frame('returns')
+    portfolio_returns = portfolio_returns.reindex(symbol_returns.index)
+    
+    entity_returns = np.hstack([portfolio_returns.to_numpy(), symbol_returns.to_numpy()])
+    entity_type = ['portfolio'] * portfolio_returns.shape[1] + ['symbol'] * symbol_returns.shape[1]
+    entity_id = list(portfolio_returns.columns) + list(symbol_returns.columns)
+    symbol_names = (prices_df.drop_duplicates('symbol').set_index('symbol')['name'].to_dict()
+                    if 'name' in prices_df.columns else {})
+    entity_name = ([names.get(pid, pid) for pid in portfolio_returns.columns] +
+                   [symbol_names.get(sym, sym) for sym in symbol_returns.columns])
+    dates = symbol_returns.index.to_numpy()
+    n_dates, n_entities = entity_returns.shape
+    
+    frames = []
+    for benchmark in ROLLING_BENCHMARKS:
+        if benchmark not in symbol_returns.columns:
+            print(f"   ⚠️  Benchmark {benchmark} not in prices, skipping")
+            continue
+        frame = pd.DataFrame({
+            'entity_type': np.tile(entity_type, n_dates),
+            'entity_id': np.tile(entity_id, n_dates),
+            'entity_name': np.tile(entity_name, n_dates),
+            'benchmark': benchmark,
+            'date': np.repeat(dates, n_entities),
+        })
+        benchmark_returns = symbol_returns[benchmark].to_numpy()
+        for window in ROLLING_WINDOWS:
+            beta, alpha, correlation = rolling_beta_alpha_correlation(entity_returns, benchmark_returns, window)
+            frame[f'beta_{window}d'] = beta.ravel().round(4)
+            frame[f'alpha_{window}d'] = alpha.ravel().round(6)
+            frame[f'correlation_{window}d'] = correlation.ravel().round(4)
+        # The benchmark against itself is trivially beta 1 / correlation 1
+        frame = frame[~((frame['entity_type'] == 'symbol') & (frame['entity_id'] == benchmark))]
+        frames.append(frame)
+        print(f"   {benchmark}: {n_entities} entities × {n_dates:,} dates × {len(ROLLING_WINDOWS)} windows")
+    
+    metric_columns = [f'beta_{w}d' for w in ROLLING_WINDOWS]
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    if len(df):
+        df = df.dropna(subset=metric_columns, how='all')
+        df = df.sort_values(['benchmark', 'entity_type', 'entity_id', 'date']).reset_index(drop=True)
+    print(f"   Generated {len(df):,} rolling beta records")
+    
+    return df
+
+@instrument_stage()
+def calculate_realized_pnl_timeseries(trades_df):
+    """
+    Realized P&L and cost basis per portfolio, symbol and trade date from lot matching.
+    Each SELL is costed against the lots it actually closes (FIFO), with average-cost
+    figures alongside; see lot_accounting.py.
+    
+    Output: portfolio_id, symbol, date, realized_pnl(_avg_cost), cumulative_realized_pnl(_avg_cost),
+            position_quantity, cost_basis(_avg_cost), avg_cost, ...
+    """
+    print("\n=== Calculating Realized P&L (Lot Matching) ===")
+    
+    df, _ = shared_lots(trades_df)
+    
+    print(f"   Generated {len(df):,} daily realized P&L records")
+    print(f"   Total realized P&L (FIFO): ${df['realized_pnl'].sum():,.2f}")
+    
+    return df
+
+@instrument_stage()
+def calculate_open_lots(trades_df):
+    """
+    Lots still open after the last trade (FIFO), with remaining quantity and cost.
+    
+    Output: portfolio_id, symbol, trade_id, acquired_date, original_quantity,
+            remaining_quantity, unit_cost, remaining_cost
+    """
+    print("\n=== Calculating Open Lots ===")
+    
+    _, df = shared_lots(trades_df)
+    
+    print(f"   {len(df):,} open lots, total cost basis ${df['remaining_cost'].sum():,.2f}")
+    
+    return df
+
+@instrument_stage()
+def calculate_position_ledger(trades_df, prices_df):
+    """
+    Daily positions reconstructed from the trade history (see position_ledger.py).
+    Quantities are cumulative signed trade quantities valued at each day's close,
+    so they reconcile with trades_history_sample.csv. Resumes from the saved ledger
+    state when only new trades / price dates were added.
+    
+    Output: portfolio_id, symbol, as_of_date, quantity, net_quantity_change,
+            trade_count, current_price, position_value, is_short
+    """
+    print("\n=== Building Position Ledger from Trades ===")
+    
+    ledger = shared_ledger(trades_df, prices_df, state_path=DATA_DIR / LEDGER_STATE_FILE)
+    df = ledger.positions.round({'quantity': 8, 'net_quantity_change': 8, 'current_price': 8, 'position_value': 2})
+    
+    latest = df[df['as_of_date'] == df['as_of_date'].max()]
+    print(f"   Generated {len(df):,} daily position records ({df.groupby(['portfolio_id', 'symbol']).ngroups} positions)")
+    print(f"   Latest value: ${latest['position_value'].sum():,.2f} ({latest['is_short'].sum()} short positions)")
+    
+    return df
+
+@instrument_stage()
+def calculate_category_attribution(prices_df, positions_df, crypto_ref_df):
+    """
+    Brinson-Fachler attribution and risk contribution by category for every portfolio and date.
+    
+    Weights from each position snapshot are held over the next price date's returns.
+    The benchmark is the whole universe weighted by the snapshot day's dollar volume
+    (close x volume, a market-size proxy). Per category c:
+        allocation  = (w_p - w_b) * (R_b,c - R_b)
+        selection   = w_b * (R_p,c - R_b,c)
+        interaction = (w_p - w_b) * (R_p,c - R_b,c)
+    and the three sum over categories to the portfolio's active return that day.
+    Risk contribution is the category's share of portfolio variance under the EWMA
+    covariance on the snapshot date: sum over its assets of w_i (Σw)_i / wᵀΣw.
+    
+    All portfolios and dates are processed at once as (row x symbol) weight and return
+    matrices multiplied by a (symbol x category) indicator matrix.
+    
+    Output: portfolio_id, date, category, portfolio_weight, benchmark_weight, portfolio_return,
+            benchmark_return, allocation_effect, selection_effect, interaction_effect,
+            total_effect, risk_contribution
+    """
+    print("\n=== Calculating Category Attribution ===")
+    
+    engine = shared_engine(prices_df, state_path=DATA_DIR / STATE_FILE)
+    symbols = engine.symbols
+    categories = crypto_ref_df.set_index('symbol')['category'].reindex(symbols).fillna('Other')
+    category_names = sorted(categories.unique())
+    indicator = (categories.to_numpy()[:, None] == np.array(category_names)[None, :]).astype(float)
+    
+    matrices = shared_matrices(prices_df, DATA_DIR / MATRIX_DIR)
+    price_dates = matrices.dates
+    returns = matrices.frame('returns', symbols=symbols)
+    dollar_volume = (matrices.frame('close', symbols=symbols) * matrices.frame('volume', symbols=symbols)).fillna(0.0)
+    
+    # Portfolio weights: one row per (portfolio, snapshot date)
+    values = positions_df.pivot_table(index=['portfolio_id', 'as_of_date'], columns='symbol',
+                                      values='position_value', aggfunc='sum').reindex(columns=symbols).fillna(0.0)
+    snapshot_dates = pd.DatetimeIndex(values.index.get_level_values('as_of_date'))
+    next_position = price_dates.searchsorted(snapshot_dates, side='right')
+    keep = next_position < len(price_dates)
+    values, snapshot_dates, next_position = values[keep], snapshot_dates[keep], next_position[keep]
+    
+    # Zero-value snapshots keep zero weights; snapshot dates without prices get no benchmark
+    w_p = values.to_numpy()
+    w_p = w_p / np.where(w_p.sum(axis=1, keepdims=True) > 0, w_p.sum(axis=1, keepdims=True), 1.0)
+    w_b = dollar_volume.reindex(snapshot_dates, fill_value=0.0).to_numpy()
+    w_b = w_b / np.where(w_b.sum(axis=1, keepdims=True) > 0, w_b.sum(axis=1, keepdims=True), 1.0)
+    r = np.nan_to_num(returns.to_numpy()[next_position])
+    
+    # Category weights, returns and Brinson-Fachler effects (rows x categories)
+    wp_c, wb_c = w_p @ indicator, w_b @ indicator
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rb_c = np.where(wb_c > 0, ((w_b * r) @ indicator) / wb_c, 0.0)
+        rp_c = np.where(wp_c > 0, ((w_p * r) @ indicator) / wp_c, rb_c)
+    r_b = (w_b * r).sum(axis=1, keepdims=True)
+    allocation = (wp_c - wb_c) * (rb_c - r_b)
+    selection = wb_c * (rp_c - rb_c)
+    interaction = (wp_c - wb_c) * (rp_c - rb_c)
+    
+    # Risk contribution: one (portfolios x N) @ (N x N) product per snapshot date
+    risk = np.zeros_like(wp_c)
+    row_dates = pd.Series(np.arange(len(snapshot_dates)), index=snapshot_dates)
+    for date, cov in engine.iter_covariances(start=snapshot_dates.min()):
+        if date not in row_dates.index:
+            continue
+        rows = row_dates.loc[[date]].to_numpy()
+        weights = w_p[rows]
+        contribution = weights * (weights @ np.nan_to_num(cov))
+        variance = contribution.sum(axis=1, keepdims=True)
+        risk[rows] = np.where(variance > 0, (contribution @ indicator) / np.where(variance > 0, variance, 1.0), 0.0)
+    
+    n_rows, n_categories = wp_c.shape
+    portfolio_ids = values.index.get_level_values('portfolio_id').to_numpy()
+    names = positions_df.drop_duplicates('portfolio_id').set_index('portfolio_id')['portfolio_name']
+    df = pd.DataFrame({
+        'portfolio_id': np.repeat(portfolio_ids, n_categories),
+        'portfolio_name': names.reindex(portfolio_ids).to_numpy().repeat(n_categories),
+        'date': np.repeat(price_dates[next_position], n_categories),
+        'category': np.tile(category_names, n_rows),
+        'portfolio_weight': wp_c.ravel(),
+        'benchmark_weight': wb_c.ravel(),
+        'portfolio_return': rp_c.ravel(),
+        'benchmark_return': rb_c.ravel(),
+        'allocation_effect': allocation.ravel(),
+        'selection_effect': selection.ravel(),
+        'interaction_effect': interaction.ravel(),
+        'risk_contribution': risk.ravel(),
+    })
+    df['total_effect'] = df['allocation_effect'] + df['selection_effect'] + df['interaction_effect']
+    df = df[(df['portfolio_weight'] > 0) | (df['benchmark_weight'] > 0)]
+    df = df[['portfolio_id', 'portfolio_name', 'date', 'category', 'portfolio_weight', 'benchmark_weight',
+             'portfolio_return', 'benchmark_return', 'allocation_effect', 'selection_effect',
+             'interaction_effect', 'total_effect', 'risk_contribution']].round(6).reset_index(drop=True)
+    
+    print(f"   Generated {len(df):,} category attribution records "
+          f"({len(category_names)} categories, {n_rows:,} portfolio-days)")
+    
+    return df
+
+@instrument_stage()
+def calculate_portfolio_risk_bootstrap(prices_df, positions_df):
+    """
+    Block-bootstrap 95% confidence intervals for volatility, Sharpe, Sortino and VaR.
+    
+    Resamples the last BOOTSTRAP_WINDOW days of each portfolio's daily returns (latest
+    target weights, as the volatility time series) in blocks of BLOCK_SIZE days; one
+    set of resample indices is shared by all portfolios (see risk_bootstrap.py).
+    Output: portfolio_id, as_of_date, observations, resamples, block_size, and for each of
+            volatility, sharpe_ratio, sortino_ratio, var_95_pct, var_99_pct:
+            the point estimate, _ci_lower, _ci_upper and _std_error
+    """
+    print("\n=== Calculating Bootstrap Confidence Intervals ===")
+    
+    portfolio_returns, names = build_portfolio_returns_matrix(prices_df, positions_df)
+    window = portfolio_returns.tail(BOOTSTRAP_WINDOW)
+    intervals = bootstrap_intervals(window, n_resamples=BOOTSTRAP_RESAMPLES)
+    
+    df = intervals.round(6).rename_axis('portfolio_id').reset_index()
+    df.insert(1, 'portfolio_name', df['portfolio_id'].map(names))
+    df.insert(2, 'as_of_date', window.index.max())
+    df.insert(3, 'observations', len(window))
+    df.insert(4, 'resamples', BOOTSTRAP_RESAMPLES)
+    df.insert(5, 'block_size', BLOCK_SIZE)
+    
+    for row in df.itertuples():
+        print(f"   {row.portfolio_name}: Sharpe={row.sharpe_ratio:.2f} "
+              f"[{row.sharpe_ratio_ci_lower:.2f}, {row.sharpe_ratio_ci_upper:.2f}], "
+              f"VaR 95%={row.var_95_pct:.2f}% [{row.var_95_pct_ci_lower:.2f}, {row.var_95_pct_ci_upper:.2f}]")
+    
+    return df
+
+@instrument_stage()
+def calculate_garch_volatility_forecast(prices_df, positions_df):
+    """
+    Fit GARCH(1,1) to every symbol's (and portfolio's) full daily return history and
+    forecast next-day and FORECAST_HORIZON-day volatility (see garch.py).
+    Output: entity_type, entity_id, entity_name, as_of_date, observations, omega, alpha,
+            beta, persistence, trailing_vol_30d, forecast_vol_1d, forecast_vol_30d,
+            long_run_vol, log_likelihood, iterations, converged
+    """
+    print("\n=== Calculating GARCH(1,1) Volatility Forecasts ===")
+    
+    symbol_returns = shared_matrices(prices_df, DATA_DIR / MATRIX_DIR).frame('returns')
+    symbol_names = (prices_df.drop_duplicates('symbol').set_index('symbol')['name'].to_dict()
+                    if 'name' in prices_df.columns else {})
+    series = [('symbol', symbol_returns, symbol_names)]
+    if GARCH_INCLUDE_PORTFOLIOS:
+        portfolio_returns, names = build_portfolio_returns_matrix(prices_df, positions_df)
+        series.append(('portfolio', portfolio_returns, names))
+    
+    frames = []
+    for entity_type, returns, names in series:
+        fits = fit_garch_frame(returns, horizon=FORECAST_HORIZON)
+        fits['trailing_vol_30d'] = returns.tail(30).std() * np.sqrt(365)
+        fits = fits.rename_axis('entity_id').reset_index()
+        fits.insert(0, 'entity_type', entity_type)
+        fits.insert(2, 'entity_name', fits['entity_id'].map(lambda e: names.get(e, e)))
+        fits.insert(3, 'as_of_date', returns.index.max())
+        frames.append(fits)
+    
+    df = pd.concat(frames, ignore_index=True)
+    df = df[['entity_type', 'entity_id', 'entity_name', 'as_of_date', 'observations', 'omega', 'alpha', 'beta',
+             'persistence', 'trailing_vol_30d', 'forecast_vol_1d', f'forecast_vol_{FORECAST_HORIZON}d',
+             'long_run_vol', 'log_likelihood', 'iterations', 'converged']]
+    df = df.round({'omega': 10, 'alpha': 6, 'beta': 6, 'persistence': 6, 'trailing_vol_30d': 6,
+                   'forecast_vol_1d': 6, f'forecast_vol_{FORECAST_HORIZON}d': 6, 'long_run_vol': 6,
+                   'log_likelihood': 4})
+    
+    fitted = df['alpha'].notna()
+    print(f"   Fitted {fitted.sum():,} of {len(df):,} series ({df.loc[fitted, 'converged'].sum():,} converged)")
+    return df
+
+def _hrp_inputs(prices_df):
+    """Latest covariance and correlation matrices used for clustering and HRP, with their date."""
+    engine = shared_engine(prices_df, state_path=DATA_DIR / STATE_FILE)
+    as_of_date = engine.dates[-1]
+    return (engine.covariance(as_of_date, HRP_COVARIANCE_METHOD),
+            engine.correlation(as_of_date, HRP_COVARIANCE_METHOD), as_of_date)
+
+@instrument_stage()
+def calculate_correlation_clusters(prices_df):
+    """
+    Cluster the whole universe on correlation distance and compute universe-wide HRP weights.
+    
+    Single-linkage clustering of sqrt((1 - rho) / 2) on the latest HRP_COVARIANCE_METHOD
+    correlation, cut into N_CLUSTERS clusters (see hrp.py).
+    Output: as_of_date, symbol, cluster_id, cluster_size, dendrogram_order,
+            volatility, hrp_weight, ivp_weight
+    """
+    print("\n=== Calculating Correlation Clusters ===")
+    
+    cov, corr, as_of_date = _hrp_inputs(prices_df)
+    df = hrp_allocation(cov, corr, n_clusters=N_CLUSTERS).reset_index()
+    df.insert(0, 'as_of_date', as_of_date)
+    df.insert(3, 'cluster_size', df.groupby('cluster_id')['symbol'].transform('size'))
+    df.insert(5, 'volatility', np.sqrt(np.diag(cov.loc[df['symbol'], df['symbol']].to_numpy()) * 365))
+    df = df.sort_values('dendrogram_order').reset_index(drop=True)
+    df = df.round({'volatility': 6, 'hrp_weight': 6, 'ivp_weight': 6})
+    
+    for cluster_id, members in df.groupby('cluster_id')['symbol']:
+        print(f"   Cluster {cluster_id}: {', '.join(members.head(8))}{' ...' if len(members) > 8 else ''}")
+    
+    return df
+
+@instrument_stage()
+def calculate_portfolio_hrp_weights(prices_df, positions_df):
+    """
+    Hierarchical-risk-parity weights over each portfolio's latest holdings, as a
+    candidate rebalancing target next to the current and target weights.
+    
+    Each portfolio is clustered on its own holdings; cluster_id is the symbol's
+    universe cluster (as in kpi_correlation_clusters.csv).
+    Output: portfolio_id, as_of_date, symbol, cluster_id, current_weight, target_weight,
+            hrp_weight, hrp_weight_change, hrp_rebalance_value, portfolio_volatility,
+            portfolio_volatility_hrp
+    """
+    print("\n=== Calculating Portfolio HRP Weights ===")
     
-    for portfolio_id in daily_values['portfolio_id'].unique():
-        pf_data = daily_values[daily_values['portfolio_id'] == portfolio_id].copy()
-        portfolio_name = pf_data['portfolio_name'].iloc[0]
+    cov, corr, _ = _hrp_inputs(prices_df)
+    universe_clusters = hrp_allocation(cov, corr, n_clusters=N_CLUSTERS)['cluster_id']
+    latest_date = positions_df['as_of_date'].max()
+    latest_positions = positions_df[positions_df['as_of_date'] == latest_date]
+    
+    frames = []
+    for portfolio_id, pf_positions in latest_positions.groupby('portfolio_id', sort=False):
+        pf_positions = pf_positions.groupby('symbol', sort=False).agg(
+            portfolio_name=('portfolio_name', 'first'), position_value=('position_value', 'sum'),
+            target_weight=('target_weight', 'sum'))
+        symbols = [s for s in pf_positions.index if s in cov.index]
+        allocation = hrp_allocation(cov.loc[symbols, symbols], corr.loc[symbols, symbols])
         
-        # Calculate 24h change
-        pf_data['prev_value'] = pf_data['position_value'].shift(1)
-        pf_data['change_24h'] = pf_data['position_value'] - pf_data['prev_value']
-        pf_data['change_24h_pct'] = (pf_data['change_24h'] / pf_data['prev_value']) * 100
+        df = pf_positions.join(allocation[['hrp_weight']]).rename_axis('symbol').reset_index()
+        portfolio_value = df['position_value'].sum()
+        df['current_weight'] = df['position_value'] / portfolio_value if portfolio_value > 0 else 0.0
+        df['hrp_weight'] = df['hrp_weight'].fillna(0.0)
+        df['hrp_weight_change'] = df['hrp_weight'] - df['current_weight']
+        df['hrp_rebalance_value'] = df['hrp_weight_change'] * portfolio_value
         
-        for _, row in pf_data.iterrows():
-            if pd.notna(row['change_24h']):
-                change_records.append({
-                    'portfolio_id': portfolio_id,
-                    'portfolio_name': portfolio_name,
-                    'date': row['as_of_date'],
-                    'portfolio_value': round(row['position_value'], 2),
-                    'change_24h': round(row['change_24h'], 2),
-                    'change_24h_pct': round(row['change_24h_pct'], 4)
-                })
+        # Annualized volatility of the current and HRP weights under the same covariance
+        pf_cov = np.nan_to_num(cov.reindex(index=df['symbol'], columns=df['symbol']).to_numpy(), nan=0.0)
+        for column, weights in (('portfolio_volatility', df['current_weight']),
+                                ('portfolio_volatility_hrp', df['hrp_weight'])):
+            w = weights.to_numpy()
+            df[column] = np.sqrt(max(w @ pf_cov @ w, 0.0) * 365)
+        
+        df.insert(0, 'portfolio_id', portfolio_id)
+        frames.append(df)
+        print(f"   {df['portfolio_name'].iloc[0]}: volatility {df['portfolio_volatility'].iloc[0]:.1%} current, "
+              f"{df['portfolio_volatility_hrp'].iloc[0]:.1%} HRP")
     
-    df = pd.DataFrame(change_records)
-    print(f"   Generated {len(df):,} daily change records")
+    df = pd.concat(frames, ignore_index=True)
+    df['as_of_date'] = latest_date
+    df['cluster_id'] = df['symbol'].map(universe_clusters)
+    df = df[['portfolio_id', 'portfolio_name', 'as_of_date', 'symbol', 'cluster_id', 'current_weight',
+             'target_weight', 'hrp_weight', 'hrp_weight_change', 'hrp_rebalance_value',
+             'portfolio_volatility', 'portfolio_volatility_hrp']]
+    return df.round({'current_weight': 6, 'hrp_weight': 6, 'hrp_weight_change': 6, 'hrp_rebalance_value': 2,
+                     'portfolio_volatility': 6, 'portfolio_volatility_hrp': 6})
+
+@instrument_stage()
+def calculate_portfolio_liquidity_risk(prices_df, positions_df):
+    """
+    Liquidity risk of each portfolio's latest holdings.
+    
+    Average dollar volume and Amihud illiquidity over the trailing ADV_WINDOW days,
+    and the days needed to sell each position trading PARTICIPATION_RATE of that
+    volume per day (see liquidity.py).
+    Output: portfolio_id, as_of_date, symbol, position_value, position_weight,
+            avg_dollar_volume_30d, amihud_illiquidity, days_to_liquidate, is_liquid,
+            portfolio_days_to_liquidate, portfolio_amihud_illiquidity, portfolio_liquid_assets_pct
+    """
+    print("\n=== Calculating Portfolio Liquidity Risk ===")
+    
+    latest_date = positions_df['as_of_date'].max()
+    df = positions_df.loc[positions_df['as_of_date'] == latest_date,
+                          ['portfolio_id', 'portfolio_name', 'as_of_date', 'symbol', 'position_value']]
+    df = df.reset_index(drop=True)
+    df = df.join(position_liquidity(df, shared_matrices(prices_df, DATA_DIR / MATRIX_DIR)))
+    
+    groups = df.groupby('portfolio_id', sort=False)
+    total_value = groups['position_value'].transform('sum')
+    weight = (df['position_value'] / total_value).where(total_value > 0, 0.0)
+    df['position_weight'] = weight
+    # Selling every position in parallel takes as long as the slowest one
+    df['portfolio_days_to_liquidate'] = groups['days_to_liquidate'].transform('max')
+    df['portfolio_amihud_illiquidity'] = (weight * df['amihud_illiquidity']).groupby(df['portfolio_id']).transform('sum')
+    liquid_total = df['position_value'].where(df['is_liquid'], 0.0).groupby(df['portfolio_id']).transform('sum')
+    df['portfolio_liquid_assets_pct'] = (liquid_total / total_value * 100).where(total_value > 0, 0.0)
+    
+    df = df.rename(columns={'avg_dollar_volume': f'avg_dollar_volume_{ADV_WINDOW}d'})
+    df = df[['portfolio_id', 'portfolio_name', 'as_of_date', 'symbol', 'position_value', 'position_weight',
+             f'avg_dollar_volume_{ADV_WINDOW}d', 'amihud_illiquidity', 'days_to_liquidate', 'is_liquid',
+             'portfolio_days_to_liquidate', 'portfolio_amihud_illiquidity', 'portfolio_liquid_assets_pct']]
+    df = df.round({'position_value': 2, 'position_weight': 6, f'avg_dollar_volume_{ADV_WINDOW}d': 2,
+                   'amihud_illiquidity': 10, 'days_to_liquidate': 6, 'portfolio_days_to_liquidate': 6,
+                   'portfolio_amihud_illiquidity': 10, 'portfolio_liquid_assets_pct': 2})
+    
+    for portfolio in df.drop_duplicates('portfolio_id').itertuples():
+        print(f"   {portfolio.portfolio_name}: {portfolio.portfolio_days_to_liquidate:.2f} days to liquidate "
+              f"at {PARTICIPATION_RATE:.0%} of volume, Liquid Assets={portfolio.portfolio_liquid_assets_pct:.1f}%")
     
     return df
 
-def save_kpi_tables(volatility_df, var_df, risk_adj_df, concentration_df, change_24h_df):
-    """Save all pre-calculated KPI tables to CSV."""
+# Registry of pre-calculated KPI tables, in dependency order.
+# inputs name loaded datasets ('prices', 'positions', 'trades', 'crypto_ref') or other KPI tables.
+KPI_TABLES = {
+    'volatility': {
+        'function': calculate_portfolio_volatility_timeseries,
+        'inputs': ['prices', 'positions'],
+        'file': 'kpi_portfolio_volatility_timeseries.csv',
+        'date_column': 'date',
+    },
+    'var': {
+        'function': calculate_portfolio_var_current,
+        'inputs': ['prices', 'positions'],
+        'file': 'kpi_portfolio_var_current.csv',
+        'date_column': 'as_of_date',
+        'covariance_state': True,
+    },
+    'risk_adjusted': {
+        'function': calculate_portfolio_risk_adjusted_returns,
+        'inputs': ['prices', 'positions', 'volatility'],
+        'file': 'kpi_portfolio_risk_adjusted_returns.csv',
+        'date_column': 'as_of_date',
+    },
+    'concentration': {
+        'function': calculate_portfolio_concentration_metrics,
+        'inputs': ['positions', 'prices'],
+        'file': 'kpi_portfolio_concentration.csv',
+        'date_column': 'as_of_date',
+    },
+    'concentration_history': {
+        'function': calculate_portfolio_concentration_history,
+        'inputs': ['positions', 'prices'],
+        'file': 'kpi_portfolio_concentration_history.csv',
+        'date_column': 'as_of_date',
+    },
+    'change_24h': {
+        'function': calculate_portfolio_24h_change,
+        'inputs': ['positions'],
+        'file': 'kpi_portfolio_24h_change.csv',
+        'date_column': 'date',
+    },
+    'drawdown': {
+        'function': calculate_portfolio_drawdown_timeseries,
+        'inputs': ['prices', 'positions'],
+        'file': 'kpi_portfolio_drawdown_timeseries.csv',
+        'date_column': 'date',
+    },
+    'rolling_beta': {
+        'function': calculate_rolling_beta_timeseries,
+        'inputs': ['prices', 'positions'],
+        'file': 'kpi_rolling_beta_timeseries.csv',
+        'date_column': 'date',
+    },
+    'realized_pnl': {
+        'function': calculate_realized_pnl_timeseries,
+        'inputs': ['trades'],
+        'file': 'kpi_realized_pnl_timeseries.csv',
+        'date_column': 'date',
+    },
+    'open_lots': {
+        'function': calculate_open_lots,
+        'inputs': ['trades'],
+        'file': 'kpi_open_lots.csv',
+        'date_column': 'acquired_date',
+    },
+    'position_ledger': {
+        'function': calculate_position_ledger,
+        'inputs': ['trades', 'prices'],
+        'file': 'kpi_position_ledger.csv',
+        'date_column': 'as_of_date',
+    },
+    'category_attribution': {
+        'function': calculate_category_attribution,
+        'inputs': ['prices', 'positions', 'crypto_ref'],
+        'file': 'kpi_category_attribution.csv',
+        'date_column': 'date',
+        'covariance_state': True,
+    },
+    'bootstrap': {
+        'function': calculate_portfolio_risk_bootstrap,
+        'inputs': ['prices', 'positions'],
+        'file': 'kpi_portfolio_risk_bootstrap.csv',
+        'date_column': 'as_of_date',
+    },
+    'garch': {
+        'function': calculate_garch_volatility_forecast,
+        'inputs': ['prices', 'positions'],
+        'file': 'kpi_garch_volatility_forecast.csv',
+        'date_column': 'as_of_date',
+    },
+    'clusters': {
+        'function': calculate_correlation_clusters,
+        'inputs': ['prices'],
+        'file': 'kpi_correlation_clusters.csv',
+        'date_column': 'as_of_date',
+        'covariance_state': True,
+    },
+    'hrp': {
+        'function': calculate_portfolio_hrp_weights,
+        'inputs': ['prices', 'positions'],
+        'file': 'kpi_portfolio_hrp_weights.csv',
+        'date_column': 'as_of_date',
+        'covariance_state': True,
+    },
+    'liquidity': {
+        'function': calculate_portfolio_liquidity_risk,
+        'inputs': ['prices', 'positions'],
+        'file': 'kpi_portfolio_liquidity_risk.csv',
+        'date_column': 'as_of_date',
+    },
+}
+
+def configure(data_dir=None):
+    """Override the input/output directory before running stages."""
+    global DATA_DIR
+    if data_dir is not None:
+        DATA_DIR = Path(data_dir)
+
+def resolve_kpi_selection(names=None):
+    """
+    Expand a KPI selection with the KPI tables it depends on.
+    
+    Returns (names to compute in registry order, names to save).
+    """
+    if not names:
+        return list(KPI_TABLES), list(KPI_TABLES)
+    unknown = [name for name in names if name not in KPI_TABLES]
+    if unknown:
+        raise ValueError(f"Unknown KPI table(s): {', '.join(unknown)}. Choose from: {', '.join(KPI_TABLES)}")
+    
+    needed = set()
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name not in needed:
+            needed.add(name)
+            pending.extend(i for i in KPI_TABLES[name]['inputs'] if i in KPI_TABLES)
+    return [name for name in KPI_TABLES if name in needed], [name for name in KPI_TABLES if name in names]
+
+def _compute_kpi_isolated(name, args):
+    """Worker entry point: compute one KPI table and return it with its stage record."""
+    run = start_run(f"kpi_{name}")
+    df = KPI_TABLES[name]['function'](*args)
+    return df, run.stages[-1]
+
+def compute_kpi_tables(datasets, names=None, workers=1):
+    """
+    Compute the selected KPI tables (plus their dependencies).
+    
+    With workers > 1, tables whose inputs are ready run concurrently in a process
+    pool; each worker's stage measurements are merged into the active run.
+    
+    Args:
+        datasets: dict with the loaded 'prices', 'positions', 'trades', 'crypto_ref' frames
+        names: KPI table names (default: all of KPI_TABLES)
+        workers: Number of processes
+    
+    Returns:
+        dict of KPI table name -> DataFrame (only the requested tables)
+    """
+    to_compute, requested = resolve_kpi_selection(names)
+    results = dict(datasets)
+    
+    if workers <= 1 or len(to_compute) == 1:
+        for name in to_compute:
+            spec = KPI_TABLES[name]
+            results[name] = spec['function'](*[results[i] for i in spec['inputs']])
+        return {name: results[name] for name in requested}
+    
+    from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+    
+    run = active_run()
+    remaining = list(to_compute)
+    running = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while remaining or running:
+            for name in [n for n in remaining if all(i in results for i in KPI_TABLES[n]['inputs'])]:
+                args = [results[i] for i in KPI_TABLES[name]['inputs']]
+                running[pool.submit(_compute_kpi_isolated, name, args)] = name
+                remaining.remove(name)
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                results[name], record = future.result()
+                if run is not None:
+                    run.stages.append(record)
+    return {name: results[name] for name in requested}
+
+@instrument_stage()
+def save_kpi_tables(tables):
+    """
+    Save pre-calculated KPI tables to CSV.
+    
+    Args:
+        tables: dict of KPI table name (see KPI_TABLES) -> DataFrame
+    
+    Returns:
+        Total size of the written files in MB
+    """
     print("\n=== Saving Pre-Calculated KPI Tables ===")
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
     
-    # 1. Portfolio Volatility Time Series
-    volatility_df['date'] = pd.to_datetime(volatility_df['date']).dt.strftime('%Y-%m-%d')
-    output_path = DATA_DIR / 'kpi_portfolio_volatility_timeseries.csv'
-    volatility_df.to_csv(output_path, index=False)
-    file_size_mb = output_path.stat().st_size / (1024 * 1024)
-    print(f"✓ Created {output_path.name} ({len(volatility_df):,} records, {file_size_mb:.2f} MB)")
-    
-    # 2. Current Portfolio VaR
-    var_df['as_of_date'] = pd.to_datetime(var_df['as_of_date']).dt.strftime('%Y-%m-%d')
-    output_path = DATA_DIR / 'kpi_portfolio_var_current.csv'
-    var_df.to_csv(output_path, index=False)
-    file_size_mb = output_path.stat().st_size / (1024 * 1024)
-    print(f"✓ Created {output_path.name} ({len(var_df):,} records, {file_size_mb:.2f} MB)")
-    
-    # 3. Risk-Adjusted Returns
-    risk_adj_df['as_of_date'] = pd.to_datetime(risk_adj_df['as_of_date']).dt.strftime('%Y-%m-%d')
-    output_path = DATA_DIR / 'kpi_portfolio_risk_adjusted_returns.csv'
-    risk_adj_df.to_csv(output_path, index=False)
-    file_size_mb = output_path.stat().st_size / (1024 * 1024)
-    print(f"✓ Created {output_path.name} ({len(risk_adj_df):,} records, {file_size_mb:.2f} MB)")
-    
-    # 4. Portfolio Concentration
-    concentration_df['as_of_date'] = pd.to_datetime(concentration_df['as_of_date']).dt.strftime('%Y-%m-%d')
-    output_path = DATA_DIR / 'kpi_portfolio_concentration.csv'
-    concentration_df.to_csv(output_path, index=False)
-    file_size_mb = output_path.stat().st_size / (1024 * 1024)
-    print(f"✓ Created {output_path.name} ({len(concentration_df):,} records, {file_size_mb:.2f} MB)")
-    
-    # 5. Portfolio 24h Change
-    change_24h_df['date'] = pd.to_datetime(change_24h_df['date']).dt.strftime('%Y-%m-%d')
-    output_path = DATA_DIR / 'kpi_portfolio_24h_change.csv'
-    change_24h_df.to_csv(output_path, index=False)
-    file_size_mb = output_path.stat().st_size / (1024 * 1024)
-    print(f"✓ Created {output_path.name} ({len(change_24h_df):,} records, {file_size_mb:.2f} MB)")
-    
-    # Calculate total KPI table size
-    total_size = sum([
-        (DATA_DIR / f).stat().st_size for f in [
-            'kpi_portfolio_volatility_timeseries.csv',
-            'kpi_portfolio_var_current.csv',
-            'kpi_portfolio_risk_adjusted_returns.csv',
-            'kpi_portfolio_concentration.csv',
-            'kpi_portfolio_24h_change.csv'
-        ]
-    ]) / (1024 * 1024)
+    total_bytes = 0
+    for name, df in tables.items():
+        spec = KPI_TABLES[name]
+        date_column = spec['date_column']
+        df[date_column] = pd.to_datetime(df[date_column]).dt.strftime('%Y-%m-%d')
+        output_path = DATA_DIR / spec['file']
+        df.to_csv(output_path, index=False)
+        file_size = output_path.stat().st_size
+        total_bytes += file_size
+        print(f"✓ Created {output_path.name} ({len(df):,} records, {file_size / (1024 * 1024):.2f} MB)")
     
+    total_size = total_bytes / (1024 * 1024)
     print(f"\n📦 Total KPI tables size: {total_size:.2f} MB")
     
     return total_size
 
-def main():
-    """Main execution function."""
+def main(kpi_names=None, workers=1):
+    """
+    Main execution function.
+    
+    Args:
+        kpi_names: Subset of KPI_TABLES to build (default: all)
+        workers: Number of processes for independent KPI tables
+    """
     print("\n" + "="*70)
     print("CryptoRisk Analytics - Pre-Calculate All KPIs")
     print("="*70)
     print(f"Output directory: {DATA_DIR}\n")
     
+    run = start_run('prepare_crypto_data_with_kpis', output_dir=DATA_DIR)
+    
     # Load existing data
     prices_df, positions_df, trades_df, crypto_ref_df = load_existing_data()
+    datasets = {'prices': prices_df, 'positions': positions_df, 'trades': trades_df, 'crypto_ref': crypto_ref_df}
+    
+    # Aligned return/close/volume matrices, memory-mapped by every KPI stage and worker
+    build_matrix_store(prices_df, DATA_DIR / MATRIX_DIR)
     
     # Calculate all KPIs
     print("\n" + "="*70)
     print("CALCULATING PRE-COMPUTED KPI TABLES")
     print("="*70)
     
-    # 1. Portfolio Volatility Time Series (rolling windows)
-    volatility_df = calculate_portfolio_volatility_timeseries(prices_df, positions_df)
-    
-    # 2. Current Portfolio VaR
-    var_df = calculate_portfolio_var_current(prices_df, positions_df)
+    tables = compute_kpi_tables(datasets, kpi_names, workers=workers)
     
-    # 3. Risk-Adjusted Returns (Sharpe, Sortino, Beta, Alpha)
-    risk_adj_df = calculate_portfolio_risk_adjusted_returns(prices_df, positions_df, volatility_df)
-    
-    # 4. Portfolio Concentration Metrics
-    concentration_df = calculate_portfolio_concentration_metrics(positions_df)
-    
-    # 5. Portfolio 24h Change
-    change_24h_df = calculate_portfolio_24h_change(positions_df)
+    # Persist covariance state so the next run only processes new days (only when a
+    # selected table uses the covariance engine; building it costs O(days x symbols²))
+    computed, _ = resolve_kpi_selection(kpi_names)
+    if any(KPI_TABLES[name].get('covariance_state') for name in computed):
+        shared_engine(prices_df, state_path=DATA_DIR / STATE_FILE).save(DATA_DIR / STATE_FILE)
+    if 'position_ledger' in tables:
+        shared_ledger(trades_df, prices_df, state_path=DATA_DIR / LEDGER_STATE_FILE).save(DATA_DIR / LEDGER_STATE_FILE)
     
     # Save all KPI tables
-    total_kpi_size = save_kpi_tables(volatility_df, var_df, risk_adj_df, concentration_df, change_24h_df)
+    total_kpi_size = save_kpi_tables(tables)
+    
+    run.finish(DATA_DIR / 'run_report_prepare_crypto_data_with_kpis.json')
     
     # Summary
     print("\n" + "="*70)
     print("✅ PRE-CALCULATED KPI TABLES COMPLETE!")
     print("="*70)
     print("\n📊 Generated Tables:")
-    print(f"  1. kpi_portfolio_volatility_timeseries.csv - {len(volatility_df):,} records")
-    print(f"  2. kpi_portfolio_var_current.csv - {len(var_df):,} records")
-    print(f"  3. kpi_portfolio_risk_adjusted_returns.csv - {len(risk_adj_df):,} records")
-    print(f"  4. kpi_portfolio_concentration.csv - {len(concentration_df):,} records")
-    print(f"  5. kpi_portfolio_24h_change.csv - {len(change_24h_df):,} records")
+    for i, (name, df) in enumerate(tables.items(), 1):
+        print(f"  {i}. {KPI_TABLES[name]['file']} - {len(df):,} records")
     print(f"\n📦 Total size: {total_kpi_size:.2f} MB")
     
     print("\n✅ Next Steps:")
-    print("1. Upload these 5 new CSV files to Tableau Data Cloud")
+    print(f"1. Upload these {len(tables)} new CSV files to Tableau Data Cloud")
     print("2. Create DMOs for each KPI table")
     print("3. Update semantic layer to reference pre-calculated fields")
     print("4. Enjoy simple SUM/AVG aggregations instead of complex LOD!")
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+CryptoRisk Analytics - Price Matrix Store
+Aligned (date x symbol) daily return, close and volume matrices written once to
+.npy files and memory-mapped by every consumer (KPI stages and workers, the
+concierge cache, covariance engine) instead of each pivoting the long prices frame.
+
+Layout of the store directory:
+    returns.npy / close.npy / volume.npy   float64 (date x symbol), NaN = no row
+    index.json                             dates, symbols and the prices fingerprint
+                                           (shape, date range and a content hash)
+
+Arrays are opened with mmap_mode='r', so a process only pages in the rows and
+columns it touches and slices are zero-copy views. index.json is written last;
+a store is reused only while its fingerprint matches the prices frame.
+
+Usage:
+    matrices = shared_matrices(prices_df, DATA_DIR / MATRIX_DIR)
+    returns = matrices.frame('returns', symbols=['BTC', 'ETH'], start='2024-01-01')
+"""
+
+import json
+import weakref
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Configuration
+DATA_DIR = Path(__file__).parent.parent / "data" / "raw"
+MATRIX_DIR = 'price_matrices'
+INDEX_FILE = 'index.json'
+FIELDS = {'returns': 'daily_return', 'close': 'close', 'volume': 'volume'}
+
+
+_content_hashes = {}
+
+
+def content_hash(prices_df):
+    """
+    Hex digest of the date, symbol and matrix field values of a prices frame.
+
+    The wrapping sum of per-row hashes does not depend on row order. It is computed
+    once per frame object (frames are not modified after they reach the stores).
+    """
+    key = id(prices_df)
+    cached = _content_hashes.get(key)
+    if cached is not None and cached[0]() is prices_df:
+        return cached[1]
+    columns = [c for c in ['date', 'symbol', *FIELDS.values()] if c in prices_df.columns]
+    row_hashes = pd.util.hash_pandas_object(prices_df[columns], index=False).to_numpy()
+    digest = format(int(row_hashes.sum(dtype=np.uint64)), '016x')
+    _content_hashes[key] = (weakref.ref(prices_df, lambda _, key=key: _content_hashes.pop(key, None)), digest)
+    return digest
+
+
+def prices_fingerprint(prices_df):
+    """Identity of a prices frame: rows, symbols, first/last date and content hash."""
+    return [len(prices_df), int(prices_df['symbol'].nunique()),
+            str(pd.Timestamp(prices_df['date'].min()).date()), str(pd.Timestamp(prices_df['date'].max()).date()),
+            content_hash(prices_df)]
+
+
+def align_prices(prices_df):
+    """
+    Scatter the long prices frame into dense (date x symbol) arrays.
+
+    Dates and symbols are sorted; a duplicated (date, symbol) keeps its last row.
+
+    Returns:
+        (DatetimeIndex of dates, list of symbols, dict of field -> 2-D float array)
+    """
+    dates = pd.DatetimeIndex(np.sort(pd.to_datetime(prices_df['date']).unique()))
+    symbol_codes, symbols = pd.factorize(prices_df['symbol'], sort=True)
+    date_codes = dates.searchsorted(pd.to_datetime(prices_df['date']))
+
+    # Assigning in row order lets the last duplicate win
+    order = np.lexsort((np.arange(len(prices_df)), symbol_codes, date_codes))
+    rows, cols = date_codes[order], symbol_codes[order]
+    arrays = {}
+    for field, column in FIELDS.items():
+        matrix = np.full((len(dates), len(symbols)), np.nan)
+        if column in prices_df.columns:
+            matrix[rows, cols] = prices_df[column].to_numpy(dtype=float)[order]
+        arrays[field] = matrix
+    return dates, list(symbols), arrays
+
+
+class PriceMatrices:
+    """Date x symbol matrices with label-based slicing (backed by arrays or memory maps)."""
+
+    def __init__(self, dates, symbols, arrays, fingerprint=None):
+        self.dates = pd.DatetimeIndex(dates)
+        self.symbols = list(symbols)
+        self.fingerprint = fingerprint
+        self._arrays = arrays
+        self._index = {symbol: i for i, symbol in enumerate(self.symbols)}
+
+    @classmethod
+    def from_prices(cls, prices_df):
+        """Build in-memory matrices from a prices frame."""
+        dates, symbols, arrays = align_prices(prices_df)
+        return cls(dates, symbols, arrays, prices_fingerprint(prices_df))
+
+    @classmethod
+    def open(cls, directory):
+        """Memory-map a store written by save(); returns None if it is missing or incomplete."""
+        directory = Path(directory)
+        index_path = directory / INDEX_FILE
+        if not index_path.exists():
+            return None
+        with open(index_path) as f:
+            index = json.load(f)
+        arrays = {field: np.load(directory / f"{field}.npy", mmap_mode='r') for field in FIELDS}
+        return cls(pd.to_datetime(index['dates']), index['symbols'], arrays, index['fingerprint'])
+
+    def save(self, directory):
+        """Write the matrices and index to a store directory (index last, so readers never see a partial store)."""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        (directory / INDEX_FILE).unlink(missing_ok=True)
+        for field in FIELDS:
+            np.save(directory / f"{field}.npy", np.ascontiguousarray(self._arrays[field], dtype=float))
+        with open(directory / INDEX_FILE, 'w') as f:
+            json.dump({'fingerprint': self.fingerprint, 'fields': list(FIELDS),
+                       'dates': [str(d.date()) for d in self.dates], 'symbols': self.symbols}, f)
+
+    def __contains__(self, symbol):
+        return symbol in self._index
+
+    def array(self, field, symbols=None, start=None, end=None):
+        """
+        Slice one matrix by date range (inclusive) and symbols.
+
+        A contiguous date range over all symbols is a zero-copy view; selecting
+        symbols gathers those columns. Unknown symbols are skipped.
+        """
+        rows = slice(self.dates.searchsorted(pd.Timestamp(start)) if start is not None else 0,
+                     self.dates.searchsorted(pd.Timestamp(end), side='right') if end is not None else len(self.dates))
+        matrix = self._arrays[field][rows]
+        if symbols is None:
+            return matrix
+        return matrix[:, [self._index[s] for s in symbols if s in self._index]]
+
+    def frame(self, field, symbols=None, start=None, end=None):
+        """Slice one matrix as a DataFrame indexed by date with one column per symbol."""
+        rows = slice(self.dates.searchsorted(pd.Timestamp(start)) if start is not None else 0,
+                     self.dates.searchsorted(pd.Timestamp(end), side='right') if end is not None else len(self.dates))
+        columns = self.symbols if symbols is None else [s for s in symbols if s in self._index]
+        return pd.DataFrame(self.array(field, symbols, start, end), index=self.dates[rows],
+                            columns=pd.Index(columns, name='symbol'), copy=False).rename_axis('date')
+
+    def cross_section(self, field, date):
+        """Values of one field for every symbol on a date (NaN where missing)."""
+        position = self.dates.get_loc(pd.Timestamp(date))
+        return pd.Series(self._arrays[field][position], index=pd.Index(self.symbols, name='symbol'))
+
+
+def build_matrix_store(prices_df, directory):
+    """Write the aligned matrices for prices_df to directory and return the memory-mapped store."""
+    PriceMatrices.from_prices(prices_df).save(directory)
+    store = PriceMatrices.open(directory)
+    _shared[tuple(prices_fingerprint(prices_df))] = store
+    return store
+
+
+_shared = {}
+
+
+def shared_matrices(prices_df, directory=None):
+    """
+    Return the price matrices for prices_df, reusing ones loaded earlier in this process.
+
+    Maps the on-disk store in `directory` when its fingerprint matches prices_df
+    (e.g. one written by the parent before KPI workers start); otherwise builds
+    the matrices in memory.
+    """
+    fingerprint = prices_fingerprint(prices_df)
+    key = tuple(fingerprint)
+    if key not in _shared:
+        store = PriceMatrices.open(directory) if directory is not None else None
+        if store is None or store.fingerprint != fingerprint:
+            store = PriceMatrices.from_prices(prices_df)
+        _shared[key] = store
+    return _shared[key]
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+CryptoRisk Analytics - Price Store
+Symbol/date index over the long prices frame, replacing repeated full scans such
+as prices_df[prices_df['symbol'] == symbol] or prices_df[prices_df['date'] == date].
+
+Rows are kept sorted by (symbol, date) with per-symbol offsets, so one symbol's
+history (or a date range of it) is a binary search plus a slice. A second,
+date-major permutation serves cross sections and all-symbol date ranges the
+same way. Ties keep the original row order and original index labels, so
+results match the boolean filters they replace.
+
+Usage:
+    store = shared_store(prices_df)
+    btc = store.get('BTC', start='2024-01-01')
+    day = store.cross_section('2024-06-30')
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# Configuration
+CACHE_SIZE = 4          # Price frames indexed at once per process
+
+
+class PriceStore:
+    """Read-only (symbol, date) index over a long prices frame."""
+
+    def __init__(self, prices_df):
+        self._prices = prices_df
+        dates = pd.to_datetime(prices_df['date']).to_numpy(dtype='datetime64[ns]')
+        codes, symbols = pd.factorize(prices_df['symbol'], sort=True)
+        self.symbols = list(symbols)
+
+        # Symbol-major: rows of each symbol contiguous and date-sorted
+        order = np.lexsort((dates, codes))
+        self.frame = prices_df.iloc[order]
+        self._symbol_dates = dates[order]
+        bounds = np.searchsorted(codes[order], np.arange(len(self.symbols) + 1))
+        self._offsets = {symbol: (int(bounds[i]), int(bounds[i + 1])) for i, symbol in enumerate(self.symbols)}
+
+        # Date-major permutation for cross sections
+        self._date_order = np.argsort(dates, kind='stable')
+        self._dates = dates[self._date_order]
+
+    def __len__(self):
+        return len(self._prices)
+
+    def __contains__(self, symbol):
+        return symbol in self._offsets
+
+    @property
+    def dates(self):
+        """Distinct price dates in order."""
+        return pd.DatetimeIndex(np.unique(self._dates))
+
+    @staticmethod
+    def _bounds(dates, start, end, lo=0, hi=None):
+        hi = len(dates) if hi is None else hi
+        first = lo if start is None else lo + int(dates[lo:hi].searchsorted(np.datetime64(pd.Timestamp(start))))
+        last = hi if end is None else lo + int(dates[lo:hi].searchsorted(np.datetime64(pd.Timestamp(end)), side='right'))
+        return first, last
+
+    def get(self, symbol, start=None, end=None):
+        """Rows of one symbol with start <= date <= end, in date order (empty if unknown)."""
+        if symbol not in self._offsets:
+            return self.frame.iloc[0:0]
+        first, last = self._bounds(self._symbol_dates, start, end, *self._offsets[symbol])
+        return self.frame.iloc[first:last]
+
+    def cross_section(self, date):
+        """Rows of every symbol on one date."""
+        return self.between(date, date)
+
+    def between(self, start=None, end=None):
+        """Rows of every symbol with start <= date <= end, in date order."""
+        first, last = self._bounds(self._dates, start, end)
+        return self._prices.iloc[self._date_order[first:last]]
+
+
+_shared = OrderedDict()
+
+
+def shared_store(prices_df):
+    """
+    Return the PriceStore for prices_df, reusing the one built earlier in this process.
+
+    Stores are keyed by the frame's identity, shape, columns and date range, and the
+    CACHE_SIZE most recent are kept, so every stage handed the same frame shares one index.
+    """
+    key = (id(prices_df), len(prices_df), tuple(prices_df.columns),
+           str(prices_df['date'].min()), str(prices_df['date'].max()))
+    if key in _shared:
+        _shared.move_to_end(key)
+        return _shared[key]
+    _shared[key] = store = PriceStore(prices_df)
+    if len(_shared) > CACHE_SIZE:
+        _shared.popitem(last=False)
+    return store
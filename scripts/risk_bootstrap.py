@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+CryptoRisk Analytics - Risk Bootstrap
+Block-bootstrap confidence intervals for volatility, Sharpe, Sortino and VaR of
+many return series at once.
+
+One (resamples x days) index matrix of circular moving blocks is drawn up front
+and shared by every series, so each resample is a single gather over the
+(days x series) returns matrix and all series see the same resampled days.
+Statistics follow calculate_portfolio_risk_metrics (annualized with 365 days,
+2% risk-free rate, downside deviation over negative days, historical VaR).
+
+Memory is bounded by chunk_bytes: series are split into blocks whose resampled
+statistics fit the budget, and resamples are gathered a chunk at a time. Blocks
+run in a process pool when there are many series.
+
+Usage:
+    intervals = bootstrap_intervals(returns_df, n_resamples=10_000)
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+# Configuration
+N_RESAMPLES = 10_000
+BLOCK_SIZE = 7                      # Days per block; keeps a week of volatility clustering together
+CONFIDENCE = 0.95
+RISK_FREE_RATE = 0.02               # Annual, as in the point estimates
+ANNUALIZATION = 365
+SEED = 20240101
+CHUNK_BYTES = 256 * 1024 * 1024     # Working-memory budget per process
+PARALLEL_MIN_SERIES = 500           # Below this, a process pool costs more than it saves
+METRICS = ['volatility', 'sharpe_ratio', 'sortino_ratio', 'var_95_pct', 'var_99_pct']
+
+_indices = None
+
+
+def block_bootstrap_indices(n_obs, n_resamples=N_RESAMPLES, block_size=BLOCK_SIZE, seed=SEED):
+    """
+    Circular moving-block resample indices.
+
+    Returns:
+        (n_resamples x n_obs) int32 array; row r lists the day positions of resample r
+    """
+    rng = np.random.default_rng(seed)
+    block_size = max(1, min(block_size, n_obs))
+    n_blocks = -(-n_obs // block_size)
+    starts = rng.integers(0, n_obs, size=(n_resamples, n_blocks), dtype=np.int64)
+    indices = (starts[:, :, None] + np.arange(block_size)) % n_obs
+    return indices.reshape(n_resamples, -1)[:, :n_obs].astype(np.int32)
+
+
+def resample_counts(indices, n_obs):
+    """(resamples x days) matrix of how often each day appears in each resample."""
+    n_resamples = len(indices)
+    flat = (indices + (np.arange(n_resamples, dtype=np.int64) * n_obs)[:, None]).ravel()
+    return np.bincount(flat, minlength=n_resamples * n_obs).reshape(n_resamples, n_obs)
+
+
+def _order_statistics(counts, order, ranks):
+    """
+    Order statistics of resampled series, from day counts.
+
+    The m-th smallest value of a resample is the first day (in ascending order of
+    the series) at which the cumulative count exceeds m. Only the lowest days are
+    scanned, widening the scan for any resample that needs more.
+
+    Args:
+        counts: (resamples x days) day counts
+        order: (days x series) day positions sorting each series ascending
+        ranks: 0-based order statistics wanted
+
+    Returns:
+        dict of rank -> (resamples x series) array of sorted-day positions
+    """
+    n_obs = len(order)
+    scan = min(n_obs, 2 * max(ranks) + 16)
+    while True:
+        cumulative = np.cumsum(counts[:, order[:scan]], axis=1)
+        if scan == n_obs or (cumulative[:, -1] > max(ranks)).all():
+            return {m: np.argmax(cumulative > m, axis=1) for m in ranks}
+        scan = min(n_obs, 2 * scan)
+
+
+def risk_statistics(returns, counts):
+    """
+    Risk metrics of resampled return series, computed from day counts.
+
+    Sums over a resample are counts @ values, so every moment for all resamples and
+    series is one matrix product; VaR comes from order statistics of the counts.
+
+    Args:
+        returns: (days x series) daily returns
+        counts: (resamples x days) day counts (a row of ones is the original sample)
+
+    Returns:
+        dict of metric (see METRICS) -> (resamples x series) array; undefined values are NaN
+    """
+    rf_daily = RISK_FREE_RATE / ANNUALIZATION
+    scale = np.sqrt(ANNUALIZATION)
+    n_obs = returns.shape[0]
+    weights = counts.astype(float)
+
+    # Centering per series keeps the sums of squares well conditioned
+    center = returns.mean(axis=0)
+    centered = returns - center
+    negative = (returns < 0).astype(float)
+    s1, s2 = weights @ centered, weights @ centered ** 2
+    n_negative = weights @ negative
+    d1, d2 = weights @ (centered * negative), weights @ (centered ** 2 * negative)
+
+    mean = s1 / n_obs + center
+    with np.errstate(divide='ignore', invalid='ignore'):
+        std = np.sqrt(np.maximum(s2 - s1 ** 2 / n_obs, 0.0) / (n_obs - 1))
+        downside_var = np.maximum(d2 - d1 ** 2 / n_negative, 0.0) / (n_negative - 1)
+        downside_std = np.sqrt(np.where(n_negative > 1, downside_var, np.nan))
+        sharpe = np.where(std > 0, (mean - rf_daily) / std * scale, np.nan)
+        sortino = np.where(downside_std > 0, (mean - rf_daily) / downside_std * scale, np.nan)
+
+    # Historical VaR with np.percentile's linear interpolation between order statistics
+    order = np.argsort(returns, axis=0, kind='stable')
+    sorted_returns = np.take_along_axis(returns, order, axis=0)
+    positions = {p: (n_obs - 1) * p / 100 for p in (5, 1)}
+    ranks = sorted({r for h in positions.values() for r in (int(h), min(int(h) + 1, n_obs - 1))})
+    statistics = _order_statistics(counts, order, ranks)
+    series = np.arange(returns.shape[1])
+    var = {}
+    for p, h in positions.items():
+        below = sorted_returns[statistics[int(h)], series]
+        above = sorted_returns[statistics[min(int(h) + 1, n_obs - 1)], series]
+        var[p] = below + (above - below) * (h - int(h))
+    return {'volatility': std * scale, 'sharpe_ratio': sharpe, 'sortino_ratio': sortino,
+            'var_95_pct': var[5] * 100, 'var_99_pct': var[1] * 100}
+
+
+def _interval_block(returns, indices=None, confidence=CONFIDENCE, chunk_bytes=CHUNK_BYTES):
+    """Bootstrap one block of series: returns dict of '<metric>_ci_lower/_ci_upper/_std_error' -> array."""
+    indices = _indices if indices is None else indices
+    n_resamples, n_obs = indices.shape
+    # Per resample: its day counts plus the order-statistic scan over the series
+    chunk = max(1, chunk_bytes // (8 * (2 * n_obs + 4 * returns.shape[1] * min(n_obs, 64))))
+    stats = {metric: np.empty((n_resamples, returns.shape[1])) for metric in METRICS}
+    for first in range(0, n_resamples, chunk):
+        counts = resample_counts(indices[first:first + chunk], n_obs)
+        for metric, values in risk_statistics(returns, counts).items():
+            stats[metric][first:first + chunk] = values
+
+    tail = (1 - confidence) / 2 * 100
+    result = {}
+    for metric, values in stats.items():
+        with np.errstate(invalid='ignore'):
+            lower, upper = np.nanpercentile(values, [tail, 100 - tail], axis=0)
+            result[f'{metric}_ci_lower'], result[f'{metric}_ci_upper'] = lower, upper
+            result[f'{metric}_std_error'] = np.nanstd(values, axis=0, ddof=1)
+    return result
+
+
+def _init_worker(indices):
+    global _indices
+    _indices = indices
+
+
+def bootstrap_intervals(returns_df, n_resamples=N_RESAMPLES, block_size=BLOCK_SIZE, confidence=CONFIDENCE,
+                        seed=SEED, workers=None, chunk_bytes=CHUNK_BYTES):
+    """
+    Point estimates and block-bootstrap confidence intervals for every column of a returns matrix.
+
+    Args:
+        returns_df: (date x series) daily returns without gaps (e.g. portfolio returns)
+        n_resamples: Bootstrap resamples
+        block_size: Days per resampled block
+        confidence: Two-sided confidence level of the percentile intervals
+        seed: Seed for the shared resample indices
+        workers: Processes (default: all cores once there are PARALLEL_MIN_SERIES series, else 1)
+        chunk_bytes: Working-memory budget per process
+
+    Returns:
+        DataFrame indexed by series with each metric in METRICS plus its
+        _ci_lower, _ci_upper and _std_error
+    """
+    returns = returns_df.to_numpy(dtype=float)
+    n_obs, n_series = returns.shape
+    point = {metric: values[0] for metric, values in risk_statistics(returns, np.ones((1, n_obs), dtype=np.int64)).items()}
+    if n_obs < 2 or n_series == 0:
+        return pd.DataFrame(point, index=returns_df.columns)
+
+    if workers is None:
+        workers = (os.cpu_count() or 1) if n_series >= PARALLEL_MIN_SERIES else 1
+    indices = block_bootstrap_indices(n_obs, n_resamples, block_size, seed)
+
+    # Series per block so that the (resamples x series) statistics fit the budget,
+    # and at least two blocks per worker when running in parallel
+    per_block = max(1, chunk_bytes // (len(METRICS) * 8 * n_resamples))
+    if workers > 1:
+        per_block = min(per_block, -(-n_series // (2 * workers)))
+    blocks = [returns[:, first:first + per_block] for first in range(0, n_series, per_block)]
+
+    if workers <= 1 or len(blocks) == 1:
+        results = [_interval_block(block, indices, confidence, chunk_bytes) for block in blocks]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        # Indices are shipped to each worker once, not with every block
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(indices,)) as pool:
+            results = list(pool.map(_interval_block, blocks, [None] * len(blocks),
+                                    [confidence] * len(blocks), [chunk_bytes] * len(blocks)))
+
+    df = pd.DataFrame(point, index=returns_df.columns)
+    for column in results[0]:
+        df[column] = np.concatenate([result[column] for result in results])
+    columns = [c for metric in METRICS for c in (metric, f'{metric}_ci_lower', f'{metric}_ci_upper', f'{metric}_std_error')]
+    return df[columns]
@@ -0,0 +1,888 @@
+#!/usr/bin/env python3
+"""
+CryptoRisk Analytics - Local Semantic Layer Engine
+Parses the measure and KPI definitions in config/semantic_layer_config.yaml and
+evaluates them over the CSV tables produced by the data preparation scripts.
+
+Supports the formula subset used by the semantic layer: plain aggregations,
+arithmetic, IIF/CASE, FIXED LOD expressions, PERCENTILE/STDEV and the
+LOOKUP / RUNNING_* / WINDOW_* table calculations. Results are kept in an LRU
+pre-aggregation cache keyed by (measure, dimensions, filters), and per-measure
+timings show which measures are expensive enough to precompute as KPI tables.
+
+Run this AFTER prepare_crypto_data.py (and prepare_crypto_data_with_kpis.py).
+"""
+
+import json
+import re
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import yaml
+
+# Configuration
+DATA_DIR = Path(__file__).parent.parent / "data" / "raw"
+CONFIG_PATH = Path(__file__).parent.parent / "config" / "semantic_layer_config.yaml"
+SNAPSHOT_FILE = 'semantic_layer_snapshot.json'
+
+# DMO name -> CSV file written by the pipeline
+DMO_TABLES = {
+    'dmo_cryptocurrency': 'crypto_reference.csv',
+    'dmo_crypto_prices': 'crypto_prices_daily_2020_2024.csv',
+    'dmo_portfolio_positions': 'portfolio_positions_current.csv',
+    'dmo_trades': 'trades_history_sample.csv',
+    'dmo_market_metrics': 'market_metrics_daily.csv',
+    'dmo_correlation_matrix': 'correlation_matrix.csv',
+    'dmo_kpi_volatility': 'kpi_portfolio_volatility_timeseries.csv',
+    'dmo_kpi_var': 'kpi_portfolio_var_current.csv',
+    'dmo_kpi_risk_adjusted': 'kpi_portfolio_risk_adjusted_returns.csv',
+    'dmo_kpi_concentration': 'kpi_portfolio_concentration.csv',
+    'dmo_kpi_concentration_history': 'kpi_portfolio_concentration_history.csv',
+    'dmo_kpi_24h_change': 'kpi_portfolio_24h_change.csv',
+    'dmo_kpi_drawdown': 'kpi_portfolio_drawdown_timeseries.csv',
+    'dmo_kpi_rolling_beta': 'kpi_rolling_beta_timeseries.csv',
+    'dmo_kpi_realized_pnl': 'kpi_realized_pnl_timeseries.csv',
+    'dmo_kpi_open_lots': 'kpi_open_lots.csv',
+    'dmo_kpi_position_ledger': 'kpi_position_ledger.csv',
+    'dmo_kpi_category_attribution': 'kpi_category_attribution.csv',
+    'dmo_kpi_risk_bootstrap': 'kpi_portfolio_risk_bootstrap.csv',
+    'dmo_kpi_garch_forecast': 'kpi_garch_volatility_forecast.csv',
+    'dmo_kpi_correlation_clusters': 'kpi_correlation_clusters.csv',
+    'dmo_kpi_hrp_weights': 'kpi_portfolio_hrp_weights.csv',
+    'dmo_kpi_liquidity_risk': 'kpi_portfolio_liquidity_risk.csv',
+}
+
+# Date column of each DMO (the "Date" dimension resolves to these)
+DMO_DATE_COLUMNS = {
+    'dmo_crypto_prices': 'date',
+    'dmo_portfolio_positions': 'as_of_date',
+    'dmo_trades': 'trade_date',
+    'dmo_market_metrics': 'date',
+    'dmo_kpi_volatility': 'date',
+    'dmo_kpi_var': 'as_of_date',
+    'dmo_kpi_risk_adjusted': 'as_of_date',
+    'dmo_kpi_concentration': 'as_of_date',
+    'dmo_kpi_concentration_history': 'as_of_date',
+    'dmo_kpi_24h_change': 'date',
+    'dmo_kpi_drawdown': 'date',
+    'dmo_kpi_rolling_beta': 'date',
+    'dmo_kpi_realized_pnl': 'date',
+    'dmo_kpi_open_lots': 'acquired_date',
+    'dmo_kpi_position_ledger': 'as_of_date',
+    'dmo_kpi_category_attribution': 'date',
+    'dmo_kpi_risk_bootstrap': 'as_of_date',
+    'dmo_kpi_garch_forecast': 'as_of_date',
+    'dmo_kpi_correlation_clusters': 'as_of_date',
+    'dmo_kpi_hrp_weights': 'as_of_date',
+    'dmo_kpi_liquidity_risk': 'as_of_date',
+}
+
+# Keys used to look dimension attributes up from another DMO
+JOIN_KEYS = ['symbol', 'portfolio_id']
+
+AGGREGATIONS = {
+    'sum': 'sum',
+    'average': 'mean',
+    'avg': 'mean',
+    'min': 'min',
+    'max': 'max',
+    'count': 'count',
+    'count_distinct': 'nunique',
+    'stdev': 'std',
+    'median': 'median',
+}
+
+AGGREGATE_FUNCTIONS = {
+    'SUM': 'sum', 'AVG': 'mean', 'MIN': 'min', 'MAX': 'max', 'MEDIAN': 'median',
+    'STDEV': 'std', 'COUNT': 'count', 'COUNTD': 'nunique',
+}
+
+TABLE_CALCULATIONS = {
+    'RUNNING_MAX': 'cummax', 'RUNNING_MIN': 'cummin', 'RUNNING_SUM': 'cumsum',
+    'WINDOW_MIN': 'min', 'WINDOW_MAX': 'max', 'WINDOW_AVG': 'mean', 'WINDOW_SUM': 'sum',
+}
+
+KEYWORDS = {'FIXED', 'CASE', 'WHEN', 'THEN', 'ELSE', 'END', 'AND', 'OR', 'NOT', 'NULL', 'TRUE', 'FALSE'}
+
+
+class UnsupportedFormula(Exception):
+    """Raised when a formula uses syntax or data the local engine cannot evaluate."""
+
+
+def load_semantic_model(config_path=CONFIG_PATH):
+    """
+    Load dimensions, measures and calculated KPIs from the semantic layer YAML.
+
+    Returns:
+        dict with 'dimensions' and 'measures' (name -> spec). Calculated KPIs are
+        merged into 'measures' since they are evaluated the same way.
+    """
+    with open(config_path) as f:
+        config = yaml.safe_load(f)['semantic_model']
+
+    dimensions = {d['name']: d for d in config.get('dimensions', [])}
+    measures = {m['name']: m for m in config.get('measures', [])}
+    measures.update({k['name']: k for k in config.get('calculated_kpis', [])})
+
+    return {'dimensions': dimensions, 'measures': measures}
+
+
+# =============================================================================
+# FORMULA PARSER
+# =============================================================================
+
+_TOKEN_RE = re.compile(r"""
+    (?P<ws>\s+)
+  | (?P<number>\d+(?:\.\d+)?)
+  | (?P<string>'[^']*')
+  | (?P<ref>\[[^\]]+\](?:\.\[[^\]]+\])?)
+  | (?P<op><>|!=|>=|<=|[-+*/^=<>(){}:,])
+  | (?P<ident>[A-Za-z_][A-Za-z0-9_]*)
+""", re.VERBOSE)
+
+
+def tokenize(formula, known_names=()):
+    """
+    Split a formula into (kind, value) tokens.
+
+    Bare measure/dimension names containing spaces or parentheses (e.g.
+    `Position Concentration (HHI)`) are matched against known_names first,
+    longest name first.
+    """
+    names = sorted(known_names, key=len, reverse=True)
+    tokens = []
+    pos = 0
+    while pos < len(formula):
+        name = next((n for n in names if formula.startswith(n, pos)
+                     and not formula[pos + len(n):pos + len(n) + 1].isalnum()), None)
+        if name is not None:
+            tokens.append(('name', name))
+            pos += len(name)
+            continue
+
+        match = _TOKEN_RE.match(formula, pos)
+        if match is None:
+            raise UnsupportedFormula(f"Unexpected character {formula[pos]!r} in: {formula}")
+        kind = match.lastgroup
+        value = match.group()
+        pos = match.end()
+
+        if kind == 'ws':
+            continue
+        if kind == 'ident' and value.upper() in KEYWORDS:
+            kind, value = 'keyword', value.upper()
+        tokens.append((kind, value))
+    return tokens
+
+
+class _Parser:
+    """Recursive-descent parser producing a tuple-based AST."""
+
+    def __init__(self, tokens, formula):
+        self.tokens = tokens
+        self.formula = formula
+        self.pos = 0
+
+    def peek(self, offset=0):
+        index = self.pos + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None)
+
+    def take(self, value=None):
+        kind, token = self.peek()
+        if kind is None or (value is not None and token != value):
+            raise UnsupportedFormula(f"Expected {value or 'token'} at {token!r} in: {self.formula}")
+        self.pos += 1
+        return kind, token
+
+    def parse(self):
+        node = self.expression()
+        if self.pos != len(self.tokens):
+            raise UnsupportedFormula(f"Unexpected token {self.peek()[1]!r} in: {self.formula}")
+        return node
+
+    def expression(self):
+        node = self.conjunction()
+        while self.peek() == ('keyword', 'OR'):
+            self.take()
+            node = ('bin', 'OR', node, self.conjunction())
+        return node
+
+    def conjunction(self):
+        node = self.comparison()
+        while self.peek() == ('keyword', 'AND'):
+            self.take()
+            node = ('bin', 'AND', node, self.comparison())
+        return node
+
+    def comparison(self):
+        node = self.additive()
+        if self.peek()[1] in ('=', '!=', '<>', '>', '<', '>=', '<='):
+            _, op = self.take()
+            node = ('bin', op, node, self.additive())
+        return node
+
+    def additive(self):
+        node = self.term()
+        while self.peek()[1] in ('+', '-'):
+            _, op = self.take()
+            node = ('bin', op, node, self.term())
+        return node
+
+    def term(self):
+        node = self.power()
+        while self.peek()[1] in ('*', '/'):
+            _, op = self.take()
+            node = ('bin', op, node, self.power())
+        return node
+
+    def power(self):
+        node = self.unary()
+        if self.peek()[1] == '^':
+            self.take()
+            node = ('bin', '^', node, self.power())
+        return node
+
+    def unary(self):
+        if self.peek()[1] == '-':
+            self.take()
+            return ('neg', self.unary())
+        if self.peek() == ('keyword', 'NOT'):
+            self.take()
+            return ('not', self.unary())
+        return self.primary()
+
+    def primary(self):
+        kind, token = self.peek()
+        if kind == 'number':
+            self.take()
+            return ('const', float(token))
+        if kind == 'string':
+            self.take()
+            return ('const', token[1:-1])
+        if kind == 'keyword' and token in ('NULL', 'TRUE', 'FALSE'):
+            self.take()
+            return ('const', {'NULL': np.nan, 'TRUE': True, 'FALSE': False}[token])
+        if kind == 'keyword' and token == 'CASE':
+            return self.case()
+        if kind == 'ref':
+            self.take()
+            parts = re.findall(r'\[([^\]]+)\]', token)
+            return ('ref', parts[0], parts[1]) if len(parts) == 2 else ('ref', None, parts[0])
+        if kind == 'name':
+            self.take()
+            return ('ref', None, token)
+        if kind == 'ident':
+            self.take()
+            if self.peek()[1] == '(':
+                return ('call', token.upper(), self.arguments())
+            return ('ref', None, token)
+        if token == '(':
+            self.take()
+            node = self.expression()
+            self.take(')')
+            return node
+        if token == '{':
+            return self.lod()
+        raise UnsupportedFormula(f"Unexpected token {token!r} in: {self.formula}")
+
+    def arguments(self):
+        self.take('(')
+        args = []
+        if self.peek()[1] != ')':
+            args.append(self.expression())
+            while self.peek()[1] == ',':
+                self.take()
+                args.append(self.expression())
+        self.take(')')
+        return args
+
+    def lod(self):
+        self.take('{')
+        _, kind = self.take()
+        if kind != 'FIXED':
+            raise UnsupportedFormula(f"Only FIXED LOD expressions are supported: {self.formula}")
+        dims = [self.primary()[2]]
+        while self.peek()[1] == ',':
+            self.take()
+            dims.append(self.primary()[2])
+        self.take(':')
+        body = self.expression()
+        self.take('}')
+        return ('fixed', dims, body)
+
+    def case(self):
+        self.take('CASE')
+        branches = []
+        default = ('const', np.nan)
+        while self.peek() == ('keyword', 'WHEN'):
+            self.take()
+            condition = self.expression()
+            self.take('THEN')
+            branches.append((condition, self.expression()))
+        if self.peek() == ('keyword', 'ELSE'):
+            self.take()
+            default = self.expression()
+        self.take('END')
+        return ('case', branches, default)
+
+
+def parse_formula(formula, known_names=()):
+    """Parse a semantic-layer formula into an AST."""
+    return _Parser(tokenize(formula, known_names), formula).parse()
+
+
+# =============================================================================
+# EVALUATION
+# =============================================================================
+
+class _Rows:
+    """Row-level values of one DMO (aligned to its filtered frame)."""
+
+    def __init__(self, dmo, values):
+        self.dmo = dmo
+        self.values = values
+
+
+class _Context:
+    def __init__(self, dims, filters, compute_using='Date', row_level=False):
+        self.dims = list(dims)
+        self.filters = filters
+        self.compute_using = compute_using
+        self.row_level = row_level
+
+    def derive(self, **changes):
+        ctx = _Context(self.dims, self.filters, self.compute_using, self.row_level)
+        for key, value in changes.items():
+            setattr(ctx, key, value)
+        return ctx
+
+
+def _freeze(value):
+    """Make filter values hashable for use in cache keys."""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple, set)):
+        return tuple(sorted(_freeze(v) for v in value))
+    return value
+
+
+def _to_frame(value):
+    name = '__value__'
+    return value.rename(name).reset_index(), list(value.index.names)
+
+
+def _combine(a, b, fn):
+    """
+    Apply a binary operation to scalars, row values or aggregated Series.
+
+    Aggregated Series are aligned on the dimension levels they share and
+    broadcast over the ones they do not (like relationships between DMOs).
+    """
+    if isinstance(a, _Rows) or isinstance(b, _Rows):
+        dmos = {v.dmo for v in (a, b) if isinstance(v, _Rows)}
+        if len(dmos) > 1:
+            raise UnsupportedFormula(f"Row-level expression mixes DMOs: {sorted(dmos)}")
+        if any(isinstance(v, pd.Series) for v in (a, b)):
+            raise UnsupportedFormula("Row-level values cannot be combined with aggregates")
+        left = a.values if isinstance(a, _Rows) else a
+        right = b.values if isinstance(b, _Rows) else b
+        return _Rows(dmos.pop(), fn(left, right))
+
+    if not isinstance(a, pd.Series) or not isinstance(b, pd.Series):
+        return fn(a, b)
+
+    names_a, names_b = list(a.index.names), list(b.index.names)
+    if set(names_a) == set(names_b):
+        if len(names_a) > 1:
+            b = b.reorder_levels(names_a)
+        return fn(a, b)
+
+    frame_a, _ = _to_frame(a)
+    frame_b, _ = _to_frame(b)
+    common = [n for n in names_a if n in names_b]
+    if common:
+        merged = frame_a.merge(frame_b, on=common, suffixes=('_a', '_b'))
+    else:
+        merged = frame_a.merge(frame_b, how='cross', suffixes=('_a', '_b'))
+    levels = names_a + [n for n in names_b if n not in names_a]
+    result = fn(merged['__value___a'], merged['__value___b'])
+    result.index = pd.MultiIndex.from_frame(merged[levels]) if len(levels) > 1 else pd.Index(merged[levels[0]])
+    return result
+
+
+def _apply(value, fn):
+    """Apply a unary function to a scalar, row values or an aggregated Series."""
+    if isinstance(value, _Rows):
+        return _Rows(value.dmo, fn(value.values))
+    return fn(value)
+
+
+_BINARY_OPS = {
+    '+': lambda a, b: a + b,
+    '-': lambda a, b: a - b,
+    '*': lambda a, b: a * b,
+    '/': lambda a, b: a / b,
+    '^': lambda a, b: a ** b,
+    '=': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '<>': lambda a, b: a != b,
+    '>': lambda a, b: a > b,
+    '<': lambda a, b: a < b,
+    '>=': lambda a, b: a >= b,
+    '<=': lambda a, b: a <= b,
+    'AND': lambda a, b: a & b,
+    'OR': lambda a, b: a | b,
+}
+
+
+class SemanticEngine:
+    """
+    Evaluate semantic-layer measures locally with an LRU pre-aggregation cache.
+
+    Tables are read lazily from data_dir the first time a DMO is referenced,
+    or can be passed in directly as {dmo_name: DataFrame}.
+    """
+
+    def __init__(self, model=None, data_dir=None, tables=None, cache_size=256):
+        self.model = model or load_semantic_model()
+        self.data_dir = Path(data_dir or DATA_DIR)
+        self.cache_size = cache_size
+        self._tables = dict(tables or {})
+        self._columns = {}
+        self._filtered = {}
+        self._cache = OrderedDict()
+        self._ast = {}
+        self._stats = {}
+        self._known_names = list(self.model['dimensions']) + list(self.model['measures'])
+
+    # --- Public API ---------------------------------------------------------
+
+    def query(self, measure, dimensions=(), filters=None):
+        """
+        Evaluate a measure grouped by dimensions.
+
+        Args:
+            measure: Measure or calculated KPI name from the semantic layer
+            dimensions: Dimension names to group by (e.g. ['Portfolio ID', 'Date'])
+            filters: {dimension name: value | [values] | {'min': x, 'max': y}}
+
+        Returns:
+            DataFrame with one column per resolved dimension plus the measure column.
+            Dimensions the measure's DMOs cannot resolve are left out.
+        """
+        result = self.evaluate(measure, dimensions, filters)
+        if isinstance(result, pd.Series):
+            return result.rename(measure).reset_index()
+        return pd.DataFrame({measure: [result]})
+
+    def evaluate(self, measure, dimensions=(), filters=None):
+        """Evaluate a measure and return a scalar or a Series indexed by dimensions."""
+        filters = filters or {}
+        key = (measure, tuple(dimensions), _freeze(filters))
+        stats = self._stats.setdefault(measure, {'calls': 0, 'cache_hits': 0, 'total_ms': 0.0})
+        stats['calls'] += 1
+
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            stats['cache_hits'] += 1
+            return self._cache[key]
+
+        start = time.perf_counter()
+        result = self._evaluate_measure(measure, _Context(dimensions, filters))
+        stats['total_ms'] += (time.perf_counter() - start) * 1000
+
+        self._cache[key] = result
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return result
+
+    def clear_cache(self):
+        """Drop cached aggregates and filtered tables (e.g. after new data is written)."""
+        self._cache.clear()
+        self._filtered.clear()
+
+    def cost_report(self):
+        """Per-measure evaluation cost, most expensive first."""
+        records = []
+        for measure, stats in self._stats.items():
+            misses = stats['calls'] - stats['cache_hits']
+            records.append({
+                'measure': measure,
+                'calls': stats['calls'],
+                'cache_hits': stats['cache_hits'],
+                'total_ms': round(stats['total_ms'], 3),
+                'avg_ms': round(stats['total_ms'] / misses, 3) if misses else 0.0,
+            })
+        df = pd.DataFrame(records, columns=['measure', 'calls', 'cache_hits', 'total_ms', 'avg_ms'])
+        return df.sort_values('total_ms', ascending=False).reset_index(drop=True)
+
+    def precompute_candidates(self, min_avg_ms=50.0):
+        """Measures whose uncached evaluation is slow enough to move into a KPI table."""
+        report = self.cost_report()
+        return report[report['avg_ms'] >= min_avg_ms]['measure'].tolist()
+
+    # --- Tables -------------------------------------------------------------
+
+    def table(self, dmo):
+        """Return a DMO's DataFrame, loading it from data_dir on first use."""
+        if dmo not in self._tables:
+            if dmo not in DMO_TABLES:
+                raise UnsupportedFormula(f"Unknown DMO: {dmo}")
+            path = self.data_dir / DMO_TABLES[dmo]
+            if not path.exists():
+                raise UnsupportedFormula(f"Missing table for {dmo}: {path.name}")
+            df = pd.read_csv(path)
+            date_col = DMO_DATE_COLUMNS.get(dmo)
+            if date_col in df.columns:
+                df[date_col] = pd.to_datetime(df[date_col])
+            self._tables[dmo] = df
+        return self._tables[dmo]
+
+    def columns(self, dmo):
+        """Column names of a DMO without loading the whole file."""
+        if dmo in self._tables:
+            return list(self._tables[dmo].columns)
+        if dmo not in self._columns:
+            path = self.data_dir / DMO_TABLES.get(dmo, '')
+            self._columns[dmo] = list(pd.read_csv(path, nrows=0).columns) if path.is_file() else []
+        return self._columns[dmo]
+
+    def _filtered_table(self, dmo, filters):
+        key = (dmo, _freeze(filters))
+        if key not in self._filtered:
+            df = self.table(dmo)
+            mask = pd.Series(True, index=df.index)
+            for dim, value in filters.items():
+                values = self._dimension_values(dmo, df, dim)
+                if values is None:
+                    continue
+                if isinstance(value, dict):
+                    if 'min' in value:
+                        mask &= values >= value['min']
+                    if 'max' in value:
+                        mask &= values <= value['max']
+                elif isinstance(value, (list, tuple, set)):
+                    mask &= values.isin(list(value))
+                else:
+                    mask &= values == value
+            self._filtered[key] = df[mask]
+        return self._filtered[key]
+
+    def _dimension_values(self, dmo, df, dim):
+        """Row-aligned values of a dimension for a DMO, or None if it cannot be resolved."""
+        spec = self.model['dimensions'].get(dim)
+        if spec is None or not re.fullmatch(r'\w+\.\w+', spec.get('source_field', '')):
+            return None
+        dim_dmo, field = spec['source_field'].split('.')
+
+        if field in df.columns:
+            return df[field]
+        if spec.get('data_type') == 'date' and DMO_DATE_COLUMNS.get(dmo) in df.columns:
+            return df[DMO_DATE_COLUMNS[dmo]]
+
+        key = next((k for k in JOIN_KEYS if k in df.columns and k in self.columns(dim_dmo)), None)
+        if key is None or field not in self.columns(dim_dmo):
+            return None
+        lookup = self.table(dim_dmo).drop_duplicates(key).set_index(key)[field]
+        return df[key].map(lookup)
+
+    # --- Evaluation ---------------------------------------------------------
+
+    def _parsed(self, measure):
+        if measure not in self._ast:
+            self._ast[measure] = parse_formula(self.model['measures'][measure]['formula'], self._known_names)
+        return self._ast[measure]
+
+    def _evaluate_measure(self, measure, ctx):
+        spec = self.model['measures'].get(measure)
+        if spec is None:
+            raise UnsupportedFormula(f"Unknown measure: {measure}")
+        ctx = ctx.derive(compute_using=spec.get('compute_using', 'Date'))
+        how = AGGREGATIONS.get(spec.get('aggregation', 'sum'), 'sum')
+
+        if 'formula' in spec:
+            # Formulas with an explicit aggregation are row-level expressions
+            row_level = 'aggregation' in spec
+            result = self._eval(self._parsed(measure), ctx.derive(row_level=row_level))
+            if isinstance(result, _Rows):
+                result = self._aggregate(result, how if row_level else 'mean', ctx)
+        else:
+            result = self._aggregate(self._source_rows(spec, ctx), how, ctx)
+
+        return self._conform(result, ctx.dims)
+
+    def _conform(self, result, dims):
+        """Roll aggregated values up to the requested dimensions."""
+        if not isinstance(result, pd.Series):
+            return result
+        keep = [d for d in dims if d in result.index.names]
+        if len(keep) == len(result.index.names):
+            return result.reorder_levels(keep) if len(keep) > 1 else result
+        if not keep:
+            return result.mean()
+        return result.groupby(level=keep).mean()
+
+    def _source_rows(self, spec, ctx):
+        dmo, field = spec['source_field'].split('.')
+        if field not in self.columns(dmo):
+            raise UnsupportedFormula(f"Column {field} not found in {dmo}")
+        return _Rows(dmo, self._filtered_table(dmo, ctx.filters)[field])
+
+    def _aggregate(self, rows, how, ctx, q=None):
+        df = self._filtered_table(rows.dmo, ctx.filters)
+        keys, names = [], []
+        for dim in ctx.dims:
+            values = self._dimension_values(rows.dmo, df, dim)
+            if values is not None:
+                keys.append(values)
+                names.append(dim)
+
+        values = pd.Series(rows.values, index=df.index) if np.ndim(rows.values) == 0 else rows.values
+        if not keys:
+            return values.quantile(q) if how == 'quantile' else values.agg(how)
+
+        grouped = values.groupby(keys)
+        result = grouped.quantile(q) if how == 'quantile' else grouped.agg(how)
+        result.index.names = names
+        return result
+
+    def _resolve_ref(self, dmo, name, ctx):
+        measures = self.model['measures']
+        dimensions = self.model['dimensions']
+
+        if name in measures:
+            spec = measures[name]
+            if not ctx.row_level:
+                return self.evaluate(name, ctx.dims, ctx.filters)
+            if 'source_field' in spec:
+                return self._source_rows(spec, ctx)
+            return self._eval(self._parsed(name), ctx)
+
+        if name in dimensions:
+            source = dimensions[name].get('source_field', '')
+            if not re.fullmatch(r'\w+\.\w+', source):
+                raise UnsupportedFormula(f"Computed dimension not supported: {name}")
+            dim_dmo, field = source.split('.')
+            dmo = dmo or dim_dmo
+            df = self._filtered_table(dmo, ctx.filters)
+            values = self._dimension_values(dmo, df, name)
+            if values is None:
+                raise UnsupportedFormula(f"Dimension {name} not available in {dmo}")
+            return _Rows(dmo, values)
+
+        # Plain column reference, e.g. [dmo_crypto_prices].[symbol] or Quantity
+        column_name = name.lower().replace(' ', '_')
+        candidates = [dmo] if dmo else list(DMO_TABLES)
+        for candidate in candidates:
+            columns = self.columns(candidate)
+            for column in (name, column_name):
+                if column in columns:
+                    return _Rows(candidate, self._filtered_table(candidate, ctx.filters)[column])
+        raise UnsupportedFormula(f"Unknown field: {name}")
+
+    def _eval(self, node, ctx):
+        kind = node[0]
+
+        if kind == 'const':
+            return node[1]
+        if kind == 'ref':
+            return self._resolve_ref(node[1], node[2], ctx)
+        if kind == 'neg':
+            return _apply(self._eval(node[1], ctx), lambda v: -v)
+        if kind == 'not':
+            return _apply(self._eval(node[1], ctx), lambda v: ~v)
+        if kind == 'bin':
+            left = self._eval(node[2], ctx)
+            right = self._eval(node[3], ctx)
+            return _combine(left, right, _BINARY_OPS[node[1]])
+        if kind == 'fixed':
+            return self._eval(node[2], ctx.derive(dims=node[1], row_level=False))
+        if kind == 'case':
+            branches = [(self._eval(c, ctx), self._eval(v, ctx)) for c, v in node[1]]
+            return self._select(branches, self._eval(node[2], ctx))
+        if kind == 'call':
+            return self._call(node[1], node[2], ctx)
+        raise UnsupportedFormula(f"Unknown node: {kind}")
+
+    def _select(self, branches, default):
+        """Vectorized CASE/IIF over row-level values."""
+        values = [v for pair in branches for v in pair] + [default]
+        dmos = {v.dmo for v in values if isinstance(v, _Rows)}
+        if any(isinstance(v, pd.Series) for v in values) or len(dmos) > 1:
+            raise UnsupportedFormula("CASE/IIF is only supported on row-level values of one DMO")
+        if not dmos:
+            return next((v for c, v in branches if c), default)
+
+        dmo = dmos.pop()
+        index = next(v.values.index for v in values if isinstance(v, _Rows))
+        unwrap = lambda v: v.values.to_numpy() if isinstance(v, _Rows) else v
+        conditions = [np.asarray(unwrap(c), dtype=bool) & np.ones(len(index), dtype=bool) for c, _ in branches]
+        choices = [np.broadcast_to(np.asarray(unwrap(v), dtype=float), len(index)) for _, v in branches]
+        default_values = np.broadcast_to(np.asarray(unwrap(default), dtype=float), len(index))
+        return _Rows(dmo, pd.Series(np.select(conditions, choices, default_values), index=index))
+
+    def _call(self, name, args, ctx):
+        if name in AGGREGATE_FUNCTIONS or name == 'PERCENTILE':
+            rows = self._eval(args[0], ctx.derive(row_level=True))
+            if not isinstance(rows, _Rows):
+                return rows
+            if name == 'PERCENTILE':
+                return self._aggregate(rows, 'quantile', ctx, q=float(self._eval(args[1], ctx)))
+            return self._aggregate(rows, AGGREGATE_FUNCTIONS[name], ctx)
+
+        if name == 'IIF':
+            condition, when_true, when_false = (self._eval(a, ctx) for a in args)
+            return self._select([(condition, when_true)], when_false)
+        if name == 'ABS':
+            return _apply(self._eval(args[0], ctx), abs)
+        if name == 'SQRT':
+            return _apply(self._eval(args[0], ctx), np.sqrt)
+        if name == 'ZN':
+            return _apply(self._eval(args[0], ctx), lambda v: v.fillna(0) if hasattr(v, 'fillna') else (0 if pd.isna(v) else v))
+        if name == 'TODAY':
+            return pd.Timestamp.today().normalize()
+        if name == 'DATEDIFF':
+            if self._eval(args[0], ctx) != 'day':
+                raise UnsupportedFormula("DATEDIFF only supports 'day'")
+            start, end = self._eval(args[1], ctx), self._eval(args[2], ctx)
+            return _combine(start, end, lambda a, b: (b - a) / pd.Timedelta(days=1))
+
+        if name == 'LOOKUP' or name in TABLE_CALCULATIONS:
+            values = self._eval(args[0], ctx.derive(row_level=False))
+            offset = int(self._eval(args[1], ctx)) if name == 'LOOKUP' else 0
+            return self._table_calculation(values, name, ctx, offset)
+
+        raise UnsupportedFormula(f"Unsupported function: {name}")
+
+    def _table_calculation(self, values, name, ctx, offset=0):
+        """Compute LOOKUP / RUNNING_* / WINDOW_* along ctx.compute_using."""
+        along = ctx.compute_using
+        if not isinstance(values, pd.Series) or along not in values.index.names:
+            raise UnsupportedFormula(f"{name} requires '{along}' in the query dimensions")
+
+        partition = [n for n in values.index.names if n != along]
+        ordered = values.sort_index(level=partition + [along])
+        grouped = ordered.groupby(level=partition) if partition else ordered.groupby(lambda _: 0)
+
+        if name == 'LOOKUP':
+            return grouped.shift(-offset)
+        if name.startswith('RUNNING_'):
+            return getattr(grouped, TABLE_CALCULATIONS[name])()
+        return grouped.transform(TABLE_CALCULATIONS[name])
+
+
+def _default_dimensions(spec):
+    """Dimensions used when snapshotting a measure for regression testing."""
+    dims = []
+    source = spec.get('source_field', '') + spec.get('formula', '')
+    if 'portfolio' in source or 'kpi' in source or 'Portfolio' in source:
+        dims.append('Portfolio ID')
+    if spec.get('table_calculation'):
+        dims.append(spec.get('compute_using', 'Date'))
+    return dims
+
+
+def _summarize(result):
+    if isinstance(result, pd.Series):
+        numeric = pd.to_numeric(result, errors='coerce')
+        return {
+            'rows': int(len(result)),
+            'sum': None if numeric.isna().all() else round(float(numeric.sum()), 6),
+            'min': None if numeric.isna().all() else round(float(numeric.min()), 6),
+            'max': None if numeric.isna().all() else round(float(numeric.max()), 6),
+        }
+    if isinstance(result, (bool, np.bool_)):
+        return {'value': bool(result)}
+    numeric = pd.to_numeric(pd.Series([result]), errors='coerce').iloc[0]
+    return {'value': None if pd.isna(numeric) else round(float(numeric), 6)}
+
+
+def evaluate_all_measures(engine):
+    """
+    Evaluate every measure and KPI once at its default dimensions.
+
+    Returns:
+        dict of measure -> {'status', 'dimensions', 'ms', ...summary}
+    """
+    results = {}
+    for measure, spec in engine.model['measures'].items():
+        dims = _default_dimensions(spec)
+        start = time.perf_counter()
+        try:
+            summary = _summarize(engine.evaluate(measure, dims))
+            status = 'ok'
+        except UnsupportedFormula as e:
+            summary, status = {'error': str(e)}, 'unsupported'
+        except Exception as e:
+            summary, status = {'error': f"{type(e).__name__}: {e}"}, 'error'
+        results[measure] = {
+            'status': status,
+            'dimensions': dims,
+            'ms': round((time.perf_counter() - start) * 1000, 3),
+            **summary,
+        }
+    return results
+
+
+def compare_snapshots(previous, current, tolerance=1e-6):
+    """Return measures whose status or summary values changed between two snapshots."""
+    changed = []
+    for measure, result in current.items():
+        before = previous.get(measure)
+        if before is None:
+            continue
+        for field in ('status', 'rows', 'value', 'sum', 'min', 'max'):
+            old, new = before.get(field), result.get(field)
+            if isinstance(old, float) and isinstance(new, float):
+                if abs(old - new) > tolerance * max(1.0, abs(old)):
+                    changed.append(measure)
+                    break
+            elif old != new:
+                changed.append(measure)
+                break
+    return changed
+
+
+def main():
+    """Evaluate the semantic layer offline and compare with the last snapshot."""
+    print("\n" + "="*70)
+    print("CryptoRisk Analytics - Local Semantic Layer Evaluation")
+    print("="*70)
+    print(f"Config: {CONFIG_PATH}")
+    print(f"Data directory: {DATA_DIR}\n")
+
+    engine = SemanticEngine()
+    results = evaluate_all_measures(engine)
+
+    for measure, result in results.items():
+        icon = {'ok': '✓', 'unsupported': '⚠️ ', 'error': '❌'}[result['status']]
+        detail = result.get('error', '')
+        print(f"   {icon} {measure:<35} {result['ms']:>10.1f} ms  {detail[:60]}")
+
+    ok_count = sum(r['status'] == 'ok' for r in results.values())
+    print(f"\n📊 Evaluated {ok_count}/{len(results)} measures locally")
+
+    candidates = engine.precompute_candidates()
+    if candidates:
+        print(f"\n💡 Precompute candidates (≥ 50 ms uncached): {', '.join(candidates)}")
+
+    snapshot_path = DATA_DIR / SNAPSHOT_FILE
+    if snapshot_path.exists():
+        with open(snapshot_path) as f:
+            changed = compare_snapshots(json.load(f), results)
+        if changed:
+            print(f"\n⚠️  Changed since last snapshot: {', '.join(changed)}")
+        else:
+            print("\n✅ No changes since last snapshot")
+
+    with open(snapshot_path, 'w') as f:
+        json.dump(results, f, indent=2, default=str)
+    print(f"✓ Wrote {snapshot_path.name}")
+    print("\n" + "="*70)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+CryptoRisk Analytics - Sharded Synthetic Data Generator
+Reproducible synthetic prices, positions and trades at load-test scale, split
+into shards that run in a process pool and each write their own CSV partition.
+
+Every random draw comes from a numpy SeedSequence stream keyed by what is being
+generated, never from global state or Python's (per-process randomized) hash():
+    prices     one stream per symbol, keyed by the symbol's characters
+    portfolios one stream per shard of PORTFOLIOS_PER_SHARD portfolios
+Shard boundaries depend only on the dataset size, so the output files are
+byte-identical whatever the number of workers. A manifest.json lists every
+partition with its row count and SHA-256.
+
+Output layout:
+    {output_dir}/crypto_reference.csv
+    {output_dir}/prices/part-00000.csv ...
+    {output_dir}/positions/part-00000.csv ...
+    {output_dir}/trades/part-00000.csv ...
+    {output_dir}/manifest.json
+
+Usage:
+    generate_dataset('/data/loadtest', n_symbols=2000, n_days=4000, n_portfolios=100_000, workers=32)
+"""
+
+import hashlib
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Configuration
+DEFAULT_SEED = 20150101
+SYMBOLS_PER_SHARD = 50
+PORTFOLIOS_PER_SHARD = 100
+SNAPSHOT_DAYS = 365
+TRADES_PER_POSITION = 20
+
+PRICE_STREAM = 0
+PORTFOLIO_STREAM = 1
+
+RISK_TOLERANCES = ['Low', 'Medium', 'High']
+PORTFOLIO_NAMES = {'Low': 'Conservative', 'Medium': 'Balanced', 'High': 'Growth'}
+EXCHANGES = ['Coinbase', 'Binance', 'Kraken', 'FTX', 'Gemini', 'KuCoin']
+ORDER_TYPES = ['Market', 'Limit', 'Stop Loss', 'Take Profit']
+
+
+def price_model(symbol):
+    """(starting price, daily volatility, total log-trend) of the synthetic price model."""
+    if symbol == 'BTC':
+        base_price, volatility = 30000, 0.04
+    elif symbol == 'ETH':
+        base_price, volatility = 2000, 0.05
+    elif symbol in ['BNB', 'SOL']:
+        base_price, volatility = 150, 0.06
+    elif symbol in ['ADA', 'DOT', 'AVAX']:
+        base_price, volatility = 1.5, 0.07
+    elif symbol == 'DOGE':
+        base_price, volatility = 0.08, 0.10
+    else:
+        base_price, volatility = 10, 0.06
+    trend = 0.3 if symbol in ['ETH', 'SOL'] else 0.1
+    return base_price, volatility, trend
+
+
+def symbol_stream(symbol, seed=DEFAULT_SEED):
+    """Random generator for one symbol; identical in every process and independent of universe order."""
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(PRICE_STREAM, *symbol.encode())))
+
+
+def symbol_ohlcv(symbol, n_days, seed=DEFAULT_SEED):
+    """
+    Synthetic daily open/high/low/close/volume arrays for one symbol.
+
+    Log-normal random walk with drift plus a linear trend; open within ±2% of close,
+    high/low up to 3% beyond, log-normal volume.
+    """
+    rng = symbol_stream(symbol, seed)
+    base_price, volatility, trend = price_model(symbol)
+    returns = rng.normal(0.0005, volatility, n_days)
+    close = base_price * np.exp(np.cumsum(returns) + np.linspace(0, trend, n_days))
+    open_price = close * (1 + rng.uniform(-0.02, 0.02, n_days))
+    high = np.maximum(open_price, close) * (1 + rng.uniform(0, 0.03, n_days))
+    low = np.minimum(open_price, close) * (1 - rng.uniform(0, 0.03, n_days))
+    volume = rng.lognormal(18 if symbol in ['BTC', 'ETH'] else 16, 2, n_days)
+    return {'open': open_price, 'high': high, 'low': low, 'close': close, 'volume': volume}
+
+
+def build_universe(n_symbols, universe=None):
+    """
+    First n_symbols of the universe (default: CRYPTO_UNIVERSE), padded with SYN00001, SYN00002, ...
+    """
+    if universe is None:
+        from prepare_crypto_data import CRYPTO_UNIVERSE as universe
+    symbols = list(universe)[:n_symbols]
+    extra = [f'SYN{i:05d}' for i in range(1, n_symbols - len(symbols) + 1)]
+    result = {symbol: universe[symbol] for symbol in symbols}
+    for symbol in extra:
+        result[symbol] = {'name': f'Synthetic {symbol[3:]}', 'category': 'Other', 'launch_year': None}
+    return result
+
+
+def _write_partition(df, path):
+    """Write one CSV partition; returns its manifest entry."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    df.to_csv(path, index=False)
+    digest = hashlib.sha256(path.read_bytes()).hexdigest()
+    return {'file': f"{path.parent.name}/{path.name}", 'rows': len(df), 'sha256': digest}
+
+
+def generate_price_shard(shard, symbols, dates, output_dir, seed=DEFAULT_SEED):
+    """Generate and write the price partition for one shard of symbols."""
+    n_days = len(dates)
+    frames = []
+    for symbol in symbols:
+        ohlcv = symbol_ohlcv(symbol, n_days, seed)
+        frames.append(pd.DataFrame({
+            'date': dates,
+            'symbol': symbol,
+            'open': ohlcv['open'].round(8),
+            'high': ohlcv['high'].round(8),
+            'low': ohlcv['low'].round(8),
+            'close': ohlcv['close'].round(8),
+            'volume': ohlcv['volume'].round(2),
+        }))
+    df = pd.concat(frames, ignore_index=True)
+    df['daily_return'] = df.groupby('symbol', sort=False)['close'].pct_change()
+    return _write_partition(df, Path(output_dir) / 'prices' / f'part-{shard:05d}.csv')
+
+
+def generate_portfolio_shard(shard, first_portfolio, n_portfolios, symbols, dates, output_dir,
+                             seed=DEFAULT_SEED, trades_per_position=TRADES_PER_POSITION):
+    """
+    Generate and write the positions and trades partitions for one shard of portfolios.
+
+    Closes of the held symbols are regenerated from their own symbol streams, so a
+    portfolio shard never needs to read the price partitions.
+    """
+    rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(PORTFOLIO_STREAM, shard)))
+    n_days = len(dates)
+    snapshot_start = max(0, n_days - SNAPSHOT_DAYS)
+    snapshot_dates = dates[snapshot_start:]
+    closes = {}
+
+    position_frames, trade_frames = [], []
+    for number in range(first_portfolio, first_portfolio + n_portfolios):
+        portfolio_id = f'PF{number + 1:03d}'
+        risk_tolerance = RISK_TOLERANCES[number % len(RISK_TOLERANCES)]
+        portfolio_name = f'{PORTFOLIO_NAMES[risk_tolerance]} {number + 1}'
+        held = rng.choice(symbols, size=min(len(symbols), int(rng.integers(4, 9))), replace=False)
+        weights = rng.dirichlet(np.ones(len(held))).round(4)
+        total_value = rng.uniform(1e5, 5e5)
+
+        for symbol in held:
+            if symbol not in closes:
+                closes[symbol] = symbol_ohlcv(symbol, n_days, seed)['close']
+        close = np.column_stack([closes[symbol] for symbol in held])
+        snapshot_close = close[snapshot_start:]
+        position_value = total_value * weights * rng.uniform(0.95, 1.05, size=snapshot_close.shape)
+        avg_cost = snapshot_close * rng.uniform(0.8, 1.2, size=snapshot_close.shape)
+        quantity = position_value / snapshot_close
+        position_frames.append(pd.DataFrame({
+            'portfolio_id': portfolio_id,
+            'portfolio_name': portfolio_name,
+            'risk_tolerance': risk_tolerance,
+            'symbol': np.tile(held, len(snapshot_dates)),
+            'quantity': quantity.ravel().round(8),
+            'avg_cost': avg_cost.ravel().round(8),
+            'current_price': snapshot_close.ravel().round(8),
+            'position_value': position_value.ravel().round(2),
+            'target_weight': np.tile(weights, len(snapshot_dates)),
+            'unrealized_pnl': ((snapshot_close - avg_cost) * quantity).ravel().round(2),
+            'unrealized_pnl_pct': ((snapshot_close / avg_cost - 1) * 100).ravel().round(4),
+            'as_of_date': np.repeat(snapshot_dates, len(held)),
+        }))
+
+        n_trades = len(held) * trades_per_position
+        holding = np.repeat(np.arange(len(held)), trades_per_position)
+        day = rng.integers(0, n_days, n_trades)
+        trade_quantity = quantity[-1][holding] * rng.uniform(0.05, 0.3, n_trades)
+        trade_price = close[day, holding] * rng.uniform(0.95, 1.05, n_trades)
+        trade_amount = trade_quantity * trade_price
+        trade_frames.append(pd.DataFrame({
+            'trade_id': [f'{portfolio_id}-{i:08d}' for i in range(1, n_trades + 1)],
+            'trade_date': dates[day],
+            'portfolio_id': portfolio_id,
+            'portfolio_name': portfolio_name,
+            'symbol': held[holding],
+            'trade_type': np.where(rng.random(n_trades) < 0.2, 'SELL', 'BUY'),
+            'quantity': trade_quantity.round(8),
+            'price': trade_price.round(8),
+            'trade_amount': trade_amount.round(2),
+            'fee': (trade_amount * 0.001).round(2),
+            'exchange': np.array(EXCHANGES)[rng.integers(0, len(EXCHANGES), n_trades)],
+            'order_type': np.array(ORDER_TYPES)[rng.integers(0, len(ORDER_TYPES), n_trades)],
+        }).sort_values(['trade_date', 'trade_id'], kind='stable'))
+
+    output_dir = Path(output_dir)
+    return [_write_partition(pd.concat(position_frames, ignore_index=True),
+                             output_dir / 'positions' / f'part-{shard:05d}.csv'),
+            _write_partition(pd.concat(trade_frames, ignore_index=True),
+                             output_dir / 'trades' / f'part-{shard:05d}.csv')]
+
+
+def _run_job(job):
+    """Worker entry point: run one shard job (function name, kwargs)."""
+    kind, kwargs = job
+    if kind == 'prices':
+        return [generate_price_shard(**kwargs)]
+    return generate_portfolio_shard(**kwargs)
+
+
+def generate_dataset(output_dir, n_symbols=None, n_days=None, n_portfolios=3, start_date='2015-01-01',
+                     seed=DEFAULT_SEED, workers=1, universe=None, trades_per_position=TRADES_PER_POSITION,
+                     symbols_per_shard=SYMBOLS_PER_SHARD, portfolios_per_shard=PORTFOLIOS_PER_SHARD):
+    """
+    Generate a sharded synthetic dataset.
+
+    Args:
+        output_dir: Directory for the partitions and manifest
+        n_symbols: Universe size (default: the whole universe); padded with SYN symbols
+        n_days: Number of daily prices (default: start_date to today)
+        n_portfolios: Number of portfolios
+        start_date: First price date
+        seed: Root seed; the same seed and sizes always give the same bytes
+        workers: Processes in the pool (does not affect the output)
+        universe: dict in CRYPTO_UNIVERSE format (default: CRYPTO_UNIVERSE)
+
+    Returns:
+        The manifest dict (also written to manifest.json)
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    universe = build_universe(n_symbols if n_symbols is not None else 10 ** 9, universe)
+    symbols = np.array(list(universe))
+    if n_days is None:
+        dates = pd.date_range(start=start_date, end=pd.Timestamp.now().normalize(), freq='D')
+    else:
+        dates = pd.date_range(start=start_date, periods=n_days, freq='D')
+    date_strings = dates.strftime('%Y-%m-%d').to_numpy()
+
+    reference = pd.DataFrame([{
+        'symbol': symbol, 'name': info['name'], 'category': info['category'],
+        'launch_year': info.get('launch_year'), 'is_stablecoin': False, 'is_active': True,
+    } for symbol, info in universe.items()])
+    reference.to_csv(output_dir / 'crypto_reference.csv', index=False)
+
+    jobs = []
+    for shard, first in enumerate(range(0, len(symbols), symbols_per_shard)):
+        jobs.append(('prices', {'shard': shard, 'symbols': symbols[first:first + symbols_per_shard].tolist(),
+                                'dates': date_strings, 'output_dir': output_dir, 'seed': seed}))
+    for shard, first in enumerate(range(0, n_portfolios, portfolios_per_shard)):
+        jobs.append(('portfolios', {'shard': shard, 'first_portfolio': first,
+                                    'n_portfolios': min(portfolios_per_shard, n_portfolios - first),
+                                    'symbols': symbols, 'dates': date_strings, 'output_dir': output_dir,
+                                    'seed': seed, 'trades_per_position': trades_per_position}))
+
+    print(f"\n=== Generating Sharded Synthetic Dataset ({len(jobs)} shards, {workers} workers) ===")
+    if workers <= 1:
+        results = [_run_job(job) for job in jobs]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_run_job, jobs))
+
+    partitions = sorted((entry for result in results for entry in result), key=lambda e: e['file'])
+    manifest = {
+        'seed': seed,
+        'symbols': len(symbols),
+        'days': len(dates),
+        'portfolios': n_portfolios,
+        'trades_per_position': trades_per_position,
+        'start_date': date_strings[0] if len(dates) else start_date,
+        'partitions': partitions,
+    }
+    with open(output_dir / 'manifest.json', 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    for kind in ('prices', 'positions', 'trades'):
+        rows = sum(p['rows'] for p in partitions if p['file'].startswith(kind))
+        print(f"✓ {kind}: {rows:,} rows in {sum(p['file'].startswith(kind) for p in partitions)} partitions")
+    print(f"✓ Manifest written to {output_dir / 'manifest.json'}")
+    return manifest
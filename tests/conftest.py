@@ -0,0 +1,68 @@
+"""
+Shared fixtures for the automated checks of the pipeline modules in scripts/.
+
+Run from the repository root:
+    python -m pytest -q tests
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+
+from synthetic_generator import symbol_ohlcv  # noqa: E402
+
+SYMBOLS = ['BTC', 'ETH', 'SOL', 'ADA', 'DOGE', 'LINK']
+N_DAYS = 400
+
+
+def make_prices(symbols=SYMBOLS, n_days=N_DAYS, start='2023-01-01', late_listing=None, seed=7):
+    """
+    Long prices frame (date, symbol, close, volume, daily_return) from the synthetic price model.
+
+    late_listing maps a symbol to the number of leading days it has no rows, like a coin
+    that listed after the others.
+    """
+    dates = pd.date_range(start, periods=n_days, freq='D')
+    frames = []
+    for symbol in symbols:
+        ohlcv = symbol_ohlcv(symbol, n_days, seed)
+        skip = (late_listing or {}).get(symbol, 0)
+        frames.append(pd.DataFrame({'date': dates[skip:], 'symbol': symbol,
+                                    'close': ohlcv['close'][skip:], 'volume': ohlcv['volume'][skip:]}))
+    df = pd.concat(frames, ignore_index=True)
+    df['daily_return'] = df.groupby('symbol')['close'].pct_change()
+    return df
+
+
+def make_trades(n_trades=3000, portfolios=3, symbols=SYMBOLS[:4], start='2023-01-01', n_days=N_DAYS, seed=11):
+    """Random BUY/SELL trades with the pipeline's trade schema (SELLs may exceed the holding)."""
+    rng = np.random.default_rng(seed)
+    portfolio = rng.integers(1, portfolios + 1, n_trades)
+    quantity = np.round(rng.exponential(2.0, n_trades), 4)
+    price = np.round(rng.uniform(1, 500, n_trades), 4)
+    return pd.DataFrame({
+        'trade_id': [f'TRD{i:08d}' for i in range(1, n_trades + 1)],
+        'trade_date': pd.Timestamp(start) + pd.to_timedelta(rng.integers(0, n_days, n_trades), unit='D'),
+        'portfolio_id': [f'PF{p:03d}' for p in portfolio],
+        'portfolio_name': [f'Portfolio {p}' for p in portfolio],
+        'symbol': rng.choice(symbols, n_trades),
+        'trade_type': np.where(rng.random(n_trades) < 0.4, 'SELL', 'BUY'),
+        'quantity': quantity,
+        'price': price,
+        'fee': np.round(quantity * price * 0.001, 2),
+    })
+
+
+@pytest.fixture
+def prices():
+    return make_prices()
+
+
+@pytest.fixture
+def trades():
+    return make_trades()
@@ -0,0 +1,82 @@
+"""Checks for scripts/covariance_engine.py: resume, incremental updates and pairwise moments."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import make_prices
+from covariance_engine import CovarianceEngine, pairwise_moments, returns_matrix
+
+
+def assert_same_engine(a, b):
+    assert a.symbols == b.symbols
+    assert a.dates == b.dates
+    for method in ('ewma', 'sample', 'ledoit_wolf'):
+        np.testing.assert_allclose(a.covariance(method=method).to_numpy(), b.covariance(method=method).to_numpy(),
+                                   rtol=1e-10, atol=1e-14, equal_nan=True)
+    midpoint = a.dates[len(a.dates) // 2]
+    np.testing.assert_allclose(a.covariance(midpoint).to_numpy(), b.covariance(midpoint).to_numpy(),
+                               rtol=1e-10, atol=1e-14, equal_nan=True)
+
+
+def test_resume_from_state_on_appended_days_equals_fresh_build(tmp_path):
+    prices = make_prices()
+    state = tmp_path / 'covariance_state.npz'
+    CovarianceEngine.from_prices(prices[prices['date'] < '2023-11-01'], state_path=state).save(state)
+
+    assert_same_engine(CovarianceEngine.from_prices(prices, state_path=state), CovarianceEngine.from_prices(prices))
+
+
+def test_resume_on_revised_prices_equals_fresh_build(tmp_path):
+    prices = make_prices()
+    state = tmp_path / 'covariance_state.npz'
+    CovarianceEngine.from_prices(prices, state_path=state).save(state)
+
+    revised = prices.copy()
+    revised.loc[revised['symbol'] == 'BTC', 'daily_return'] *= 10
+    resumed = CovarianceEngine.from_prices(revised, state_path=state)
+    assert_same_engine(resumed, CovarianceEngine.from_prices(revised))
+    assert resumed.covariance().loc['BTC', 'BTC'] > 50 * CovarianceEngine.from_prices(prices).covariance().loc['BTC', 'BTC']
+
+
+def test_incremental_updates_equal_full_build():
+    prices = make_prices(late_listing={'SOL': 120})
+    returns = returns_matrix(prices)
+    full = CovarianceEngine(returns.columns)
+    full.extend(returns)
+
+    incremental = CovarianceEngine(returns.columns)
+    incremental.extend(returns.iloc[:150])
+    for date, row in returns.iloc[150:].iterrows():
+        incremental.update(date, row)
+    assert_same_engine(incremental, full)
+
+
+def test_iter_covariances_matches_point_lookups_and_accepts_early_start():
+    engine = CovarianceEngine.from_prices(make_prices(n_days=120))
+    swept = list(engine.iter_covariances(start=pd.Timestamp('2020-01-01')))
+    assert [date for date, _ in swept] == engine.dates
+    for date, cov in swept[::17]:
+        np.testing.assert_allclose(cov, engine.covariance(date).to_numpy(), rtol=1e-12, equal_nan=True)
+
+
+def test_pairwise_moments_match_pandas():
+    rng = np.random.default_rng(3)
+    returns = pd.DataFrame(rng.normal(0, 0.03, (300, 5)), columns=list('ABCDE'))
+    returns.iloc[:120, 1] = np.nan                        # late listing
+    returns.iloc[rng.random(300) < 0.1, 2] = np.nan       # scattered gaps
+    returns.iloc[:295, 4] = np.nan                        # too short for min_periods
+
+    pair_count, covariance, correlation = pairwise_moments(returns.to_numpy(), min_periods=10)
+    valid = returns.notna().astype(int)
+    np.testing.assert_array_equal(pair_count, (valid.T @ valid).to_numpy())
+    np.testing.assert_allclose(correlation, returns.corr(min_periods=10).to_numpy(), rtol=1e-10, equal_nan=True)
+    # pandas normalizes by n - 1, pairwise_moments by the pair count n
+    expected_cov = returns.cov(min_periods=10).to_numpy() * (pair_count - 1) / pair_count
+    np.testing.assert_allclose(covariance, expected_cov, rtol=1e-10, equal_nan=True)
+
+
+def test_unknown_method_is_rejected():
+    engine = CovarianceEngine.from_prices(make_prices(n_days=40))
+    with pytest.raises(ValueError):
+        engine.covariance(method='garch')
@@ -0,0 +1,51 @@
+"""Checks for scripts/garch.py: parameter recovery, batched fits and variance forecasts."""
+
+import numpy as np
+import pandas as pd
+
+from garch import fit_garch, fit_garch_frame, forecast_variance
+
+
+def simulate_garch(n, alpha, beta, long_run_variance, rng):
+    omega = long_run_variance * (1 - alpha - beta)
+    returns = np.empty(n)
+    variance = long_run_variance
+    for t in range(n):
+        returns[t] = np.sqrt(variance) * rng.standard_normal()
+        variance = omega + alpha * returns[t] ** 2 + beta * variance
+    return returns
+
+
+def test_fit_recovers_simulated_parameters():
+    rng = np.random.default_rng(8)
+    returns = np.column_stack([simulate_garch(5000, 0.08, 0.90, 0.0004, rng),
+                               simulate_garch(5000, 0.15, 0.80, 0.0009, rng)])
+    fit = fit_garch(returns)
+    assert fit['converged'].all()
+    np.testing.assert_allclose(fit['alpha'], [0.08, 0.15], atol=0.03)
+    np.testing.assert_allclose(fit['beta'], [0.90, 0.80], atol=0.05)
+
+
+def test_batched_fit_equals_single_series_fits():
+    rng = np.random.default_rng(9)
+    returns = np.column_stack([simulate_garch(800, 0.1, 0.85, 0.0004, rng) for _ in range(3)])
+    returns[:300, 1] = np.nan          # listed later
+    batched = fit_garch(returns)
+    for column in range(returns.shape[1]):
+        single = fit_garch(returns[:, [column]])
+        for name in ('alpha', 'beta', 'next_variance', 'log_likelihood'):
+            np.testing.assert_allclose(batched[name][column], single[name][0], rtol=1e-9, err_msg=name)
+
+
+def test_forecast_reverts_to_long_run_variance():
+    rng = np.random.default_rng(10)
+    fit = fit_garch(simulate_garch(2000, 0.1, 0.85, 0.0004, rng)[:, None])
+    path = forecast_variance(fit, horizon=2000)[0]
+    np.testing.assert_allclose(path[0], fit['next_variance'][0])
+    np.testing.assert_allclose(path[-1], fit['long_run_variance'][0], rtol=1e-6)
+
+
+def test_short_series_are_not_fitted():
+    rng = np.random.default_rng(12)
+    frame = fit_garch_frame(pd.DataFrame({'A': rng.normal(0, 0.02, 100)}), workers=1)
+    assert np.isnan(frame.loc['A', 'alpha']) and not frame.loc['A', 'converged']
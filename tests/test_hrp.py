@@ -0,0 +1,58 @@
+"""Checks for scripts/hrp.py: single linkage, correlation clusters and HRP weights."""
+
+import numpy as np
+import pandas as pd
+
+from hrp import correlation_distance, cut_clusters, hrp_allocation, quasi_diagonal_order, single_linkage
+
+
+def test_single_linkage_heights_are_minimum_spanning_tree_edges():
+    rng = np.random.default_rng(13)
+    points = rng.normal(size=(12, 3))
+    distance = np.sqrt(((points[:, None] - points[None]) ** 2).sum(axis=2))
+
+    # Kruskal over all pairs as the reference
+    pairs = sorted((distance[i, j], i, j) for i in range(12) for j in range(i + 1, 12))
+    group = list(range(12))
+    heights = []
+    for d, i, j in pairs:
+        gi, gj = group[i], group[j]
+        if gi != gj:
+            heights.append(d)
+            group = [gi if g == gj else g for g in group]
+    linkage = single_linkage(distance)
+    np.testing.assert_allclose(linkage[:, 2], heights)
+    assert linkage[-1, 3] == 12
+
+
+def test_clusters_follow_correlation_blocks():
+    corr = np.full((6, 6), 0.1)
+    corr[:3, :3] = corr[3:, 3:] = 0.9
+    np.fill_diagonal(corr, 1.0)
+    linkage = single_linkage(correlation_distance(corr))
+    labels = cut_clusters(linkage, 2)
+    assert len(set(labels[:3])) == 1 and len(set(labels[3:])) == 1 and labels[0] != labels[3]
+    order = quasi_diagonal_order(linkage)
+    assert set(order[:3]) in ({0, 1, 2}, {3, 4, 5})
+
+
+def test_hrp_equals_inverse_variance_for_uncorrelated_assets():
+    variance = np.array([0.04, 0.01, 0.09, 0.0025, 0.02])
+    symbols = ['BTC', 'ETH', 'SOL', 'ADA', 'DOGE']
+    cov = pd.DataFrame(np.diag(variance), index=symbols, columns=symbols)
+    allocation = hrp_allocation(cov, n_clusters=2)
+    np.testing.assert_allclose(allocation['hrp_weight'].astype(float), (1 / variance) / (1 / variance).sum())
+    np.testing.assert_allclose(allocation['hrp_weight'].astype(float), allocation['ivp_weight'].astype(float))
+
+
+def test_hrp_weights_are_a_long_only_allocation():
+    rng = np.random.default_rng(14)
+    factors = rng.normal(size=(500, 3))
+    returns = factors @ rng.normal(size=(3, 15)) * 0.01 + rng.normal(size=(500, 15)) * 0.01
+    symbols = [f'S{i}' for i in range(15)]
+    frame = pd.DataFrame(returns, columns=symbols)
+    allocation = hrp_allocation(frame.cov(), frame.corr())
+    weights = allocation['hrp_weight'].astype(float)
+    assert (weights > 0).all()
+    np.testing.assert_allclose(weights.sum(), 1.0)
+    assert sorted(allocation['dendrogram_order']) == list(range(15))
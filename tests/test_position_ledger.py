@@ -0,0 +1,94 @@
+"""Checks for scripts/position_ledger.py: positions reconcile with trades, incremental equals rebuild."""
+
+import numpy as np
+import pandas as pd
+
+from conftest import make_prices, make_trades
+from position_ledger import PositionLedger, trades_fingerprint
+
+
+def signed_totals(trades):
+    signed = np.where(trades['trade_type'] == 'SELL', -1.0, 1.0) * trades['quantity']
+    return signed.groupby([trades['portfolio_id'], trades['symbol']]).sum()
+
+
+def test_final_quantity_is_net_of_all_trades(prices, trades):
+    positions = PositionLedger.from_trades(trades, prices).positions
+    last = positions.groupby(['portfolio_id', 'symbol']).tail(1).set_index(['portfolio_id', 'symbol'])
+    pd.testing.assert_series_equal(last['quantity'], signed_totals(trades).reindex(last.index),
+                                   check_names=False, atol=1e-9)
+    assert (positions['is_short'] == (positions['quantity'] < 0)).all()
+    np.testing.assert_allclose(positions['position_value'], positions['quantity'] * positions['current_price'])
+
+
+def test_every_key_is_dense_over_price_dates(prices, trades):
+    positions = PositionLedger.from_trades(trades, prices).positions
+    last_date = prices['date'].max()
+    spans = positions.groupby(['portfolio_id', 'symbol'])['as_of_date'].agg(['min', 'max', 'size'])
+    assert (spans['max'] == last_date).all()
+    assert ((spans['max'] - spans['min']).dt.days + 1 == spans['size']).all()
+
+
+def test_incremental_update_equals_rebuild():
+    prices = make_prices()
+    trades = make_trades()
+    cutoff = pd.Timestamp('2023-10-01')
+
+    ledger = PositionLedger.from_trades(trades[trades['trade_date'] < cutoff], prices[prices['date'] < cutoff])
+    ledger.extend(prices)
+    ledger.update(trades[trades['trade_date'] >= cutoff], prices)
+
+    pd.testing.assert_frame_equal(ledger.positions, PositionLedger.from_trades(trades, prices).positions,
+                                  check_exact=False, atol=1e-9)
+
+
+def test_resume_from_saved_state_equals_rebuild(tmp_path):
+    prices = make_prices()
+    trades = make_trades()
+    cutoff = pd.Timestamp('2023-10-01')
+    state = tmp_path / 'position_ledger_state.npz'
+    PositionLedger.from_trades(trades[trades['trade_date'] < cutoff], prices[prices['date'] < cutoff]).save(state)
+
+    resumed = PositionLedger.from_trades(trades, prices, state_path=state)
+    pd.testing.assert_frame_equal(resumed.positions, PositionLedger.from_trades(trades, prices).positions,
+                                  check_exact=False, atol=1e-9)
+
+
+def test_revised_history_forces_rebuild(tmp_path):
+    prices = make_prices()
+    trades = make_trades()
+    state = tmp_path / 'position_ledger_state.npz'
+    PositionLedger.from_trades(trades, prices).save(state)
+
+    revised = trades.copy()
+    revised.loc[revised.index[:10], 'quantity'] *= 3
+    resumed = PositionLedger.from_trades(revised, prices, state_path=state)
+    pd.testing.assert_frame_equal(resumed.positions, PositionLedger.from_trades(revised, prices).positions,
+                                  check_exact=False, atol=1e-9)
+
+
+def test_day_by_day_refresh_equals_rebuild_and_only_rewrites_new_cells():
+    prices = make_prices(late_listing={'SOL': 90})
+    trades = make_trades(symbols=['BTC', 'ETH', 'SOL', 'XRP'])
+    dates = np.sort(prices['date'].unique())
+    ledger = PositionLedger.from_trades(trades[trades['trade_date'] <= dates[360]], prices[prices['date'] <= dates[360]])
+    for date in dates[361:]:
+        ledger.extend(prices[prices['date'] <= date])
+        todays = trades[trades['trade_date'] == date]
+        rewritten = ledger.update(todays, prices[prices['date'] <= date])
+        assert rewritten == todays.groupby(['portfolio_id', 'symbol']).ngroups
+
+    pd.testing.assert_frame_equal(ledger.positions, PositionLedger.from_trades(trades, prices).positions,
+                                  check_exact=False, atol=1e-9)
+
+
+def test_fingerprint_ignores_row_order_but_sees_moved_trades():
+    trades = make_trades()
+    assert trades_fingerprint(trades.sample(frac=1, random_state=0)) == trades_fingerprint(trades)
+
+    later = trades.copy()
+    later.loc[later.index[0], 'trade_date'] += pd.Timedelta(days=1)
+    other_portfolio = trades.copy()
+    other_portfolio.loc[other_portfolio.index[0], 'portfolio_id'] = 'PF999'
+    assert trades_fingerprint(later) != trades_fingerprint(trades)
+    assert trades_fingerprint(other_portfolio) != trades_fingerprint(trades)
@@ -0,0 +1,49 @@
+"""Checks for scripts/risk_bootstrap.py: count-based resample statistics and block structure."""
+
+import numpy as np
+import pandas as pd
+
+from risk_bootstrap import (ANNUALIZATION, RISK_FREE_RATE, block_bootstrap_indices, bootstrap_intervals,
+                            resample_counts, risk_statistics)
+
+
+def direct_statistics(returns):
+    """Risk metrics of one sample the way calculate_portfolio_risk_metrics computes them."""
+    rf_daily = RISK_FREE_RATE / ANNUALIZATION
+    std = returns.std(axis=0, ddof=1)
+    downside = [np.std(column[column < 0], ddof=1) for column in returns.T]
+    return {'volatility': std * np.sqrt(ANNUALIZATION),
+            'sharpe_ratio': (returns.mean(axis=0) - rf_daily) / std * np.sqrt(ANNUALIZATION),
+            'sortino_ratio': (returns.mean(axis=0) - rf_daily) / np.array(downside) * np.sqrt(ANNUALIZATION),
+            'var_95_pct': np.percentile(returns, 5, axis=0) * 100,
+            'var_99_pct': np.percentile(returns, 1, axis=0) * 100}
+
+
+def test_count_based_statistics_match_gathered_resamples():
+    rng = np.random.default_rng(5)
+    returns = rng.standard_t(4, size=(250, 3)) * 0.02
+    indices = block_bootstrap_indices(len(returns), n_resamples=8, block_size=7, seed=1)
+    counts = resample_counts(indices, len(returns))
+    assert (counts.sum(axis=1) == len(returns)).all()
+
+    statistics = risk_statistics(returns, counts)
+    for r in range(len(indices)):
+        expected = direct_statistics(returns[indices[r]])
+        for metric, values in expected.items():
+            np.testing.assert_allclose(statistics[metric][r], values, rtol=1e-9, err_msg=metric)
+
+
+def test_blocks_are_consecutive_days():
+    indices = block_bootstrap_indices(100, n_resamples=20, block_size=7, seed=2)
+    steps = np.diff(indices.reshape(20, -1)[:, :98].reshape(20, 14, 7), axis=2) % 100
+    assert (steps == 1).all()
+
+
+def test_intervals_bracket_point_estimates():
+    rng = np.random.default_rng(6)
+    returns = pd.DataFrame(rng.normal(0.001, 0.03, size=(365, 4)), columns=['PF001', 'PF002', 'PF003', 'PF004'])
+    intervals = bootstrap_intervals(returns, n_resamples=500, workers=1)
+    for metric in ('volatility', 'sharpe_ratio', 'var_95_pct'):
+        assert (intervals[f'{metric}_ci_lower'] <= intervals[metric]).all()
+        assert (intervals[metric] <= intervals[f'{metric}_ci_upper']).all()
+    np.testing.assert_allclose(intervals['volatility'], direct_statistics(returns.to_numpy())['volatility'])